@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+sync_mcp.py 常駐模式的 Unix socket RPC
+
+- 伺服端：python sync_mcp.py --daemon
+  常駐保留已載入的環境變數、Claude CLI 清單、部署紀錄與 agent 索引
+- 用戶端：python sync_daemon.py {sync,status,diff,stop}
+  只使用標準函式庫，啟動快速，適合 git hook 或編輯器工作呼叫
+- 協定：每個連線一個請求，各以一行 JSON 表示
+  請求 {"command": ..., "args": {...}}；回應 {"ok": ..., "output": ..., "exit": ...}
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import socket
+import sys
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+SOCKET_NAME = "daemon.sock"
+# 用戶端等待回應的秒數（同步可能需要呼叫 Claude CLI）
+CLIENT_TIMEOUT = 600
+COMMANDS = ("sync", "status", "diff", "ping", "stop")
+PHASES = ("mcp", "rules", "workflows")
+
+
+def socket_path() -> Path:
+    """常駐程序的 socket 路徑（與 sync_io.cache_dir 相同的目錄）。"""
+    base = os.environ.get("XDG_CACHE_HOME") or str(Path.home() / ".cache")
+    return Path(base) / "mcp_rule_config" / SOCKET_NAME
+
+
+def _recv_json(conn: socket.socket) -> dict:
+    chunks: List[bytes] = []
+    while True:
+        chunk = conn.recv(1 << 16)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        if chunk.endswith(b"\n"):
+            break
+    data = json.loads(b"".join(chunks) or b"{}")
+    return data if isinstance(data, dict) else {}
+
+
+def _send_json(conn: socket.socket, data: dict) -> None:
+    conn.sendall(json.dumps(data, ensure_ascii=False).encode("utf-8") + b"\n")
+
+
+def call(command: str, args: Optional[dict] = None, path: Optional[Path] = None,
+         timeout: float = CLIENT_TIMEOUT) -> dict:
+    """向常駐程序送出一個請求並回傳回應；常駐程序未啟動時拋出 OSError。"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+        conn.settimeout(timeout)
+        conn.connect(str(path or socket_path()))
+        _send_json(conn, {"command": command, "args": args or {}})
+        conn.shutdown(socket.SHUT_WR)
+        return _recv_json(conn)
+
+
+def is_running(path: Optional[Path] = None) -> bool:
+    try:
+        return bool(call("ping", path=path, timeout=2).get("ok"))
+    except (OSError, ValueError):
+        return False
+
+
+def serve(handlers: Dict[str, Callable[[dict], Optional[int]]], path: Optional[Path] = None) -> None:
+    """在 Unix socket 上依序處理請求，直到收到 stop。
+
+    每個請求的標準輸出會被收集後隨回應一併傳回；請求依序處理，不會有兩次同步同時進行。
+    socket 只有擁有者可存取 (0600，所在目錄 0700)。
+    """
+    path = path or socket_path()
+    path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+    if is_running(path):
+        raise RuntimeError(f"常駐程序已在執行: {path}")
+    with contextlib.suppress(FileNotFoundError):
+        path.unlink()
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    old_umask = os.umask(0o177)
+    try:
+        server.bind(str(path))
+    finally:
+        os.umask(old_umask)
+    server.listen(8)
+
+    try:
+        while True:
+            conn, _ = server.accept()
+            with conn:
+                try:
+                    request = _recv_json(conn)
+                except (OSError, ValueError):
+                    continue
+                command = request.get("command")
+                if command == "ping":
+                    _send_json(conn, {"ok": True, "output": "", "exit": 0})
+                    continue
+                if command == "stop":
+                    _send_json(conn, {"ok": True, "output": "👋 常駐程序已結束\n", "exit": 0})
+                    break
+
+                handler = handlers.get(command)
+                output = io.StringIO()
+                if handler is None:
+                    response = {"ok": False, "output": f"✗ 不支援的指令: {command}\n", "exit": 1}
+                else:
+                    try:
+                        with contextlib.redirect_stdout(output):
+                            code = handler(request.get("args") or {})
+                        response = {"ok": True, "output": output.getvalue(), "exit": code or 0}
+                    except SystemExit as e:
+                        code = e.code if isinstance(e.code, int) else 1
+                        response = {"ok": code == 0, "output": output.getvalue(), "exit": code}
+                    except Exception as e:
+                        response = {"ok": False, "output": output.getvalue() + f"✗ {e}\n", "exit": 1}
+                try:
+                    _send_json(conn, response)
+                except OSError:
+                    pass
+    finally:
+        server.close()
+        with contextlib.suppress(FileNotFoundError):
+            path.unlink()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description='⚡ MCP 配置同步常駐程序的用戶端',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+範例:
+  # 先啟動常駐程序
+  python sync_mcp.py --daemon &
+
+  # 同步全部 / 只同步 workflows 中變動的檔案
+  python sync_daemon.py sync
+  python sync_daemon.py sync --phase workflows --files workflows/code-review-agent.md
+
+  # 檢視部署狀態、預覽會變更的目標、結束常駐程序
+  python sync_daemon.py status
+  python sync_daemon.py diff
+  python sync_daemon.py stop
+        """
+    )
+    parser.add_argument('command', choices=COMMANDS, help='要執行的指令')
+    parser.add_argument(
+        '--phase',
+        action='append',
+        choices=PHASES,
+        help='sync 只執行指定的部分（可重複指定，預設全部）'
+    )
+    parser.add_argument(
+        '--files',
+        nargs='+',
+        type=Path,
+        metavar='FILE',
+        help='sync 只處理這些 workflow 來源檔'
+    )
+    args = parser.parse_args()
+
+    request: dict = {}
+    if args.phase:
+        request["phases"] = args.phase
+    if args.files:
+        request["files"] = [str(f.resolve()) for f in args.files]
+
+    try:
+        response = call(args.command, request)
+    except OSError:
+        print("✗ 常駐程序未啟動，請先執行: python sync_mcp.py --daemon", file=sys.stderr)
+        return 2
+    except ValueError as e:
+        print(f"✗ 無法解析常駐程序的回應: {e}", file=sys.stderr)
+        return 1
+
+    sys.stdout.write(response.get("output", ""))
+    return int(response.get("exit", 0 if response.get("ok") else 1))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
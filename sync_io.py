@@ -0,0 +1,856 @@
+"""
+sync_mcp.py 與 sync_workflows.py 共用的檔案 I/O 工具
+- 快取目錄與私有 JSON 檔讀寫
+- 原子寫入、內容比對（大小 → 快取的雜湊；未變動的檔案不需讀取內容）
+- 並行執行各目標的比對/寫入（結果依輸入順序回傳，單一目標失敗不影響其他目標）
+- 部署方式：複製（核心內 reflink / copy_file_range）、hardlink、symlink
+- 部署紀錄 (manifest)：以 stat 判斷目標自上次部署後是否變動
+- 內容定址物件庫與部署世代：可直接切換回任一次部署的結果
+"""
+import atexit
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, TypeVar
+
+from sync_timing import add_bytes, bind, count
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+# 同時進行檔案比對/寫入的工作執行緒數量（網路檔案系統上延遲較高，並行可有效縮短時間）
+DEFAULT_IO_WORKERS = 8
+IO_WORKERS = DEFAULT_IO_WORKERS
+
+# 超過此大小的檔案以 mmap 計算雜湊，避免大量小區塊讀取
+MMAP_THRESHOLD = 1 << 20
+# 雜湊快取 (路徑, 大小, mtime_ns) → sha256；超過保留天數未使用的項目在存檔時移除
+DIGEST_CACHE_FILE = "digests.json"
+DIGEST_CACHE_MAX_AGE = 30 * 24 * 60 * 60
+# mtime 距今少於此秒數的檔案不寫入快取（同一時間刻度內可能再被修改而 mtime 不變）
+DIGEST_RACY_WINDOW = 2
+
+# 部署檔案的方式：copy 複製內容（先嘗試以 FICLONE 共用資料區塊，寫入時才複製；
+# 不支援時由核心以 copy_file_range 完成）；hardlink / symlink 讓目標直接指向來源；
+# reflink 與 copy 相同，保留作為明確指定共用資料區塊的名稱
+LINK_MODES = ("copy", "hardlink", "symlink", "reflink")
+LINK_MODE = "copy"
+# Linux ioctl FICLONE（btrfs、XFS、bcachefs 等支援）
+FICLONE = 0x40049409
+
+
+def set_link_mode(mode: str) -> None:
+    """設定 deploy_file / place_file 預設使用的部署方式。"""
+    global LINK_MODE
+    if mode not in LINK_MODES:
+        raise ValueError(f"不支援的部署方式: {mode}")
+    LINK_MODE = mode
+
+
+def get_link_mode() -> str:
+    return LINK_MODE
+
+
+def set_io_workers(workers: int) -> None:
+    """設定 map_isolated 預設使用的工作執行緒數量（最少 1）。"""
+    global IO_WORKERS
+    IO_WORKERS = max(1, workers)
+
+
+def map_isolated(
+    func: Callable[[T], R],
+    items: Iterable[T],
+    workers: Optional[int] = None,
+) -> List[Tuple[Optional[R], Optional[BaseException]]]:
+    """並行對每個項目執行 func，依輸入順序回傳 (結果, 例外)。
+
+    每個項目的例外會被捕捉並回傳，不會中斷其他項目；
+    工作函式應只回傳結果、不直接輸出，由呼叫端依序列印以保持輸出穩定。
+    """
+    items = list(items)
+
+    def call(item: T) -> Tuple[Optional[R], Optional[BaseException]]:
+        try:
+            return func(item), None
+        except Exception as e:
+            return None, e
+
+    count = max(1, min(workers or IO_WORKERS, len(items)))
+    call = bind(call)
+    if count == 1:
+        return [call(item) for item in items]
+    with ThreadPoolExecutor(max_workers=count) as executor:
+        return list(executor.map(call, items))
+
+
+def cache_dir() -> Path:
+    """回傳本工具的快取目錄 ($XDG_CACHE_HOME/mcp_rule_config)，不存在時以 0700 建立。"""
+    base = os.environ.get("XDG_CACHE_HOME") or str(Path.home() / ".cache")
+    path = Path(base) / "mcp_rule_config"
+    path.mkdir(mode=0o700, parents=True, exist_ok=True)
+    return path
+
+
+def load_json_file(path: Path) -> dict:
+    """讀取 JSON 物件檔；不存在或格式錯誤時回傳空字典。"""
+    try:
+        raw = path.read_bytes()
+        add_bytes(read=len(raw))
+        data = json.loads(raw)
+    except (OSError, ValueError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def write_private_json(path: Path, data: dict) -> None:
+    """以 0600 權限原子寫入 JSON 檔（先寫同目錄暫存檔再 rename）。"""
+    path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+    payload = json.dumps(data, ensure_ascii=False, indent=2, sort_keys=True)
+    atomic_write_bytes(path, payload.encode("utf-8"), mode=0o600)
+
+
+def atomic_write_bytes(path: Path, data: bytes, mode: int = 0o600) -> None:
+    """於目標同目錄建立暫存檔寫入後 rename，避免讀到寫一半的檔案。
+
+    目標為 symlink 時寫入其指向的檔案（保留連結，例如以 dotfiles 管理的設定檔）；
+    目標已存在時沿用其權限，mode 只用於新建的檔案。
+    """
+    path = Path(os.path.realpath(path))
+    path.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        mode = stat.S_IMODE(path.stat().st_mode)
+    except OSError:
+        pass
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            os.fchmod(f.fileno(), mode)
+            f.write(data)
+        os.replace(tmp, path)
+        add_bytes(written=len(data))
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+
+
+def _sha256_file(path: Path, size: Optional[int] = None) -> str:
+    """計算檔案的 sha256：小檔串流分塊讀取，大檔使用 mmap。"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        if size is None:
+            size = os.fstat(f.fileno()).st_size
+        if size >= MMAP_THRESHOLD:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                digest.update(mapped)
+        else:
+            for chunk in iter(lambda: f.read(1 << 16), b""):
+                digest.update(chunk)
+    add_bytes(read=size)
+    return digest.hexdigest()
+
+
+_digest_lock = threading.Lock()
+_digest_cache: Optional[Dict[str, list]] = None
+_digest_dirty = False
+
+
+def _digest_cache_path() -> Path:
+    return cache_dir() / DIGEST_CACHE_FILE
+
+
+def _load_digest_cache() -> Dict[str, list]:
+    """載入雜湊快取（每個行程只載入一次，結束時自動寫回）。須持有 _digest_lock。"""
+    global _digest_cache
+    if _digest_cache is None:
+        try:
+            entries = load_json_file(_digest_cache_path()).get("entries")
+        except OSError:
+            entries = None
+        _digest_cache = entries if isinstance(entries, dict) else {}
+        atexit.register(save_digest_cache)
+    return _digest_cache
+
+
+def save_digest_cache() -> None:
+    """將雜湊快取寫回快取目錄，並移除長時間未使用的項目。"""
+    global _digest_dirty
+    with _digest_lock:
+        if _digest_cache is None or not _digest_dirty:
+            return
+        cutoff = time.time() - DIGEST_CACHE_MAX_AGE
+        entries = {k: v for k, v in _digest_cache.items() if len(v) == 4 and v[3] >= cutoff}
+        try:
+            write_private_json(_digest_cache_path(), {"entries": entries})
+            _digest_dirty = False
+        except OSError:
+            pass
+
+
+def file_digest(path: Path, st: Optional[os.stat_result] = None) -> str:
+    """回傳檔案內容的 sha256。
+
+    以 (路徑, 大小, mtime_ns) 查詢持久化快取，命中時完全不讀取檔案內容。
+    """
+    global _digest_dirty
+    st = st or path.stat()
+    key = str(path)
+    with _digest_lock:
+        entry = _load_digest_cache().get(key)
+        if entry and len(entry) == 4 and entry[0] == st.st_size and entry[1] == st.st_mtime_ns:
+            # 使用時間每天最多更新一次，避免每次執行都重寫快取檔
+            if time.time() - entry[3] > 24 * 60 * 60:
+                entry[3] = int(time.time())
+                _digest_dirty = True
+            return entry[2]
+
+    digest = _sha256_file(path, st.st_size)
+    if time.time_ns() - st.st_mtime_ns > DIGEST_RACY_WINDOW * 1_000_000_000:
+        with _digest_lock:
+            _load_digest_cache()[key] = [st.st_size, st.st_mtime_ns, digest, int(time.time())]
+            _digest_dirty = True
+    return digest
+
+
+def files_are_identical(file1: Path, file2: Path) -> bool:
+    """比對兩個檔案內容是否完全相同
+
+    依序：任一不存在 → 不同；大小不同 → 不同；同一 inode → 相同；最後比對（快取的）雜湊。
+    """
+    try:
+        st1 = file1.stat()
+        st2 = file2.stat()
+    except OSError:
+        return False
+    if st1.st_size != st2.st_size:
+        return False
+    if (st1.st_dev, st1.st_ino) == (st2.st_dev, st2.st_ino):
+        return True
+    try:
+        return file_digest(file1, st1) == file_digest(file2, st2)
+    except OSError:
+        return False
+
+
+def bytes_match_file(data: bytes, path: Path, digest: Optional[str] = None) -> bool:
+    """判斷檔案內容是否與 data 相同：先比大小，相同才比對（快取的）雜湊。
+
+    已知 data 的 sha256 時可由 digest 傳入，避免重複計算。
+    """
+    try:
+        st = path.stat()
+        if st.st_size != len(data):
+            return False
+        return file_digest(path, st) == (digest or hashlib.sha256(data).hexdigest())
+    except OSError:
+        return False
+
+
+def links_to_source(mode: Optional[str] = None) -> bool:
+    """該部署方式是否讓目標直接指向來源（hardlink / symlink）。"""
+    return (mode or LINK_MODE) in ("hardlink", "symlink")
+
+
+def points_to(src: Path, dst: Path) -> bool:
+    """dst 是否為指向 src 的 symlink，或與 src 同一 inode 的 hardlink。"""
+    try:
+        return os.path.samefile(dst, src)
+    except OSError:
+        return False
+
+
+def is_linked(src: Path, dst: Path, mode: Optional[str] = None) -> bool:
+    """dst 是否已依 hardlink / symlink 方式指向 src（只需 stat）。"""
+    mode = mode or LINK_MODE
+    if mode == "symlink":
+        return dst.is_symlink() and points_to(src, dst)
+    if mode == "hardlink":
+        return not dst.is_symlink() and points_to(src, dst)
+    return False
+
+
+def needs_deploy(src: Path, dst: Path, mode: Optional[str] = None) -> bool:
+    """判斷 dst 是否需要重新部署。
+
+    hardlink / symlink：尚未連結即需要（內容相同也改為連結，之後只需 stat 即可確認）；
+    copy / reflink：目標仍是先前建立的連結，或內容不同時才需要。
+    """
+    mode = mode or LINK_MODE
+    if links_to_source(mode):
+        return not is_linked(src, dst, mode)
+    return points_to(src, dst) or not files_are_identical(src, dst)
+
+
+def _clone_fd(src_fd: int, dst_fd: int) -> bool:
+    """以 FICLONE 讓目標共用來源的資料區塊；不支援時回傳 False。"""
+    if fcntl is None:
+        return False
+    try:
+        fcntl.ioctl(dst_fd, FICLONE, src_fd)
+    except OSError:
+        return False
+    return True
+
+
+def _copy_fd(src_fd: int, dst_fd: int, size: int) -> None:
+    """複製檔案內容：優先以 copy_file_range 在核心內完成，不支援時改為一般讀寫。"""
+    copied = 0
+    copy_file_range = getattr(os, "copy_file_range", None)
+    if copy_file_range is not None:
+        try:
+            while copied < size:
+                n = copy_file_range(src_fd, dst_fd, size - copied)
+                if n == 0:
+                    break
+                copied += n
+        except OSError:
+            pass
+    os.lseek(src_fd, copied, os.SEEK_SET)
+    os.lseek(dst_fd, copied, os.SEEK_SET)
+    for chunk in iter(lambda: os.read(src_fd, 1 << 20), b""):
+        view = memoryview(chunk)
+        while view:
+            view = view[os.write(dst_fd, view):]
+
+
+def place_file(src: Path, dst: Path, mode: Optional[str] = None) -> None:
+    """依部署方式以原子方式讓 dst 成為 src 的副本或連結（先建立暫存檔再 rename）。
+
+    copy 與 reflink 都先嘗試以 FICLONE 共用資料區塊，不支援時才實際複製內容；
+    hardlink 不被支援時（跨檔案系統、權限不足等）退回 copy。
+    dst 若是使用者建立的 symlink（未指向 src），改為寫入其指向的檔案以保留連結；
+    指向 src 的連結（先前以 symlink 模式部署）才會被替換。
+    """
+    mode = mode or LINK_MODE
+    if os.path.islink(dst) and not points_to(src, dst):
+        dst = Path(os.path.realpath(dst))
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=dst.parent, prefix=f".{dst.name}.", suffix=".tmp")
+    try:
+        if links_to_source(mode):
+            os.close(fd)
+            fd = -1
+            os.unlink(tmp)
+            try:
+                if mode == "symlink":
+                    os.symlink(os.path.abspath(src), tmp)
+                else:
+                    os.link(src, tmp)
+            except OSError:
+                if mode == "symlink":
+                    raise
+                fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        if fd >= 0:
+            with open(src, "rb") as f:
+                size = os.fstat(f.fileno()).st_size
+                if not _clone_fd(f.fileno(), fd):
+                    _copy_fd(f.fileno(), fd, size)
+                    add_bytes(read=size, written=size)
+            os.close(fd)
+            fd = -1
+            shutil.copystat(src, tmp)
+        os.replace(tmp, dst)
+    except BaseException:
+        if fd >= 0:
+            os.close(fd)
+        if os.path.lexists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+def deploy_file(src: Path, dst: Path, mode: Optional[str] = None) -> bool:
+    """需要時依部署方式更新 dst，回傳是否實際變更了 dst。"""
+    if not needs_deploy(src, dst, mode):
+        return False
+    place_file(src, dst, mode)
+    return True
+
+
+# 部署紀錄存放於快取目錄下的 manifests/<名稱>.json
+MANIFEST_DIR = "manifests"
+
+
+def _stat_pair(path: Path) -> Optional[List[int]]:
+    try:
+        st = path.stat()
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+
+class DeployManifest:
+    """單一部署目標群組（例如某 IDE 的 workflows 目錄）的部署紀錄。
+
+    每筆紀錄以目標路徑為鍵，保存來源路徑、內容雜湊、目標/來源的 (大小, mtime_ns)
+    與部署時間。下次執行時只要 stat 結果與紀錄一致，即可判定未變動而不必讀取內容。
+    """
+
+    def __init__(self, name: str, path: Optional[Path] = None):
+        self.name = name
+        safe = "".join(c if c.isalnum() or c in "._-" else "_" for c in name)
+        self.path = path or cache_dir() / MANIFEST_DIR / f"{safe}.json"
+        self._signature = _stat_pair(self.path)
+        entries = load_json_file(self.path).get("entries")
+        self._entries: Dict[str, dict] = entries if isinstance(entries, dict) else {}
+        self._lock = threading.Lock()
+        self._dirty = False
+
+    def entries(self) -> Dict[str, dict]:
+        """回傳所有紀錄（副本）。"""
+        with self._lock:
+            return {k: dict(v) for k, v in self._entries.items()}
+
+    def get(self, target: Path) -> Optional[dict]:
+        with self._lock:
+            record = self._entries.get(str(target))
+            return dict(record) if record else None
+
+    def is_current(self, target: Path, source: Optional[Path] = None,
+                   digest: Optional[str] = None, **expected) -> Optional[dict]:
+        """若目標自上次部署後未變動（僅用 stat 判斷）則回傳該筆紀錄，否則回傳 None。
+
+        - 目標的 (大小, mtime_ns) 必須與紀錄相同
+        - 指定 source 時，來源路徑與其 (大小, mtime_ns) 也必須相同
+        - 指定 digest 或其他欄位時，紀錄中的值必須相同
+        """
+        record = self.get(target)
+        if not record or record.get("target_stat") != _stat_pair(target):
+            return None
+        if source is not None and (
+            record.get("source") != str(source) or record.get("source_stat") != _stat_pair(source)
+        ):
+            return None
+        if digest is not None and record.get("digest") != digest:
+            return None
+        if any(record.get(k) != v for k, v in expected.items()):
+            return None
+        count("targets_skipped")
+        return record
+
+    def record(self, target: Path, source: Optional[Path] = None,
+               digest: Optional[str] = None, written: bool = True, **extra) -> None:
+        """記錄目標目前的狀態；written=False 表示內容本來就相同、未重新寫入。"""
+        target_stat = _stat_pair(target)
+        if target_stat is None:
+            return
+        count("targets_written" if written else "targets_skipped")
+        if digest is None:
+            digest = file_digest(target)
+        now = int(time.time())
+        with self._lock:
+            previous = self._entries.get(str(target)) or {}
+            entry = {
+                "source": str(source) if source is not None else None,
+                "source_stat": _stat_pair(source) if source is not None else None,
+                "digest": digest,
+                "target_stat": target_stat,
+                "deployed_at": now if written or "deployed_at" not in previous else previous["deployed_at"],
+                "checked_at": now,
+                **extra,
+            }
+            self._entries[str(target)] = entry
+            self._dirty = True
+        note_generation_target(target, digest)
+
+    def forget(self, target: Path, removed: bool = False) -> None:
+        """移除目標的紀錄；removed=True 表示目標檔已被刪除（下個世代不再包含它）。"""
+        with self._lock:
+            if self._entries.pop(str(target), None) is not None:
+                self._dirty = True
+        if removed:
+            note_generation_target(target, None)
+
+    def owned(self, root: Optional[Path] = None) -> List[Path]:
+        """回傳本工具部署（有紀錄）的目標；指定 root 時只列出其下的目標。"""
+        with self._lock:
+            targets = [Path(t) for t in self._entries]
+        if root is not None:
+            targets = [t for t in targets if root in t.parents]
+        return sorted(targets)
+
+    def orphans(self, root: Optional[Path] = None) -> List[Path]:
+        """回傳來源檔已不存在的目標（只需 stat）。"""
+        with self._lock:
+            sources = {t: e.get("source") for t, e in self._entries.items()}
+        return [
+            t for t in self.owned(root)
+            if sources.get(str(t)) and not os.path.exists(sources[str(t)])
+        ]
+
+    def status(self, target: Path) -> str:
+        """回傳目標相對於紀錄的狀態：ok / modified / missing / unknown。"""
+        record = self.get(target)
+        if not record:
+            return "unknown"
+        current = _stat_pair(target)
+        if current is None:
+            return "missing"
+        if current == record.get("target_stat"):
+            return "ok"
+        try:
+            return "ok" if file_digest(target) == record.get("digest") else "modified"
+        except OSError:
+            return "missing"
+
+    def save(self) -> None:
+        """若有變動則寫回 manifest 檔。"""
+        with self._lock:
+            if not self._dirty:
+                return
+            entries = dict(self._entries)
+            self._dirty = False
+        try:
+            write_private_json(self.path, {"name": self.name, "entries": entries})
+            self._signature = _stat_pair(self.path)
+        except OSError:
+            with self._lock:
+                self._dirty = True
+
+    def changed_on_disk(self) -> bool:
+        """manifest 檔自載入或上次寫回後是否已被其他行程改寫（只需 stat）。"""
+        return _stat_pair(self.path) != self._signature
+
+
+def remove_deployed(manifest: DeployManifest, targets: Iterable[Path],
+                    dry_run: bool = False) -> List[Tuple[Path, str]]:
+    """刪除本工具部署的目標，依目錄分批並行：每個目錄只開啟一次，以相對名稱 unlink。
+
+    只刪除仍與部署紀錄一致的目標，已被修改的檔案保留。
+    回傳 [(目標, 結果)]，結果為 removed / dry-run / modified / unknown / missing 或錯誤訊息。
+    """
+    by_dir: Dict[Path, List[Path]] = {}
+    for target in targets:
+        by_dir.setdefault(target.parent, []).append(target)
+    use_dir_fd = os.unlink in os.supports_dir_fd
+
+    def remove_batch(item: Tuple[Path, List[Path]]) -> List[Tuple[Path, str]]:
+        folder, paths = item
+        results: List[Tuple[Path, str]] = []
+        dir_fd = None
+        try:
+            if use_dir_fd and not dry_run and os.path.isdir(folder):
+                dir_fd = os.open(folder, os.O_RDONLY | getattr(os, "O_DIRECTORY", 0))
+            for path in paths:
+                state = manifest.status(path)
+                # 來源已刪除的 symlink 會成為斷開的連結，仍須移除
+                if state == "missing" and not path.is_symlink():
+                    manifest.forget(path)
+                    results.append((path, "missing"))
+                    continue
+                if state in ("modified", "unknown"):
+                    results.append((path, state))
+                    continue
+                if dry_run:
+                    results.append((path, "dry-run"))
+                    continue
+                try:
+                    if dir_fd is not None:
+                        os.unlink(path.name, dir_fd=dir_fd)
+                    else:
+                        os.unlink(path)
+                except OSError as e:
+                    results.append((path, str(e)))
+                    continue
+                manifest.forget(path, removed=True)
+                results.append((path, "removed"))
+        finally:
+            if dir_fd is not None:
+                os.close(dir_fd)
+        return results
+
+    outcome: List[Tuple[Path, str]] = []
+    for (folder, paths), (results, error) in zip(by_dir.items(), map_isolated(remove_batch, by_dir.items())):
+        outcome.extend(results if error is None else [(p, str(error)) for p in paths])
+    manifest.save()
+    return outcome
+
+
+_manifests: Dict[str, DeployManifest] = {}
+_manifests_lock = threading.Lock()
+
+
+def load_manifest(name: str) -> DeployManifest:
+    """取得指定名稱的部署紀錄；同一行程內重複取得會共用同一個物件。"""
+    with _manifests_lock:
+        manifest = _manifests.get(name)
+        if manifest is None:
+            manifest = _manifests[name] = DeployManifest(name)
+        return manifest
+
+
+def forget_changed_manifests() -> None:
+    """捨棄檔案已被其他行程改寫的部署紀錄，下次取得時重新讀取。
+
+    常駐程序與 --watch 在每次同步前呼叫，避免以記憶體中過期的紀錄覆寫
+    sync_workflows.py 或單次執行的 sync_mcp.py 所做的變更。
+    """
+    with _manifests_lock:
+        for name, manifest in list(_manifests.items()):
+            if manifest.changed_on_disk():
+                del _manifests[name]
+
+
+def list_manifests() -> List[DeployManifest]:
+    """列出快取目錄中所有部署紀錄。"""
+    folder = cache_dir() / MANIFEST_DIR
+    names = []
+    for path in sorted(folder.glob("*.json")) if folder.is_dir() else []:
+        names.append(load_json_file(path).get("name") or path.stem)
+    return [load_manifest(name) for name in names]
+
+
+# 內容定址物件庫與部署世代：每次部署的產物以 sha256 存放於 objects/，
+# 每次執行結束時若有變動便記錄一個編號世代 generations/<編號>.json（目標路徑 → 雜湊）
+OBJECTS_DIR = "objects"
+GENERATIONS_DIR = "generations"
+CURRENT_GENERATION_FILE = "current"
+# 保留最近幾個世代（目前使用中的世代一律保留）
+GENERATION_KEEP = 20
+# 尚未被任何世代引用、但建立不到此秒數的物件不回收（可能屬於進行中的執行）
+OBJECT_GC_GRACE = 60 * 60
+
+_generation_lock = threading.Lock()
+_generation_changes: Optional[Dict[str, Optional[str]]] = None
+
+
+def _objects_dir() -> Path:
+    return cache_dir() / OBJECTS_DIR
+
+
+def _generations_dir() -> Path:
+    return cache_dir() / GENERATIONS_DIR
+
+
+def object_path(digest: str) -> Path:
+    return _objects_dir() / digest[:2] / digest[2:]
+
+
+def store_object(path: Path, digest: str) -> Path:
+    """將檔案內容以雜湊為名存入物件庫（已存在則略過），回傳物件路徑。"""
+    obj = object_path(digest)
+    if obj.exists():
+        return obj
+    obj.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=obj.parent, prefix=".", suffix=".tmp")
+    try:
+        with open(path, "rb") as f:
+            if not _clone_fd(f.fileno(), fd):
+                _copy_fd(f.fileno(), fd, os.fstat(f.fileno()).st_size)
+        os.fchmod(fd, 0o400)
+        os.close(fd)
+        fd = -1
+        # 複製期間檔案可能又被修改，內容與雜湊不符時不存入
+        if _sha256_file(Path(tmp)) != digest:
+            raise OSError(f"內容已變動，未存入物件庫: {path}")
+        os.replace(tmp, obj)
+    except BaseException:
+        if fd >= 0:
+            os.close(fd)
+        Path(tmp).unlink(missing_ok=True)
+        raise
+    return obj
+
+
+def note_generation_target(target: Path, digest: Optional[str]) -> None:
+    """記錄本次執行部署（digest）或移除（None）的目標，行程結束時寫成新世代。"""
+    global _generation_changes
+    if digest is not None:
+        try:
+            store_object(target, digest)
+        except OSError:
+            return
+    with _generation_lock:
+        if _generation_changes is None:
+            _generation_changes = {}
+            atexit.register(commit_generation)
+        _generation_changes[str(target)] = digest
+
+
+def load_generation(gen_id: int) -> dict:
+    return load_json_file(_generations_dir() / f"{gen_id:06d}.json")
+
+
+def list_generations() -> List[int]:
+    """依編號列出所有世代。"""
+    folder = _generations_dir()
+    if not folder.is_dir():
+        return []
+    return sorted(int(p.stem) for p in folder.glob("*.json") if p.stem.isdigit())
+
+
+def current_generation() -> Optional[int]:
+    """回傳目前使用中的世代編號（最近一次部署或切換的世代）。"""
+    try:
+        return int((_generations_dir() / CURRENT_GENERATION_FILE).read_text().strip())
+    except (OSError, ValueError):
+        generations = list_generations()
+        return generations[-1] if generations else None
+
+
+def _set_current_generation(gen_id: int) -> None:
+    atomic_write_bytes(_generations_dir() / CURRENT_GENERATION_FILE, f"{gen_id}\n".encode())
+
+
+def commit_generation(command: Optional[str] = None) -> Optional[int]:
+    """以目前世代為基礎套用本次執行的變動，有差異時寫成新世代並回傳其編號。"""
+    global _generation_changes
+    with _generation_lock:
+        changes, _generation_changes = _generation_changes, None
+    if not changes:
+        return None
+
+    current = current_generation()
+    base = load_generation(current).get("targets", {}) if current is not None else {}
+    targets = dict(base)
+    for target, digest in changes.items():
+        if digest is None:
+            targets.pop(target, None)
+        else:
+            targets[target] = digest
+    if targets == base:
+        return None
+
+    generations = list_generations()
+    gen_id = (generations[-1] if generations else 0) + 1
+    try:
+        write_private_json(_generations_dir() / f"{gen_id:06d}.json", {
+            "id": gen_id,
+            "parent": current,
+            "created_at": int(time.time()),
+            "command": command or " ".join([Path(sys.argv[0]).name] + sys.argv[1:]),
+            "targets": targets,
+        })
+        _set_current_generation(gen_id)
+        if len(generations) + 1 > GENERATION_KEEP:
+            gc_generations()
+    except OSError:
+        return None
+    return gen_id
+
+
+def _restore_object(obj: Path, path: Path, mode: int) -> None:
+    """以物件庫內容原子取代 path 本身（path 為 symlink 時取代連結，不寫入其指向的檔案）。"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with open(obj, "rb") as f:
+            if not _clone_fd(f.fileno(), fd):
+                size = os.fstat(f.fileno()).st_size
+                _copy_fd(f.fileno(), fd, size)
+                add_bytes(read=size, written=size)
+        os.fchmod(fd, mode)
+        os.close(fd)
+        fd = -1
+        os.replace(tmp, path)
+    except BaseException:
+        if fd >= 0:
+            os.close(fd)
+        Path(tmp).unlink(missing_ok=True)
+        raise
+
+
+def switch_generation(gen_id: int) -> Tuple[List[str], List[str]]:
+    """將各目標切換為指定世代的內容（直接由物件庫還原，不重新產生）。
+
+    只處理目前世代與指定世代有差異的目標；使用者已自行修改（與目前世代內容不同）
+    的目標不覆寫也不刪除。以 symlink 部署的目標會被替換為一般檔案，不會改到連結指向的來源。
+    回傳 (已變更的目標, 略過/失敗的訊息)。
+    """
+    data = load_generation(gen_id)
+    if "targets" not in data:
+        raise ValueError(f"找不到世代 {gen_id}")
+    wanted: Dict[str, str] = data["targets"]
+    current = current_generation()
+    active: Dict[str, str] = load_generation(current).get("targets", {}) if current is not None else {}
+
+    changed: List[str] = []
+    problems: List[str] = []
+
+    def untouched(path: Path) -> bool:
+        expected = active.get(str(path))
+        try:
+            return expected is None or file_digest(path) == expected
+        except OSError:
+            return True
+
+    for target in sorted(set(wanted) | set(active)):
+        path = Path(target)
+        digest = wanted.get(target)
+        if digest is not None and digest == active.get(target) and path.exists():
+            continue
+        if not untouched(path):
+            problems.append(f"已被修改，略過: {target}")
+            continue
+        try:
+            if digest is None:
+                path.unlink(missing_ok=True)
+            else:
+                obj = object_path(digest)
+                if not obj.exists():
+                    problems.append(f"物件庫缺少內容，略過: {target}")
+                    continue
+                # 沿用目前的權限；需重新建立的目標（可能含展開後的密鑰）與 atomic_write_bytes 同樣只限本人讀寫
+                try:
+                    mode = stat.S_IMODE(os.stat(path).st_mode)
+                except OSError:
+                    mode = 0o600
+                _restore_object(obj, path, mode)
+            changed.append(target)
+        except OSError as e:
+            problems.append(f"{target}: {e}")
+
+    # 已切換的目標不再符合部署紀錄，下次同步時重新比對
+    for manifest in list_manifests():
+        for target in changed:
+            manifest.forget(Path(target))
+        manifest.save()
+    _set_current_generation(gen_id)
+    return changed, problems
+
+
+def gc_generations(keep: int = GENERATION_KEEP) -> Tuple[int, int]:
+    """只保留最近 keep 個世代（及目前世代），並回收不再被引用的物件。
+
+    回傳 (移除的世代數, 移除的物件數)。
+    """
+    generations = list_generations()
+    current = current_generation()
+    retained = set(generations[-max(1, keep):])
+    if current is not None:
+        retained.add(current)
+
+    removed_generations = 0
+    for gen_id in generations:
+        if gen_id not in retained:
+            (_generations_dir() / f"{gen_id:06d}.json").unlink(missing_ok=True)
+            removed_generations += 1
+
+    referenced = set()
+    for gen_id in retained:
+        referenced.update(load_generation(gen_id).get("targets", {}).values())
+
+    removed_objects = 0
+    cutoff = time.time() - OBJECT_GC_GRACE
+    folder = _objects_dir()
+    for obj in folder.glob("*/*") if folder.is_dir() else []:
+        try:
+            if obj.parent.name + obj.name in referenced or obj.stat().st_mtime > cutoff:
+                continue
+            obj.unlink()
+            removed_objects += 1
+        except OSError:
+            continue
+    return removed_generations, removed_objects
@@ -0,0 +1,230 @@
+"""
+同步執行紀錄 (journal)
+- 每次同步結束時，在快取目錄的 journal.jsonl 附加一行精簡紀錄：
+  耗時、各階段耗時、子程序數、讀寫/略過的檔案數、設定檔大小與結束碼
+- 互動選單、--watch 與常駐程序中的每次同步各寫一筆（見 journal_sync）
+- --history 顯示近期趨勢，並與同類執行的滾動中位數比較，標示耗時或子程序數明顯增加的執行
+- 紀錄檔超過上限時只保留較新的一半
+"""
+import contextlib
+import json
+import os
+import statistics
+import sys
+import time
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from sync_io import atomic_write_bytes, cache_dir
+from sync_timing import exit_code_of, pad_cells, run_stats
+
+JOURNAL_FILE = "journal.jsonl"
+JOURNAL_MAX_BYTES = 1 << 20
+# 與前 HISTORY_WINDOW 筆同類執行的中位數比較；至少需要 HISTORY_MIN_SAMPLES 筆才判斷
+HISTORY_WINDOW = 20
+HISTORY_MIN_SAMPLES = 3
+# 超過中位數 REGRESSION_RATIO 倍，且耗時至少多 REGRESSION_MIN_SECONDS 秒才視為退步
+REGRESSION_RATIO = 1.5
+REGRESSION_MIN_SECONDS = 0.2
+
+_run_kind: Optional[str] = None
+_gauges: Dict[str, int] = {}
+_listeners: List[Callable[[dict], None]] = []
+
+
+def mark_sync_run(kind: str) -> None:
+    """標記本次執行為同步（kind 為同類比較的依據，例如 batch、deploy），結束時寫入紀錄。"""
+    global _run_kind
+    _run_kind = kind
+
+
+def set_gauge(key: str, value: int) -> None:
+    """記錄一個數值（例如設定檔大小），隨本次執行的紀錄寫入。"""
+    _gauges[key] = value
+
+
+def add_run_listener(callback: Callable[[dict], None]) -> None:
+    """登記在同步紀錄寫入後呼叫的函式（例如輸出監控指標），參數為該筆紀錄。"""
+    _listeners.append(callback)
+
+
+def journal_path():
+    return cache_dir() / JOURNAL_FILE
+
+
+def append_record(record: dict) -> None:
+    """以單次 O_APPEND 寫入附加一行紀錄；檔案過大時保留較新的一半。"""
+    path = journal_path()
+    line = (json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+    try:
+        os.write(fd, line)
+        size = os.fstat(fd).st_size
+    finally:
+        os.close(fd)
+    if size > JOURNAL_MAX_BYTES:
+        data = path.read_bytes()
+        keep = data[len(data) // 2:]
+        atomic_write_bytes(path, keep[keep.find(b"\n") + 1:])
+
+
+def load_journal(program: Optional[str] = None) -> List[dict]:
+    """讀取所有紀錄（依時間順序）；指定 program 時只回傳該程式的紀錄。"""
+    records: List[dict] = []
+    try:
+        with open(journal_path(), encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if isinstance(record, dict) and (program is None or record.get("program") == program):
+                    records.append(record)
+    except OSError:
+        pass
+    return records
+
+
+def _regressed(value: float, samples: List[float], min_delta: float) -> Optional[float]:
+    """value 明顯高於 samples 的中位數時回傳該中位數，否則回傳 None。"""
+    if len(samples) < HISTORY_MIN_SAMPLES:
+        return None
+    median = statistics.median(samples)
+    if value > median * REGRESSION_RATIO and value - median >= min_delta:
+        return median
+    return None
+
+
+def find_regressions(records: List[dict]) -> Dict[int, List[str]]:
+    """與前 HISTORY_WINDOW 筆同類、成功的執行比較，回傳 {索引: 退步說明}。"""
+    flags: Dict[int, List[str]] = {}
+    history: Dict[Tuple[str, str], List[dict]] = {}
+    for index, record in enumerate(records):
+        key = (record.get("program", ""), record.get("kind", ""))
+        previous = history.setdefault(key, [])[-HISTORY_WINDOW:]
+        notes: List[str] = []
+
+        median = _regressed(record.get("duration", 0.0), [r.get("duration", 0.0) for r in previous],
+                            REGRESSION_MIN_SECONDS)
+        if median is not None:
+            notes.append(f"耗時 {record['duration']:.2f}s（中位數 {median:.2f}s）")
+        median = _regressed(record.get("subprocesses", 0), [r.get("subprocesses", 0) for r in previous], 1)
+        if median is not None:
+            notes.append(f"子程序 {record['subprocesses']} 個（中位數 {median:g}）")
+        for name, seconds in (record.get("phases") or {}).items():
+            samples = [r["phases"][name] for r in previous if name in (r.get("phases") or {})]
+            median = _regressed(seconds, samples, REGRESSION_MIN_SECONDS)
+            if median is not None:
+                notes.append(f"{name} {seconds:.2f}s（中位數 {median:.2f}s）")
+
+        if notes:
+            flags[index] = notes
+        if record.get("exit", 0) == 0:
+            history[key].append(record)
+    return flags
+
+
+def format_history(records: List[dict], limit: int = 20) -> str:
+    """產生近期執行的趨勢表，標示退步的執行。"""
+    if not records:
+        return "（尚無執行紀錄）"
+    flags = find_regressions(records)
+    start = max(0, len(records) - limit)
+    lines = [
+        f"📈 最近 {len(records) - start} 次同步（共 {len(records)} 筆紀錄，"
+        f"與前 {HISTORY_WINDOW} 次同類執行的中位數比較，超過 {REGRESSION_RATIO:g} 倍標示 ⚠）:",
+        "  " + " ".join([pad_cells("時間", 16), pad_cells("程式", 20), pad_cells("類型", 22)]
+                        + [pad_cells(title, width, ">") for title, width in
+                           (("耗時", 9), ("子程序", 7), ("讀取", 6), ("寫入", 6), ("略過", 6), ("結束碼", 6))]),
+    ]
+    for index in range(start, len(records)):
+        r = records[index]
+        when = time.strftime("%m-%d %H:%M:%S", time.localtime(r.get("ts", 0)))
+        lines.append(
+            f"  {when:<16} {pad_cells(r.get('program', ''), 20)} {pad_cells(r.get('kind', ''), 22)}"
+            f" {r.get('duration', 0.0):8.2f}s {r.get('subprocesses', 0):7d}"
+            f" {r.get('files_read', 0):6d} {r.get('targets_written', 0):6d} {r.get('targets_skipped', 0):6d}"
+            f" {r.get('exit', 0):6d}"
+        )
+        for note in flags.get(index, []):
+            lines.append(f"    ⚠ {note}")
+
+    recent = [r for r in records[start:] if r.get("exit", 0) == 0]
+    if recent:
+        durations = [r.get("duration", 0.0) for r in recent]
+        lines.append(
+            f"  耗時中位數 {statistics.median(durations):.2f}s，最短 {min(durations):.2f}s，最長 {max(durations):.2f}s"
+        )
+    return "\n".join(lines)
+
+
+def show_history(program: Optional[str] = None, limit: int = 20) -> None:
+    print(format_history(load_journal(program), limit))
+
+
+def _write_record(program: str, kind: str, started: float, origin: float, error: Optional[BaseException],
+                  stats: Dict[str, int], phases: Dict[str, float]) -> None:
+    record = {
+        "ts": int(started),
+        "program": program,
+        "kind": kind,
+        "exit": exit_code_of(error),
+        "duration": round(time.perf_counter() - origin, 4),
+        "phases": {name: round(seconds, 4) for name, seconds in phases.items()},
+        "subprocesses": stats.get("subprocesses", 0),
+        **{k: v for k, v in stats.items() if k != "subprocesses"},
+        **_gauges,
+    }
+    try:
+        append_record(record)
+        records = load_journal(program)
+        notes = find_regressions(records).get(len(records) - 1)
+    except OSError as e:
+        print(f"⚠ 無法寫入執行紀錄: {e}", file=sys.stderr)
+        notes = None
+    for note in notes or []:
+        print(f"⚠ 本次同步比近期慢: {note}（詳見 --history）", file=sys.stderr)
+    for callback in _listeners:
+        callback(record)
+
+
+@contextlib.contextmanager
+def record_run(program: str) -> Iterator[None]:
+    """包住程式主體：若本次執行已以 mark_sync_run 標記為同步，結束時寫入一筆紀錄。
+
+    剛寫入的紀錄若相對於近期同類執行明顯退步，立即於標準錯誤提示。
+    """
+    started = time.time()
+    origin = time.perf_counter()
+    error: Optional[BaseException] = None
+    try:
+        yield
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        if _run_kind is not None:
+            _write_record(program, _run_kind, started, origin, error, *run_stats())
+
+
+@contextlib.contextmanager
+def journal_sync(program: str, kind: str) -> Iterator[None]:
+    """在持續執行的模式（互動選單、--watch、常駐程序）中記錄單次同步。
+
+    這些模式不以 mark_sync_run 標記，結束時不另寫紀錄；每次同步以前後整體計數的差值寫入一筆。
+    """
+    stats_before, phases_before = run_stats()
+    started = time.time()
+    origin = time.perf_counter()
+    error: Optional[BaseException] = None
+    try:
+        yield
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        stats, phases = run_stats()
+        _write_record(
+            program, kind, started, origin, error,
+            {k: v - stats_before.get(k, 0) for k, v in stats.items() if v != stats_before.get(k, 0)},
+            {k: v - phases_before.get(k, 0.0) for k, v in phases.items() if v != phases_before.get(k, 0.0)},
+        )
@@ -1,35 +1,166 @@
 #!/usr/bin/env python3
 """
 簡潔的 MCP 配置同步工具
-1. 複製 mcp_config.json 為臨時檔案
-2. 替換環境變數
+1. 讀取 mcp_config.json
+2. 替換環境變數（只在記憶體中產生結果，不寫入暫存檔，避免 token 外洩或被推送到 github）
 3. 同步到 Windsurf, Cursor, Claude Code
-4. 刪除臨時檔案（避免 token 被推送到 github）
 """
+import contextlib
+import hashlib
 import json
 import os
-import shutil
 import subprocess
 import sys
 from pathlib import Path
 import re
+import shlex
 import tempfile
-from typing import Set, List, Dict, Tuple
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterator, Mapping, Optional, Set, List, Dict, Tuple, TypeVar
+
+from sync_daemon import call as call_daemon, is_running as daemon_is_running, serve as serve_daemon
+from sync_phases import Phase, format_phase_report, run_phases
+from sync_journal import add_run_listener, journal_sync, mark_sync_run, record_run, set_gauge, show_history
+from sync_metrics import write_metrics_file
+from sync_timing import add_bytes, bind, count, enable_timings, phase, report_on_exit, run_process, span
+from sync_watch import open_watcher, watch_changes
+from sync_io import (
+    atomic_write_bytes,
+    bytes_match_file,
+    cache_dir,
+    commit_generation,
+    current_generation,
+    deploy_file,
+    forget_changed_manifests,
+    gc_generations,
+    get_link_mode,
+    list_generations,
+    list_manifests,
+    load_generation,
+    load_json_file,
+    load_manifest,
+    map_isolated,
+    needs_deploy,
+    place_file,
+    remove_deployed,
+    save_digest_cache,
+    set_io_workers,
+    set_link_mode,
+    switch_generation,
+    write_private_json,
+    DEFAULT_IO_WORKERS,
+    DIGEST_RACY_WINDOW,
+    GENERATION_KEEP,
+    LINK_MODES,
+)
+
+T = TypeVar("T")
+
+# Claude CLI 每次呼叫都是一次 Node 冷啟動；以有限並行度同時執行 add/remove
+DEFAULT_CLAUDE_CLI_JOBS = 4
+CLAUDE_CLI_JOBS = DEFAULT_CLAUDE_CLI_JOBS
+
+# 註冊 Claude MCP 的方式：cli 逐一呼叫 `claude mcp add/remove`；
+# file 直接合併寫入 Claude 設定檔 (~/.claude.json) 的 user scope，整批只寫一次
+CLAUDE_BACKENDS = ("cli", "file")
+CLAUDE_BACKEND = "cli"
+# cli 後端與清單查詢所執行的 Claude 指令（可指定其他路徑，例如測試用的假指令）
+CLAUDE_EXECUTABLE = "claude"
+
+# Claude MCP 清單來源：cli 使用 `claude mcp list`（含健康檢查，較慢）；
+# file 直接解析 Claude 設定檔；auto 隨 CLAUDE_BACKEND 決定
+CLAUDE_INVENTORIES = ("auto", "cli", "file")
+CLAUDE_INVENTORY = "auto"
+
+# 擷取 login shell 環境變數：支援的 shell、快取有效秒數、啟動逾時與強制重新擷取
+LOGIN_SHELLS = ("fish", "bash", "zsh")
+LOGIN_ENV_CACHE_TTL = 24 * 60 * 60
+LOGIN_SHELL_TIMEOUT = 15
+LOGIN_ENV_REFRESH = False
+
+# 記錄本工具註冊到 Claude CLI 的各伺服器指紋（位於快取目錄）
+CLAUDE_CLI_STATE_FILE = "claude_cli_state.json"
+
+# 目標 workflows 目錄的 agent 索引（位於快取目錄，每個目標目錄一個檔案）
+AGENT_INDEX_DIR = "agent_index"
+
+# --watch：變動合併的靜默秒數，以及無法使用 inotify 時的輪詢間隔
+WATCH_DEBOUNCE = 0.5
+WATCH_POLL_INTERVAL = 1.0
+
+
+# ${VAR}、${VAR:-預設值}、${VAR:?錯誤訊息} 佔位符
+_VAR_PATTERN = re.compile(r'\$\{([^}:]+)(?:(:[-?])([^}]*))?\}')
+
+
+def _iter_strings(node: Any) -> Iterator[str]:
+    """依序產出設定樹中所有字串葉節點（不含字典鍵）。"""
+    if isinstance(node, str):
+        yield node
+    elif isinstance(node, dict):
+        for value in node.values():
+            yield from _iter_strings(value)
+    elif isinstance(node, list):
+        for value in node:
+            yield from _iter_strings(value)
+
+
+def referenced_variables(node: Any) -> Set[str]:
+    """找出字串或已解析設定樹中所有佔位符引用的變數名稱。"""
+    return {
+        match.group(1)
+        for text in _iter_strings(node) if '${' in text
+        for match in _VAR_PATTERN.finditer(text)
+    }
 
 
-def expand_variables(content: str) -> str:
-    """替換字串中的 ${VAR} 環境變數"""
-    pattern = re.compile(r'\$\{([^}]+)\}')
+def expand_config(node: Any, env: Optional[Mapping[str, str]] = None) -> Any:
+    """在已解析的設定樹上替換環境變數，只處理字串葉節點，回傳新的設定樹。
+
+    支援語法：
+    - ${VAR}：未設置時保留原字串並警告
+    - ${VAR:-default}：未設置或為空字串時使用 default
+    - ${VAR:?message}：未設置或為空字串時拋出 ValueError
+    每個變數只查詢一次並快取結果，整棵樹只走訪一遍。
+    """
+    env = os.environ if env is None else env
+    memo: Dict[str, Optional[str]] = {}
+    warned: Set[str] = set()
 
     def replace_var(match):
-        var_name = match.group(1)
-        value = os.environ.get(var_name)
+        name, op, arg = match.groups()
+        if name not in memo:
+            memo[name] = env.get(name)
+        value = memo[name]
+        if op == ':-':
+            return value if value else arg
+        if op == ':?':
+            if value:
+                return value
+            raise ValueError(f"環境變數 '{name}' 未設置: {arg or '必須提供此變數'}")
         if value is None:
-            print(f"警告: 環境變數 '{var_name}' 未設置")
+            if name not in warned:
+                warned.add(name)
+                print(f"警告: 環境變數 '{name}' 未設置")
             return match.group(0)
         return value
 
-    return pattern.sub(replace_var, content)
+    def walk(item: Any) -> Any:
+        if isinstance(item, str):
+            return _VAR_PATTERN.sub(replace_var, item) if '${' in item else item
+        if isinstance(item, dict):
+            return {key: walk(value) for key, value in item.items()}
+        if isinstance(item, list):
+            return [walk(value) for value in item]
+        return item
+
+    return walk(node)
+
+
+def expand_variables(content: str) -> str:
+    """替換字串中的 ${VAR} 環境變數"""
+    return expand_config(content)
 
 
 def _parse_dotenv_file(path: Path) -> Dict[str, str]:
@@ -63,225 +194,586 @@ def _parse_dotenv_file(path: Path) -> Dict[str, str]:
     return env
 
 
-def _env_from_fish_login() -> Dict[str, str]:
-    """透過 fish login shell 取得環境變數 (會載入 ~/.config/fish/config.fish 等)，
-    回傳 KEY=VALUE 字典。若 fish 不存在或失敗，回傳空字典。
+def _login_shell() -> str:
+    """決定用哪個 login shell 取得環境變數。
+
+    優先順序：MCP_SYNC_LOGIN_SHELL → $SHELL（限 fish/bash/zsh）→ fish。
     """
+    for candidate in (os.environ.get("MCP_SYNC_LOGIN_SHELL"), os.environ.get("SHELL")):
+        name = Path(candidate).name if candidate else ""
+        if name in LOGIN_SHELLS:
+            return name
+    return "fish"
+
+
+def _login_shell_config_files(shell: str) -> List[Path]:
+    """列出會影響 login shell 環境的設定檔（用於判斷快取是否失效）。"""
+    home = Path.home()
+    if shell == "fish":
+        conf = Path(os.environ.get("XDG_CONFIG_HOME") or home / ".config") / "fish"
+        conf_d = conf / "conf.d"
+        files = [Path("/etc/fish/config.fish"), conf / "config.fish", conf / "fish_variables", conf_d]
+        if conf_d.is_dir():
+            files.extend(sorted(conf_d.glob("*.fish")))
+        return files
+    if shell == "zsh":
+        zdot = Path(os.environ.get("ZDOTDIR") or home)
+        return [
+            Path("/etc/zshenv"), Path("/etc/zprofile"), Path("/etc/zsh/zshenv"), Path("/etc/zsh/zprofile"),
+            zdot / ".zshenv", zdot / ".zprofile", zdot / ".zlogin", zdot / ".zshrc",
+        ]
+    return [Path("/etc/profile"), home / ".bash_profile", home / ".bash_login", home / ".profile", home / ".bashrc"]
+
+
+def _config_files_signature(files: List[Path]) -> Dict[str, Optional[List[int]]]:
+    """以 (mtime_ns, size) 記錄各設定檔狀態；不存在者記為 None。"""
+    signature: Dict[str, Optional[List[int]]] = {}
+    for path in files:
+        try:
+            st = path.stat()
+            signature[str(path)] = [st.st_mtime_ns, st.st_size]
+        except OSError:
+            signature[str(path)] = None
+    return signature
+
+
+def _capture_login_shell_env(shell: str) -> Optional[Dict[str, str]]:
+    """實際啟動 login shell 執行 `env`，失敗時回傳 None。"""
     try:
-        proc = subprocess.run(
-            ["fish", "-lc", "env"], capture_output=True, text=True, check=False
+        proc = run_process(
+            [shell, "-lc", "env"], capture_output=True, text=True, check=False,
+            timeout=LOGIN_SHELL_TIMEOUT,
         )
-        if proc.returncode != 0:
-            return {}
-        env: Dict[str, str] = {}
-        for line in (proc.stdout or "").splitlines():
-            if not line or "=" not in line:
-                continue
-            k, v = line.split("=", 1)
-            env[k] = v
-        return env
-    except FileNotFoundError:
-        # 系統沒有 fish，忽略
-        return {}
-    except Exception:
+    except (OSError, subprocess.TimeoutExpired):
+        # 系統沒有該 shell 或啟動逾時，忽略
+        return None
+    if proc.returncode != 0:
+        return None
+    env: Dict[str, str] = {}
+    for line in (proc.stdout or "").splitlines():
+        if not line or "=" not in line:
+            continue
+        k, v = line.split("=", 1)
+        env[k] = v
+    return env
+
+
+def _env_from_login_shell(refresh: bool = False) -> Dict[str, str]:
+    """透過 login shell 取得環境變數 (fish/bash/zsh，會載入各自的設定檔)，回傳 KEY=VALUE 字典。
+
+    結果快取於快取目錄 (權限 0600)，在下列情況重新擷取：
+    - shell 設定檔的 mtime/size 有變動
+    - 超過 TTL (LOGIN_ENV_CACHE_TTL 秒，可用 MCP_SYNC_ENV_TTL 覆寫；0 表示不使用快取)
+    - refresh=True
+    若 shell 不存在或失敗，回傳空字典。
+    """
+    shell = _login_shell()
+    try:
+        ttl = float(os.environ.get("MCP_SYNC_ENV_TTL", LOGIN_ENV_CACHE_TTL))
+    except ValueError:
+        ttl = LOGIN_ENV_CACHE_TTL
+    signature = _config_files_signature(_login_shell_config_files(shell))
+
+    try:
+        cache_path = cache_dir() / f"login_env_{shell}.json"
+    except OSError:
+        cache_path = None
+
+    if cache_path and ttl > 0 and not refresh:
+        cached = load_json_file(cache_path)
+        if (
+            cached.get("sources") == signature
+            and isinstance(cached.get("env"), dict)
+            and 0 <= time.time() - float(cached.get("created", 0)) < ttl
+        ):
+            return cached["env"]
+
+    env = _capture_login_shell_env(shell)
+    if env is None:
         return {}
+    if cache_path and ttl > 0:
+        try:
+            write_private_json(cache_path, {
+                "shell": shell, "created": time.time(), "sources": signature, "env": env,
+            })
+        except OSError:
+            pass
+    return env
+
+
+# reload_env_vars 載入到 os.environ 的變數名稱（不含原本就存在於環境中的變數）
+_loaded_env_keys: Set[str] = set()
 
 
-def reload_env_vars() -> None:
+def reload_env_vars(required: Optional[Set[str]] = None) -> None:
     """在每次執行前重新載入環境變數：
     1. 專案根目錄 .env
     2. 使用者家目錄 ~/.env
-    3. fish login shell 的 env (若可用)
+    3. login shell (fish/bash/zsh) 的 env (若可用，結果有快取)
 
     載入順序：較前面的優先度較高；後者不覆蓋既有鍵，避免意外覆蓋既有環境。
+    若指定 required，則依序查詢各來源，一旦所需變數都已設定就停止，
+    不再讀取後面的來源（特別是需要啟動 login shell 的最後一步）。
     """
     project_root = Path(__file__).parent
+    sources = (
+        lambda: _parse_dotenv_file(project_root / ".env"),
+        lambda: _parse_dotenv_file(Path.home() / ".env"),
+        lambda: _env_from_login_shell(refresh=LOGIN_ENV_REFRESH),
+    )
+
+    for load in sources:
+        if required is not None and all(name in os.environ for name in required):
+            return
+        for k, v in load().items():
+            if k not in os.environ:
+                os.environ[k] = v
+                _loaded_env_keys.add(k)
+
 
-    # 1) 專案 .env
-    proj_env = _parse_dotenv_file(project_root / ".env")
-    for k, v in proj_env.items():
-        if k not in os.environ:
-            os.environ[k] = v
+def forget_loaded_env() -> None:
+    """移除先前由 reload_env_vars 載入的變數，讓下次載入時改用 .env 的新內容（--watch 使用）。"""
+    for k in _loaded_env_keys:
+        os.environ.pop(k, None)
+    _loaded_env_keys.clear()
 
-    # 2) 家目錄 .env
-    home_env = _parse_dotenv_file(Path.home() / ".env")
-    for k, v in home_env.items():
-        if k not in os.environ:
-            os.environ[k] = v
 
-    # 3) fish login 環境
-    fish_env = _env_from_fish_login()
-    for k, v in fish_env.items():
-        if k not in os.environ:
-            os.environ[k] = v
+def render_config(config: dict) -> bytes:
+    """將設定序列化為寫入各編輯器的 JSON 位元組。"""
+    return (json.dumps(config, indent=2, ensure_ascii=False) + "\n").encode("utf-8")
 
 
-def process_config():
-    """處理配置檔案：複製 → 替換變數 → 返回處理後的配置和臨時檔案路徑"""
+def process_config() -> Tuple[dict, bytes]:
+    """處理配置檔案：讀取 → 替換變數 → 返回處理後的配置與序列化後的內容（僅存在記憶體）"""
     config_path = Path(__file__).parent / "mcp_config.json"
 
     if not config_path.exists():
         print(f"錯誤: 找不到配置檔案 {config_path}")
         sys.exit(1)
 
-    # 創建臨時檔案
-    temp_file = tempfile.NamedTemporaryFile(mode='w+', suffix='_mcp_config.json',
-                                          delete=False, encoding='utf-8')
-    temp_path = Path(temp_file.name)
-
     try:
-        # 讀取原始配置
-        with open(config_path, 'r', encoding='utf-8') as f:
-            raw_content = f.read()
+        # 讀取並解析原始配置（變數在解析後的設定樹上展開，值含引號或反斜線也不會破壞 JSON）
+        with span("讀取 mcp_config.json"):
+            raw = config_path.read_bytes()
+            add_bytes(read=len(raw))
+            set_gauge("config_bytes", len(raw))
+            raw_config = json.loads(raw)
 
-        # 在展開之前，重新載入環境變數來源 (.env / ~/.env / fish)
-        reload_env_vars()
+        # 在展開之前，只針對設定檔引用到的變數載入環境變數來源 (.env / ~/.env / login shell)
+        with span("載入環境變數"):
+            reload_env_vars(referenced_variables(raw_config))
 
         # 替換環境變數
-        processed_content = expand_variables(raw_content)
-
-        # 寫入臨時檔案
-        temp_file.write(processed_content)
-        temp_file.close()
-
-        # 解析為 JSON 物件
-        config = json.loads(processed_content)
-
-        print(f"已創建臨時配置檔案: {temp_path}")
-        return config, temp_path
+        with span("展開變數"):
+            config = expand_config(raw_config)
+            return config, render_config(config)
 
     except json.JSONDecodeError as e:
-        temp_file.close()
-        temp_path.unlink(missing_ok=True)
         print(f"錯誤: JSON 解析失敗 - {e}")
         sys.exit(1)
     except Exception as e:
-        temp_file.close()
-        temp_path.unlink(missing_ok=True)
         print(f"錯誤: 處理配置檔案失敗 - {e}")
         sys.exit(1)
 
 
-def files_are_identical(file1: Path, file2: Path) -> bool:
-    """比對兩個檔案內容是否完全相同"""
-    if not file1.exists() or not file2.exists():
-        return False
-    try:
-        content1 = file1.read_text(encoding='utf-8')
-        content2 = file2.read_text(encoding='utf-8')
-        return content1 == content2
-    except Exception:
-        return False
-
-
-def sync_to_editors(config_data: dict, temp_path: Path):
-    """同步配置到各編輯器（使用臨時檔案，僅在內容不同時更新）"""
+def editor_config_targets() -> Dict[str, Path]:
+    """各編輯器 MCP 設定檔的目標路徑"""
     home = Path.home()
-
-    # 目標路徑配置
-    targets = {
+    return {
         "Windsurf": home / ".codeium/windsurf/mcp_config.json",
         "Cursor": home / ".cursor/mcp.json",
         "Antigravity": home / ".gemini/antigravity/mcp_config.json"
     }
 
-    success_count = 0
 
-    # 複製臨時檔案到各編輯器
-    for editor, target_path in targets.items():
-        try:
-            target_path.parent.mkdir(parents=True, exist_ok=True)
+def sync_to_editors(config_data: dict, rendered: bytes,
+                    inventory: Optional["ClaudeCliInventory"] = None, claude: bool = True):
+    """同步配置到各編輯器（由記憶體中的內容直接寫入，僅在內容不同時更新）
 
-            # 比對檔案內容
-            if files_are_identical(temp_path, target_path):
-                print(f"⊜ {editor}: 內容相同，跳過更新")
-                success_count += 1
-            else:
-                shutil.copy2(temp_path, target_path)
-                print(f"✓ {editor}: {target_path}")
-                success_count += 1
-        except Exception as e:
-            print(f"✗ {editor}: {e}")
+    claude=False 時不同步 Claude CLI（由呼叫端另行並行執行）。
+    """
+    targets = editor_config_targets()
+
+    success_count = 0
+    manifest = load_manifest("mcp")
+    digest = hashlib.sha256(rendered).hexdigest()
+
+    def write_target(item: Tuple[str, Path]) -> bool:
+        editor, target_path = item
+        with span(editor, kind="target", path=str(target_path)):
+            # 部署紀錄與目標 stat 一致時，不需讀取目標內容
+            if manifest.is_current(target_path, digest=digest):
+                return False
+            # 比對檔案內容，相同則不寫入
+            if bytes_match_file(rendered, target_path):
+                manifest.record(target_path, digest=digest, written=False)
+                return False
+            atomic_write_bytes(target_path, rendered)
+            manifest.record(target_path, digest=digest)
+            return True
+
+    # 並行寫入各編輯器（權限 0600，內容含已展開的 token），依固定順序輸出結果
+    for (editor, target_path), (written, error) in zip(
+        targets.items(), map_isolated(write_target, targets.items())
+    ):
+        if error is not None:
+            print(f"✗ {editor}: {error}")
+            count("targets_failed")
+            continue
+        if written:
+            print(f"✓ {editor}: {target_path}")
+        else:
+            print(f"⊜ {editor}: 內容相同，跳過更新")
+        success_count += 1
+    manifest.save()
+    if not claude:
+        return success_count
 
     # 同步到 Claude CLI
     try:
-        sync_to_claude_cli(config_data)
+        with span("Claude CLI", kind="target"):
+            sync_to_claude_cli(config_data, inventory=inventory)
         success_count += 1
     except Exception as e:
         print(f"✗ Claude CLI: {e}")
+        count("targets_failed")
 
     return success_count
 
 
-def sync_to_claude_cli(config: dict):
-    """同步到 Claude CLI"""
-    servers = config.get('mcpServers', {})
+def _mcp_remote_url(server_config: dict) -> Optional[str]:
+    """若 command 型伺服器透過 mcp-remote 連線遠端 URL，回傳該 URL，否則回傳 None。"""
+    args = server_config.get('args', []) or []
+    # 從 args 中找第一個 http(s) URL
+    url_in_args = next((a for a in args if isinstance(a, str) and a.startswith(('http://', 'https://'))), None)
+    uses_remote = any(isinstance(a, str) and 'mcp-remote' in a for a in args)
+    if server_config.get('command') and uses_remote and url_in_args:
+        return url_in_args
+    return None
+
+
+def normalize_server_spec(name: str, server_config: dict) -> dict:
+    """將設定檔中的伺服器定義正規化為 Claude 實際註冊的形式。
+
+    - HTTP: {"type": "http", "url": ..., "headers": {...}}
+    - stdio: {"type": "stdio", "command": ..., "args": [...], "env": {...}}
+
+    mcp-remote + URL 會轉為 HTTP transport；args 中的 '-y' 會被移除。
+    設定不完整時拋出 ValueError。
+    """
+    # 1) 支援 HTTP transport：'serverUrl' 或 'url' 皆可
+    server_url = server_config.get('serverUrl') or server_config.get('url')
+    if server_url:
+        headers: Dict[str, str] = {}
+        raw_headers = server_config.get('headers') or {}
+        if isinstance(raw_headers, dict):
+            headers = {str(k): str(v) for k, v in raw_headers.items()}
+        elif isinstance(raw_headers, list):
+            for h in raw_headers:
+                k, _, v = str(h).partition(':')
+                headers[k.strip()] = v.strip()
+        return {"type": "http", "url": server_url, "headers": headers}
+
+    # 2) 若為 command 型，嘗試偵測 mcp-remote + URL 並轉為 HTTP transport
+    remote_url = _mcp_remote_url(server_config)
+    if remote_url:
+        return {"type": "http", "url": remote_url, "headers": {}}
+
+    command = server_config.get('command')
+    if not command:
+        raise ValueError(f"伺服器 {name} 缺少必要欄位：'command' 或 'serverUrl'/'url'")
+    args = [str(a) for a in (server_config.get('args', []) or []) if a != '-y']
+    env = {str(k): str(v) for k, v in (server_config.get('env') or {}).items()}
+    return {"type": "stdio", "command": command, "args": args, "env": env}
+
+
+def registered_server_spec(name: str, entry: dict) -> dict:
+    """將 Claude 設定檔中已註冊的定義正規化為與 normalize_server_spec 相同的形式。
+
+    Claude 實際註冊的 transport 與正規化結果不同時（例如以 stdio 執行 mcp-remote），
+    回傳原始定義，使其指紋必然與設定檔不同。定義不完整時拋出 ValueError。
+    """
+    spec = normalize_server_spec(name, entry)
+    return spec if spec["type"] == (entry.get("type") or "stdio") else dict(entry)
+
+
+def server_fingerprint(spec: dict) -> str:
+    """計算正規化伺服器定義的指紋 (sha256)，用於判斷是否需要重新註冊。"""
+    payload = json.dumps(spec, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
 
-    # 先比較目前 Claude CLI 已註冊的 MCP 名稱與設定檔是否一致
+def build_claude_add_cmd(name: str, server_config: dict) -> List[str]:
+    """依伺服器設定組出 `claude mcp add` 指令。設定不完整時拋出 ValueError。"""
+    return _claude_add_cmd_from_spec(name, normalize_server_spec(name, server_config))
+
+
+def _claude_add_cmd_from_spec(name: str, spec: dict) -> List[str]:
+    """由正規化後的伺服器定義組出 `claude mcp add` 指令。"""
+    cmd = [CLAUDE_EXECUTABLE, 'mcp', 'add', '--scope', 'user']
+
+    if spec["type"] == "http":
+        cmd.extend(['--transport', 'http', name, spec["url"]])
+        # 處理 headers，避免在日誌中洩漏敏感值
+        for k, v in spec["headers"].items():
+            cmd.extend(['--header', f"{k}: {v}"])
+        return cmd
+
+    cmd.append(name)
+    for k, v in spec["env"].items():
+        cmd.extend(['-e', f"{k}={v}"])
+    # 使用 '--' 作為參數分隔，避免 Claude CLI 將後續引數（如 '--from'）誤判為自身參數
+    cmd.extend(["--", spec["command"], *spec["args"]])
+    return cmd
+
+
+def claude_config_path() -> Path:
+    """回傳 Claude 自身的設定檔路徑（尊重 CLAUDE_CONFIG_DIR，預設 ~/.claude.json）。"""
+    config_dir = os.environ.get("CLAUDE_CONFIG_DIR")
+    if config_dir:
+        return Path(config_dir).expanduser() / ".claude.json"
+    return Path.home() / ".claude.json"
+
+
+def read_claude_user_servers(path: Optional[Path] = None) -> Dict[str, dict]:
+    """直接解析 Claude 設定檔，取得 user scope 已註冊的 MCP 定義。
+
+    不啟動任何程序、也不做健康檢查；檔案不存在或無法解析時回傳空字典。
+    """
+    servers = load_json_file(path or claude_config_path()).get("mcpServers")
+    if not isinstance(servers, dict):
+        return {}
+    return {str(name): spec for name, spec in servers.items() if isinstance(spec, dict)}
+
+
+def _stat_signature(path: Path) -> Optional[Tuple[int, int, int]]:
     try:
-        existing = list_claude_cli_mcp_names()
-    except Exception:
-        existing = set()
+        st = path.stat()
+    except FileNotFoundError:
+        return None
+    return st.st_ino, st.st_size, st.st_mtime_ns
 
-    desired = desired_mcp_names(config)
 
-    if existing == desired:
-        print("Claude CLI MCP 名稱清單與 mcp_config.json 相同，略過 Claude MCP 同步。")
+def update_claude_user_servers(add: Dict[str, dict], remove: List[str] = (),
+                               path: Optional[Path] = None, retries: int = 3) -> List[str]:
+    """直接合併寫入 Claude 設定檔 user scope 的 mcpServers，回傳實際被移除的名稱。
+
+    讀取 → 合併 → 寫入同目錄暫存檔 → rename，整批變更只有一次檔案寫入。
+    Claude 執行中也會改寫此檔，因此在 rename 前確認檔案未被修改，否則重試。
+    """
+    path = path or claude_config_path()
+    for _ in range(max(1, retries)):
+        before = _stat_signature(path)
+        data = load_json_file(path) if before else {}
+        if before and not data and path.read_text(encoding="utf-8").strip():
+            raise ValueError(f"無法解析 Claude 設定檔: {path}")
+
+        servers = data.get("mcpServers")
+        if not isinstance(servers, dict):
+            servers = {}
+            data["mcpServers"] = servers
+        removed = [name for name in remove if servers.pop(name, None) is not None]
+        servers.update(add)
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+            # 保留原檔權限；新檔則僅限本人讀寫
+            os.chmod(tmp, (path.stat().st_mode & 0o777) if before else 0o600)
+            if _stat_signature(path) != before:
+                Path(tmp).unlink(missing_ok=True)
+                continue
+            os.replace(tmp, path)
+            return removed
+        except BaseException:
+            Path(tmp).unlink(missing_ok=True)
+            raise
+    raise RuntimeError(f"Claude 設定檔在寫入期間持續被修改，已放棄: {path}")
+
+
+def _run_claude_jobs(func: Callable[[str], T], names: List[str], jobs: Optional[int] = None) -> Iterator[T]:
+    """以有限並行度對每個名稱執行 func，依輸入順序逐一產出結果。
+
+    各工作只回傳結果、不直接輸出，由呼叫端依序列印，避免多執行緒輸出交錯。
+    """
+    workers = max(1, min(jobs or CLAUDE_CLI_JOBS, len(names) or 1))
+    if workers == 1:
+        for name in names:
+            yield func(name)
         return
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(bind(func), names)
 
-    print(f"正在同步 {len(servers)} 個 MCP 伺服器到 Claude CLI（將只新增缺少的項目）...")
 
+def _claude_add(name: str, cmd: List[str]) -> Tuple[str, str]:
+    """執行單一 `claude mcp add`，回傳 (狀態, 訊息)；狀態為 added / exists / failed。"""
+    try:
+        run_process(cmd, capture_output=True, text=True, check=True)
+        return "added", f"✓ Claude CLI 已添加: {name}"
+    except subprocess.CalledProcessError as e:
+        if "already exists" in str(e.stderr):
+            return "exists", f"✓ Claude CLI 已存在: {name}"
+        return "failed", f"✗ Claude CLI 失敗: {name} - {e.stderr}"
+    except Exception as e:
+        return "failed", f"✗ Claude CLI 失敗: {name} - {e}"
+
+
+def _claude_remove(name: str) -> Tuple[bool, str]:
+    """移除單一 MCP（優先帶 user scope），回傳 (成功與否, 訊息)。"""
+    tried_cmds = [
+        [CLAUDE_EXECUTABLE, 'mcp', 'remove', '--scope', 'user', name],
+        [CLAUDE_EXECUTABLE, 'mcp', 'remove', name],
+    ]
+    last_err = ''
+    for cmd in tried_cmds:
+        try:
+            run_process(cmd, capture_output=True, text=True, check=True)
+            return True, f"✓ 已移除: {name}"
+        except subprocess.CalledProcessError as e:
+            last_err = e.stderr or e.stdout or str(e)
+        except Exception as e:
+            last_err = str(e)
+    return False, f"✗ 無法移除 {name}: {last_err}"
+
+
+def add_claude_cli_mcps(servers: Dict[str, dict], jobs: Optional[int] = None,
+                        inventory: Optional["ClaudeCliInventory"] = None) -> List[str]:
+    """註冊多個 MCP 到 Claude，依設定檔順序輸出結果。回傳成功新增的名稱清單。
+
+    cli 後端以有限並行度執行 `claude mcp add`；file 後端則一次寫入 Claude 設定檔
+    （同名者直接覆蓋）。若提供 inventory，成功新增（或已存在）的名稱會同步記入其中，
+    新增成功者並記錄其指紋。
+    """
+    specs: Dict[str, dict] = {}
     for name, server_config in servers.items():
         if server_config.get('disabled', False):
             print(f"跳過已停用的伺服器: {name}")
             continue
+        try:
+            specs[name] = normalize_server_spec(name, server_config)
+        except Exception as e:
+            print(f"✗ Claude CLI 失敗: {name} - {e}")
+            continue
+        if not (server_config.get('serverUrl') or server_config.get('url')) and _mcp_remote_url(server_config):
+            print(f"偵測到 {name} 使用 mcp-remote，將改用 HTTP transport 以支援瀏覽器授權彈窗。")
 
+    names = list(specs)
+    if CLAUDE_BACKEND == "file":
         try:
-            cmd = ['claude', 'mcp', 'add', '--scope', 'user']
-
-            # 1) 支援 HTTP transport：'serverUrl' 或 'url' 皆可
-            server_url = server_config.get('serverUrl') or server_config.get('url')
-            if server_url:
-                cmd.extend(['--transport', 'http', name, server_url])
-
-                # 處理 headers（字典形式），避免在日誌中洩漏敏感值
-                headers = server_config.get('headers') or {}
-                if isinstance(headers, dict):
-                    for k, v in headers.items():
-                        cmd.extend(['--header', f"{k}: {v}"])
-                elif isinstance(headers, list):
-                    for h in headers:
-                        cmd.extend(['--header', str(h)])
-            else:
-                # 2) 若為 command 型，嘗試偵測 mcp-remote + URL 並轉為 HTTP transport
-                command = server_config.get('command')
-                args = server_config.get('args', []) or []
-                # 從 args 中找第一個 http(s) URL
-                url_in_args = next((a for a in args if isinstance(a, str) and a.startswith(('http://', 'https://'))), None)
-                uses_remote = any(isinstance(a, str) and 'mcp-remote' in a for a in args)
-                if command and uses_remote and url_in_args:
-                    print(f"偵測到 {name} 使用 mcp-remote，將改用 HTTP transport 以支援瀏覽器授權彈窗。")
-                    cmd.extend(['--transport', 'http', name, url_in_args])
-                else:
-                    if not command:
-                        raise ValueError(f"伺服器 {name} 缺少必要欄位：'command' 或 'serverUrl'/'url'")
-                    # 使用 '--' 作為參數分隔，避免 Claude CLI 將後續引數（如 '--from'）誤判為自身參數
-                    cmd.extend([name, "--", command])
-                    for arg in args:
-                        if arg != '-y':
-                            cmd.append(arg)
+            if names:
+                update_claude_user_servers(specs)
+            results = [("added", f"✓ Claude 設定檔已寫入: {name}") for name in names]
+        except Exception as e:
+            results = [("failed", f"✗ Claude 設定檔寫入失敗: {name} - {e}") for name in names]
+    else:
+        cmds = {name: _claude_add_cmd_from_spec(name, spec) for name, spec in specs.items()}
+        results = _run_claude_jobs(lambda n: _claude_add(n, cmds[n]), names, jobs)
+
+    added: List[str] = []
+    for name, (status, message) in zip(names, results):
+        print(message)
+        count({"added": "targets_written", "exists": "targets_skipped"}.get(status, "targets_failed"))
+        if status == "added":
+            added.append(name)
+        if inventory is not None and status in ("added", "exists"):
+            inventory.add(name, server_fingerprint(specs[name]) if status == "added" else None)
+    if inventory is not None:
+        inventory.save()
+    return added
+
+
+def remove_claude_cli_mcps(names: List[str], jobs: Optional[int] = None,
+                           inventory: Optional["ClaudeCliInventory"] = None) -> List[str]:
+    """移除多個 MCP，依輸入順序輸出結果。回傳成功移除的名稱清單。
+
+    cli 後端以有限並行度執行 `claude mcp remove`；file 後端則一次改寫 Claude 設定檔，
+    只能移除 user scope 的項目。
+    """
+    if CLAUDE_BACKEND == "file":
+        try:
+            gone = set(update_claude_user_servers({}, names)) if names else set()
+            results = [
+                (True, f"✓ 已移除: {name}") if name in gone
+                else (False, f"✗ 無法移除 {name}: 不在 user scope 設定中")
+                for name in names
+            ]
+        except Exception as e:
+            results = [(False, f"✗ 無法移除 {name}: {e}") for name in names]
+    else:
+        results = _run_claude_jobs(_claude_remove, names, jobs)
+
+    removed: List[str] = []
+    for name, (ok, message) in zip(names, results):
+        print(message)
+        if ok:
+            removed.append(name)
+            if inventory is not None:
+                inventory.discard(name)
+    if inventory is not None:
+        inventory.save()
+    return removed
 
-            subprocess.run(cmd, capture_output=True, text=True, check=True)
-            print(f"✓ Claude CLI 已添加: {name}")
 
-        except subprocess.CalledProcessError as e:
-            if "already exists" in str(e.stderr):
-                print(f"✓ Claude CLI 已存在: {name}")
-            else:
-                print(f"✗ Claude CLI 失敗: {name} - {e.stderr}")
+def plan_claude_cli_sync(config: dict, inventory: "ClaudeCliInventory",
+                         adopt: bool = False) -> Tuple[Dict[str, dict], Dict[str, dict]]:
+    """比對設定檔與 Claude CLI 清單，回傳 (需新增, 指紋變動需重新註冊) 的伺服器。
+
+    已註冊但沒有指紋紀錄者（例如升級前註冊或手動註冊）改與 Claude 設定檔中的註冊定義比對；
+    無法取得定義時才視為未變動並提示。adopt=True 時將判定相同者的指紋記入 inventory，
+    之後設定變動才會重新註冊。
+    """
+    servers = config.get('mcpServers', {})
+    existing = inventory.names()
+    to_add: Dict[str, dict] = {}
+    to_readd: Dict[str, dict] = {}
+    for name, server_config in servers.items():
+        if not isinstance(server_config, dict) or server_config.get('disabled', False):
+            continue
+        if name not in existing:
+            to_add[name] = server_config
+            continue
+        try:
+            fingerprint = server_fingerprint(normalize_server_spec(name, server_config))
         except Exception as e:
-            # 捕捉一般錯誤（例如 KeyError）
             print(f"✗ Claude CLI 失敗: {name} - {e}")
+            continue
+        stored = inventory.fingerprint(name)
+        if stored is None:
+            stored = inventory.registered_fingerprint(name)
+            if stored is None:
+                print(f"⚠ Claude CLI: {name} 沒有指紋紀錄，也無法從 Claude 設定檔取得其定義，視為與設定檔相同")
+                stored = fingerprint
+            if adopt and stored == fingerprint:
+                inventory.add(name, fingerprint)
+        if stored != fingerprint:
+            to_readd[name] = server_config
+    return to_add, to_readd
+
+
+def sync_to_claude_cli(config: dict, jobs: Optional[int] = None,
+                       inventory: Optional["ClaudeCliInventory"] = None):
+    """同步到 Claude CLI：只新增缺少的、重新註冊指紋變動的伺服器。"""
+    if inventory is None:
+        inventory = ClaudeCliInventory()
+
+    with span("比對 Claude CLI 清單"):
+        to_add, to_readd = plan_claude_cli_sync(config, inventory, adopt=True)
+    inventory.save()
+    if not to_add and not to_readd:
+        print("Claude CLI MCP 設定與 mcp_config.json 相同，略過 Claude MCP 同步。")
+        return
+
+    print(f"正在同步 Claude CLI MCP：新增 {len(to_add)} 個，更新 {len(to_readd)} 個...")
+    if CLAUDE_BACKEND == "file":
+        # 直接覆寫設定檔中的定義，不需先移除
+        to_add.update(to_readd)
+    elif to_readd:
+        # 設定變動者需先移除再重新註冊
+        removed = set(remove_claude_cli_mcps(sorted(to_readd), jobs, inventory))
+        to_add.update({n: c for n, c in to_readd.items() if n in removed})
+    add_claude_cli_mcps(to_add, jobs, inventory)
 
 
 def _parse_claude_mcp_list_text(output: str) -> Set[str]:
@@ -311,8 +803,8 @@ def list_claude_cli_mcp_names() -> Set[str]:
     """
     # 先嘗試 JSON 介面
     try:
-        proc = subprocess.run(
-            ['claude', 'mcp', 'list', '--json'],
+        proc = run_process(
+            [CLAUDE_EXECUTABLE, 'mcp', 'list', '--json'],
             capture_output=True, text=True, check=True
         )
         data = json.loads(proc.stdout or '[]')
@@ -335,8 +827,8 @@ def list_claude_cli_mcp_names() -> Set[str]:
 
     # 文字模式
     try:
-        proc = subprocess.run(
-            ['claude', 'mcp', 'list'],
+        proc = run_process(
+            [CLAUDE_EXECUTABLE, 'mcp', 'list'],
             capture_output=True, text=True, check=False
         )
         return _parse_claude_mcp_list_text(proc.stdout or '')
@@ -344,6 +836,96 @@ def list_claude_cli_mcp_names() -> Set[str]:
         return set()
 
 
+def claude_inventory_source() -> str:
+    """決定 Claude MCP 清單來源：auto 時隨註冊後端 (file 後端即讀設定檔)。"""
+    if CLAUDE_INVENTORY == "auto":
+        return "file" if CLAUDE_BACKEND == "file" else "cli"
+    return CLAUDE_INVENTORY
+
+
+class ClaudeCliInventory:
+    """單次執行期間共用的 Claude CLI MCP 清單。
+
+    第一次查詢時才載入清單，之後的新增/移除直接就地更新，
+    讓同步、清理等後續階段不必再重新啟動 Claude CLI。
+    清單來源 (source) 為 cli 時呼叫 `claude mcp list`；為 file 時直接解析 Claude 設定檔
+    的 user scope，不啟動程序也不做健康檢查。
+    另外保存每個伺服器註冊時的指紋（存於快取目錄的狀態檔），用於判斷設定是否變動。
+    """
+
+    def __init__(self, names: Optional[Set[str]] = None, state_path: Optional[Path] = None,
+                 source: Optional[str] = None):
+        self._names: Optional[Set[str]] = set(names) if names is not None else None
+        self.source = source or claude_inventory_source()
+        self._state_path = state_path or (cache_dir() / CLAUDE_CLI_STATE_FILE)
+        self._fingerprints: Optional[Dict[str, str]] = None
+        self._registered: Optional[Dict[str, dict]] = None
+        self._dirty = False
+
+    def names(self) -> Set[str]:
+        """回傳目前已註冊的 MCP 名稱（副本）；尚未載入時才實際查詢。"""
+        if self._names is None:
+            try:
+                if self.source == "file":
+                    self._registered = read_claude_user_servers()
+                    self._names = set(self._registered)
+                else:
+                    self._names = list_claude_cli_mcp_names()
+            except Exception:
+                self._names = set()
+        return set(self._names)
+
+    def _load_fingerprints(self) -> Dict[str, str]:
+        if self._fingerprints is None:
+            servers = load_json_file(self._state_path).get("servers")
+            self._fingerprints = dict(servers) if isinstance(servers, dict) else {}
+        return self._fingerprints
+
+    def fingerprint(self, name: str) -> Optional[str]:
+        """回傳上次由本工具註冊時記錄的指紋；未知時回傳 None。"""
+        return self._load_fingerprints().get(name)
+
+    def registered_fingerprint(self, name: str) -> Optional[str]:
+        """回傳 Claude 設定檔中 user scope 註冊定義的指紋；不在設定檔中或無法解析時回傳 None。"""
+        if self._registered is None:
+            self._registered = read_claude_user_servers()
+        entry = self._registered.get(name)
+        if entry is None:
+            return None
+        try:
+            return server_fingerprint(registered_server_spec(name, entry))
+        except ValueError:
+            return None
+
+    def add(self, name: str, fingerprint: Optional[str] = None) -> None:
+        self.names()
+        self._names.add(name)
+        if fingerprint is not None:
+            self._load_fingerprints()[name] = fingerprint
+            self._dirty = True
+
+    def discard(self, name: str) -> None:
+        self.names()
+        self._names.discard(name)
+        if self._load_fingerprints().pop(name, None) is not None:
+            self._dirty = True
+
+    def invalidate(self) -> None:
+        """捨棄快取，下次查詢時重新載入清單。"""
+        self._names = None
+        self._registered = None
+
+    def save(self) -> None:
+        """若指紋有變動，寫回狀態檔（權限 0600）。"""
+        if not self._dirty:
+            return
+        try:
+            write_private_json(self._state_path, {"servers": self._fingerprints})
+            self._dirty = False
+        except Exception as e:
+            print(f"警告: 無法寫入 Claude CLI 狀態檔 {self._state_path}: {e}")
+
+
 def desired_mcp_names(config: dict) -> Set[str]:
     """從設定檔取出欲啟用的 MCP 名稱（排除 disabled=True）。"""
     names: Set[str] = set()
@@ -354,40 +936,26 @@ def desired_mcp_names(config: dict) -> Set[str]:
     return names
 
 
-def remove_all_claude_cli_mcps() -> List[str]:
+def remove_all_claude_cli_mcps(jobs: Optional[int] = None,
+                               inventory: Optional["ClaudeCliInventory"] = None) -> List[str]:
     """移除 Claude Code（Claude CLI）中所有已註冊的 MCP。回傳被刪除的名稱清單。"""
-    existing = sorted(list_claude_cli_mcp_names())
+    if inventory is None:
+        inventory = ClaudeCliInventory()
+    existing = sorted(inventory.names())
     if not existing:
         print("Claude CLI 目前沒有已註冊的 MCP。")
         return []
 
     print(f"將清除 Claude CLI 內所有 MCP，共 {len(existing)} 個: {', '.join(existing)}")
-    removed: List[str] = []
-    for name in existing:
-        tried_cmds = [
-            ['claude', 'mcp', 'remove', '--scope', 'user', name],
-            ['claude', 'mcp', 'remove', name],
-        ]
-        ok = False
-        last_err = ''
-        for cmd in tried_cmds:
-            try:
-                subprocess.run(cmd, capture_output=True, text=True, check=True)
-                ok = True
-                break
-            except subprocess.CalledProcessError as e:
-                last_err = e.stderr or e.stdout or str(e)
-        if ok:
-            print(f"✓ 已移除: {name}")
-            removed.append(name)
-        else:
-            print(f"✗ 無法移除 {name}: {last_err}")
-    return removed
+    return remove_claude_cli_mcps(existing, jobs, inventory)
 
 
-def prune_claude_cli(config: dict) -> List[str]:
+def prune_claude_cli(config: dict, jobs: Optional[int] = None,
+                     inventory: Optional["ClaudeCliInventory"] = None) -> List[str]:
     """刪除不在設定檔中的 MCP。回傳被刪除的名稱清單。"""
-    existing = list_claude_cli_mcp_names()
+    if inventory is None:
+        inventory = ClaudeCliInventory()
+    existing = inventory.names()
     desired = desired_mcp_names(config)
     obsolete = sorted(existing - desired)
 
@@ -396,28 +964,7 @@ def prune_claude_cli(config: dict) -> List[str]:
         return []
 
     print(f"開始清理多餘 MCP，共 {len(obsolete)} 個: {', '.join(obsolete)}")
-    removed: List[str] = []
-    for name in obsolete:
-        # 優先嘗試帶 scope
-        tried_cmds = [
-            ['claude', 'mcp', 'remove', '--scope', 'user', name],
-            ['claude', 'mcp', 'remove', name],
-        ]
-        ok = False
-        last_err = ''
-        for cmd in tried_cmds:
-            try:
-                proc = subprocess.run(cmd, capture_output=True, text=True, check=True)
-                ok = True
-                break
-            except subprocess.CalledProcessError as e:
-                last_err = e.stderr or e.stdout or str(e)
-        if ok:
-            print(f"✓ 已移除: {name}")
-            removed.append(name)
-        else:
-            print(f"✗ 無法移除 {name}: {last_err}")
-    return removed
+    return remove_claude_cli_mcps(obsolete, jobs, inventory)
 
 
 def extract_agent_names_from_markdown(content: str) -> Set[str]:
@@ -431,21 +978,79 @@ def extract_agent_names_from_markdown(content: str) -> Set[str]:
     return names
 
 
+# 已載入的 agent 索引（常駐模式下重複同步時不必再讀取索引檔）
+_agent_index_memo: Dict[Path, Dict[str, list]] = {}
+
+
+def _agent_index_path(folder: Path) -> Path:
+    key = hashlib.sha256(str(folder.resolve()).encode("utf-8")).hexdigest()[:16]
+    return cache_dir() / AGENT_INDEX_DIR / f"{key}.json"
+
+
+def _scan_markdown_files(folder: Path) -> Iterator[Tuple[str, os.stat_result]]:
+    """以 os.scandir 走訪目錄，產出 (路徑, stat) ；與 rglob 相同不跟隨目錄符號連結。"""
+    stack = [str(folder)]
+    while stack:
+        try:
+            it = os.scandir(stack.pop())
+        except OSError:
+            continue
+        with it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.name.endswith(".md") and entry.is_file():
+                        yield entry.path, entry.stat()
+                except OSError:
+                    continue
+
+
 def build_workflow_agent_index(folder: Path) -> Tuple[Dict[str, Set[Path]], Dict[Path, Set[str]]]:
-    """建立目標 workflows 目錄的 agent 與檔案對應表。"""
+    """建立目標 workflows 目錄的 agent 與檔案對應表。
+
+    解析結果依 (大小, mtime_ns) 持久化於快取目錄，只重新讀取有變動的檔案。
+    """
     agent_to_files: Dict[str, Set[Path]] = {}
     file_to_agents: Dict[Path, Set[str]] = {}
 
-    for md_file in folder.rglob("*.md"):
-        if not md_file.is_file():
-            continue
+    index_path = _agent_index_path(folder)
+    cached = _agent_index_memo.get(index_path)
+    if cached is None:
+        cached = load_json_file(index_path).get("files")
+        if not isinstance(cached, dict):
+            cached = {}
+
+    files: Dict[str, list] = {}
+    racy_after = time.time_ns() - DIGEST_RACY_WINDOW * 1_000_000_000
+    for key, st in _scan_markdown_files(folder):
+        entry = cached.get(key)
+        if isinstance(entry, list) and len(entry) == 3 and entry[:2] == [st.st_size, st.st_mtime_ns]:
+            names = entry[2]
+        else:
+            try:
+                with open(key, encoding="utf-8") as f:
+                    names = sorted(extract_agent_names_from_markdown(f.read()))
+            except Exception:
+                continue
+            # 剛修改的檔案可能在同一 mtime 內再次變動，不記錄其 stat 以便下次重新解析
+            if st.st_mtime_ns > racy_after:
+                files[key] = [-1, -1, names]
+                continue
+        files[key] = [st.st_size, st.st_mtime_ns, names]
+
+    if files != cached:
         try:
-            text = md_file.read_text(encoding="utf-8")
-        except Exception:
-            continue
-        agents = extract_agent_names_from_markdown(text)
-        if not agents:
+            write_private_json(index_path, {"root": str(folder), "files": files})
+        except OSError:
+            pass
+    _agent_index_memo[index_path] = files
+
+    for key, (_, _, names) in files.items():
+        if not names:
             continue
+        md_file = Path(key)
+        agents = set(names)
         file_to_agents[md_file] = agents
         for agent in agents:
             agent_to_files.setdefault(agent, set()).add(md_file)
@@ -453,6 +1058,24 @@ def build_workflow_agent_index(folder: Path) -> Tuple[Dict[str, Set[Path]], Dict
     return agent_to_files, file_to_agents
 
 
+def global_rules_targets() -> Dict[str, Path]:
+    """各編輯器全域規則檔的目標路徑"""
+    return {
+        "Cursor": Path.home() / ".cursor/AGENTS.md",
+        "Windsurf": Path.home() / ".codeium/windsurf/memories/global_rules.md",
+        "Claude": Path.home() / ".claude/CLAUDE.md",
+        "Antigravity": Path.home() / ".gemini/GEMINI.md"
+    }
+
+
+def workflow_targets() -> Dict[str, Path]:
+    """各系統 workflows 的目標資料夾"""
+    return {
+        "Windsurf": Path.home() / ".codeium/windsurf/global_workflows",
+        "Antigravity": Path.home() / ".gemini/antigravity/global_workflows"
+    }
+
+
 def sync_global_rules():
     """同步全域規則檔案（僅在內容不同時更新）"""
     source = Path(__file__).parent / "global_rules.md"
@@ -460,51 +1083,79 @@ def sync_global_rules():
         print("跳過全域規則同步（檔案不存在）")
         return
 
-    targets = {
-        "Cursor": Path.home() / ".cursor/AGENTS.md",
-        "Windsurf": Path.home() / ".codeium/windsurf/memories/global_rules.md",
-        "Claude": Path.home() / ".claude/CLAUDE.md",
-        "Antigravity": Path.home() / ".gemini/GEMINI.md"
-    }
+    targets = global_rules_targets()
 
-    for editor, target in targets.items():
-        try:
-            target.parent.mkdir(parents=True, exist_ok=True)
+    manifest = load_manifest("rules")
 
-            # 比對檔案內容
-            if files_are_identical(source, target):
-                print(f"⊜ {editor} 全域規則: 內容相同，跳過更新")
-            else:
-                shutil.copy2(source, target)
-                print(f"✓ {editor} 全域規則: {target}")
-        except Exception as e:
-            print(f"✗ {editor} 全域規則失敗: {e}")
+    link_mode = get_link_mode()
 
+    def copy_rules(item: Tuple[str, Path]) -> bool:
+        editor, target = item
+        with span(editor, kind="target", path=str(target)):
+            # 來源與目標的 stat、部署方式都與部署紀錄一致時，直接跳過
+            if manifest.is_current(target, source=source, link_mode=link_mode):
+                return False
 
-def _sync_workflows_impl(source_dir: Path, target_root: Path, system_name: str):
-    """實際執行 workflow 同步的內部函式"""
+            # 內容相同（或已連結）則不更新；hardlink / symlink 模式下內容相同的檔案改為連結
+            changed = deploy_file(source, target, link_mode)
+            manifest.record(target, source, written=changed, link_mode=link_mode)
+            return changed
+
+    for (editor, target), (copied, error) in zip(targets.items(), map_isolated(copy_rules, targets.items())):
+        if error is not None:
+            print(f"✗ {editor} 全域規則失敗: {error}")
+            count("targets_failed")
+        elif copied:
+            print(f"✓ {editor} 全域規則: {target}")
+        else:
+            print(f"⊜ {editor} 全域規則: 內容相同，跳過更新")
+    manifest.save()
+
+
+def _sync_workflows_impl(source_dir: Path, target_root: Path, system_name: str,
+                         log: Callable[[str], None] = print,
+                         only: Optional[Set[Path]] = None):
+    """實際執行 workflow 同步的內部函式
+
+    先依序處理 agent 重複的舊檔（需維護索引，無法並行），
+    再並行比對/複製各檔案；所有訊息依來源順序交給 log 輸出。
+    指定 only 時只處理其中的來源檔（已刪除者則移除對應的目標），不走訪來源目錄。
+    """
     if not source_dir.exists() or not source_dir.is_dir():
-        print(f"跳過 {system_name} workflows 同步（來源資料夾不存在）")
+        log(f"跳過 {system_name} workflows 同步（來源資料夾不存在）")
         return
 
     try:
         target_root.mkdir(parents=True, exist_ok=True)
     except Exception as e:
-        print(f"✗ 建立 {system_name} workflows 目標目錄失敗: {e}")
+        log(f"✗ 建立 {system_name} workflows 目標目錄失敗: {e}")
         return
 
     agent_to_files, file_to_agents = build_workflow_agent_index(target_root)
+    manifest = load_manifest(f"workflows-{system_name}")
+    link_mode = get_link_mode()
 
-    count = 0
-    for src in source_dir.rglob("*.md"):
+    if only is None:
+        sources = source_dir.rglob("*.md")
+    else:
+        sources = sorted(p for p in only if p.suffix == ".md" and source_dir in p.parents)
+
+    pending: List[Tuple[Path, Path, Set[str], bool]] = []
+    for src in sources:
         if not src.is_file():
             continue
         try:
             rel = src.relative_to(source_dir)
             dst = target_root / rel
-            dst.parent.mkdir(parents=True, exist_ok=True)
-            content = src.read_text(encoding="utf-8")
-            agents = extract_agent_names_from_markdown(content)
+            # 來源與目標都未變動時，直接沿用部署紀錄中的 agent 名稱，不讀取檔案
+            record = manifest.is_current(dst, source=src, link_mode=link_mode)
+            if record is not None and isinstance(record.get("agents"), list):
+                agents = set(record["agents"])
+            else:
+                record = None
+                text = src.read_text(encoding="utf-8")
+                add_bytes(read=len(text))
+                agents = extract_agent_names_from_markdown(text)
 
             # 若目標已有相同 agent 名稱，先移除舊檔
             files_to_remove: Set[Path] = set()
@@ -519,9 +1170,10 @@ def _sync_workflows_impl(source_dir: Path, target_root: Path, system_name: str):
                 try:
                     if old.exists():
                         old.unlink()
-                        print(f"↻ [{system_name}] 移除舊版 workflow (agent 重複): {old}")
+                        manifest.forget(old, removed=True)
+                        log(f"↻ [{system_name}] 移除舊版 workflow (agent 重複): {old}")
                 except Exception as e:
-                    print(f"✗ [{system_name}] 無法移除舊 workflow {old}: {e}")
+                    log(f"✗ [{system_name}] 無法移除舊 workflow {old}: {e}")
                     continue
                 for agent in file_to_agents.get(old, set()):
                     files = agent_to_files.get(agent)
@@ -531,42 +1183,77 @@ def _sync_workflows_impl(source_dir: Path, target_root: Path, system_name: str):
                             agent_to_files.pop(agent, None)
                 file_to_agents.pop(old, None)
 
-            # 比對檔案內容
-            if files_are_identical(src, dst):
-                print(f"⊜ {system_name} workflow: 內容相同，跳過 {dst}")
-            else:
-                shutil.copy2(src, dst)
-                print(f"✓ {system_name} workflow: {dst}")
-
             # 更新索引（無論是否更新，都要維護索引）
             if agents:
                 file_to_agents[dst] = agents
                 for agent in agents:
                     agent_to_files.setdefault(agent, set()).add(dst)
 
-            count += 1
+            pending.append((src, dst, agents, record is not None))
         except Exception as e:
-            print(f"✗ [{system_name}] 複製失敗 {src} -> {e}")
-
-    if count == 0:
-        print(f"注意: {system_name} workflows 來源目錄內未找到任何 .md 檔")
-
-
-def sync_workflows():
+            log(f"✗ [{system_name}] 複製失敗 {src} -> {e}")
+            count("targets_failed")
+
+    def copy_workflow(job: Tuple[Path, Path, Set[str], bool]) -> str:
+        src, dst, agents, unchanged = job
+        skipped = f"⊜ {system_name} workflow: 內容相同，跳過 {dst}"
+        if unchanged:
+            return skipped
+        # 比對檔案內容（大小與快取的雜湊，未變動的檔案不需讀取）；連結模式下只需 stat
+        if not needs_deploy(src, dst, link_mode):
+            manifest.record(dst, src, written=False, agents=sorted(agents), link_mode=link_mode)
+            return skipped
+        place_file(src, dst, link_mode)
+        manifest.record(dst, src, agents=sorted(agents), link_mode=link_mode)
+        return f"✓ {system_name} workflow: {dst}"
+
+    for (src, *_), (message, error) in zip(pending, map_isolated(copy_workflow, pending)):
+        log(message if error is None else f"✗ [{system_name}] 複製失敗 {src} -> {error}")
+        if error is not None:
+            count("targets_failed")
+    manifest.save()
+
+    # 移除來源已刪除、由本工具部署且未被修改的 workflow（依部署紀錄，不走訪目錄）
+    orphans = manifest.orphans(target_root)
+    if only is not None:
+        removed_sources = {str(p) for p in only}
+        orphans = [t for t in orphans if (manifest.get(t) or {}).get("source") in removed_sources]
+    for old, result in remove_deployed(manifest, orphans):
+        if result == "removed":
+            log(f"🗑 [{system_name}] 來源已刪除，移除 workflow: {old}")
+        elif result == "modified":
+            log(f"⚠ [{system_name}] 來源已刪除但目標已被修改，保留: {old}")
+        elif result != "missing":
+            log(f"✗ [{system_name}] 無法移除 {old}: {result}")
+
+    if not pending and only is None:
+        log(f"注意: {system_name} workflows 來源目錄內未找到任何 .md 檔")
+
+
+def sync_workflows(only: Optional[Set[Path]] = None):
     """同步 workflows 目錄下的所有 .md 到各系統 (Windsurf, Antigravity) 的目標資料夾。
     - 來源: <repo>/workflows/**/*.md
     - 目標 Windsurf: ~/.codeium/windsurf/global_workflows/
     - 目標 Antigravity: ~/.gemini/antigravity/global_workflows/
+    各目標並行同步，輸出依目標順序整段列印；指定 only 時只同步其中的來源檔。
     """
     source_dir = Path(__file__).parent / "workflows"
-    
-    targets = {
-        "Windsurf": Path.home() / ".codeium/windsurf/global_workflows",
-        "Antigravity": Path.home() / ".gemini/antigravity/global_workflows"
-    }
-
-    for system_name, target_root in targets.items():
-        _sync_workflows_impl(source_dir, target_root, system_name)
+    targets = workflow_targets()
+
+    def sync_target(item: Tuple[str, Path]) -> List[str]:
+        system_name, target_root = item
+        lines: List[str] = []
+        with span(system_name, kind="target", path=str(target_root)):
+            _sync_workflows_impl(source_dir, target_root, system_name, lines.append, only)
+        return lines
+
+    for system_name, (lines, error) in zip(targets, map_isolated(sync_target, targets.items())):
+        if error is not None:
+            print(f"✗ [{system_name}] workflows 同步失敗: {error}")
+            count("targets_failed")
+            continue
+        for line in lines:
+            print(line)
 
 
 def print_banner():
@@ -694,7 +1381,8 @@ def filter_config_by_selection(config: dict, selected_mcps: List[str]) -> dict:
     return {'mcpServers': filtered_servers}
 
 
-def run_selective_sync_mcp(config: dict, temp_path: Path) -> int:
+def run_selective_sync_mcp(config: dict,
+                           inventory: Optional[ClaudeCliInventory] = None) -> int:
     """執行選擇性 MCP 同步"""
     print("\n📦 選擇性同步 MCP 配置...")
     
@@ -710,71 +1398,24 @@ def run_selective_sync_mcp(config: dict, temp_path: Path) -> int:
     # 過濾配置
     filtered_config = filter_config_by_selection(config, selected_mcps)
     
-    # 創建臨時配置檔案
-    import json
-    filtered_temp = temp_path.parent / f"filtered_{temp_path.name}"
-    try:
-        with open(filtered_temp, 'w', encoding='utf-8') as f:
-            json.dump(filtered_config, f, indent=2)
-        
-        # 同步到編輯器
-        success_count = sync_to_editors(filtered_config, filtered_temp)
-        
-        # 同步到 Claude CLI (只同步選中的)
-        print(f"\n正在同步選中的 MCP 到 Claude CLI...")
-        for name in selected_mcps:
-            server_config = config.get('mcpServers', {}).get(name, {})
-            if server_config.get('disabled', False):
-                print(f"⊜ 跳過已停用: {name}")
-                continue
-            
-            try:
-                cmd = ['claude', 'mcp', 'add', '--scope', 'user']
-                
-                server_url = server_config.get('serverUrl') or server_config.get('url')
-                if server_url:
-                    cmd.extend(['--transport', 'http', name, server_url])
-                    headers = server_config.get('headers') or {}
-                    if isinstance(headers, dict):
-                        for k, v in headers.items():
-                            cmd.extend(['--header', f"{k}: {v}"])
-                else:
-                    command = server_config.get('command')
-                    args = server_config.get('args', []) or []
-                    if command:
-                        cmd.extend([name, "--", command])
-                        for arg in args:
-                            if arg != '-y':
-                                cmd.append(arg)
-                    else:
-                        print(f"⚠ {name}: 無效的配置")
-                        continue
-                
-                result = subprocess.run(cmd, capture_output=True, text=True, check=False)
-                if result.returncode == 0:
-                    print(f"✓ Claude CLI 已添加: {name}")
-                elif "already exists" in str(result.stderr):
-                    print(f"⊜ Claude CLI 已存在: {name}")
-                else:
-                    print(f"✗ Claude CLI 失敗: {name} - {result.stderr}")
-            except Exception as e:
-                print(f"✗ Claude CLI 錯誤: {name} - {e}")
-        
-        return success_count
-        
-    finally:
-        if filtered_temp.exists():
-            filtered_temp.unlink()
+    # 同步到編輯器與 Claude CLI (只同步選中的)
+    if inventory is None:
+        inventory = ClaudeCliInventory()
+    return sync_to_editors(filtered_config, render_config(filtered_config), inventory)
 
 
-def run_sync_mcp(config: dict, temp_path: Path) -> int:
+def run_sync_mcp(config: dict, rendered: bytes,
+                 inventory: Optional[ClaudeCliInventory] = None) -> int:
     """執行 MCP 配置同步"""
     print("\n📦 同步 MCP 配置...")
-    success_count = sync_to_editors(config, temp_path)
+    # 同步與清理共用同一份 Claude CLI 清單，只查詢一次
+    if inventory is None:
+        inventory = ClaudeCliInventory()
+    success_count = sync_to_editors(config, rendered, inventory)
     
     # 清理多餘 MCP
     try:
-        removed = prune_claude_cli(config)
+        removed = prune_claude_cli(config, inventory=inventory)
         if removed:
             print(f"已清理多餘 MCP: {', '.join(removed)}")
     except Exception as e:
@@ -789,16 +1430,412 @@ def run_sync_rules():
     sync_global_rules()
 
 
-def run_sync_workflows():
+def run_sync_workflows(only: Optional[Set[Path]] = None):
     """執行 Workflows 同步"""
     print("\n🤖 同步 Workflows...")
-    sync_workflows()
+    sync_workflows(only)
+
+
+def run_daemon() -> None:
+    """以常駐程序提供 sync / status / diff（見 sync_daemon.py）
+
+    環境變數、Claude CLI 清單、部署紀錄與 agent 索引保留在記憶體中；
+    .env、login shell 設定檔、Claude 設定檔或部署紀錄檔變動時才捨棄對應的快取。
+    """
+    root = Path(__file__).parent
+    workflows_dir = root / "workflows"
+    env_files = [root / ".env", Path.home() / ".env"]
+    inventory = ClaudeCliInventory()
+
+    def env_signature() -> Dict[str, Optional[List[int]]]:
+        # 由 login shell 匯入的變數同樣留在 os.environ 中，shell 設定檔變動（例如更換 token）也要重新載入
+        return {
+            **_config_files_signature(env_files),
+            **_config_files_signature(_login_shell_config_files(_login_shell())),
+        }
+
+    signatures = {"env": env_signature(), "claude": _stat_signature(claude_config_path())}
+
+    def refresh() -> None:
+        forget_changed_manifests()
+        current_env = env_signature()
+        if current_env != signatures["env"]:
+            forget_loaded_env()
+            signatures["env"] = current_env
+        claude_signature = _stat_signature(claude_config_path())
+        if claude_signature != signatures["claude"]:
+            inventory.invalidate()
+            signatures["claude"] = claude_signature
+
+    def workflow_file(name: str) -> Path:
+        # 用戶端傳入的是 resolve 後的路徑，轉回與部署紀錄相同的形式
+        path = Path(name)
+        try:
+            return workflows_dir / path.relative_to(workflows_dir.resolve())
+        except ValueError:
+            return path
+
+    def handle_sync(args: dict) -> int:
+        refresh()
+        phases = set(args.get("phases") or ("mcp", "rules", "workflows"))
+        with journal_sync("sync_mcp.py", _sync_kind("daemon", phases)):
+            if "mcp" in phases:
+                with phase("mcp"):
+                    config, rendered = process_config()
+                    run_sync_mcp(config, rendered, inventory)
+            if "rules" in phases:
+                with phase("rules"):
+                    run_sync_rules()
+            if "workflows" in phases:
+                files = args.get("files")
+                with phase("workflows"):
+                    run_sync_workflows({workflow_file(f) for f in files} if files else None)
+        commit_generation("sync_daemon.py sync " + " ".join(sorted(phases)))
+        save_digest_cache()
+        signatures["claude"] = _stat_signature(claude_config_path())
+        return 0
+
+    def handle_status(args: dict) -> int:
+        print("\n📋 Claude MCP（依設定檔）:")
+        show_claude_status_from_config()
+        show_deploy_status()
+        return 0
+
+    def handle_diff(args: dict) -> int:
+        refresh()
+        return run_diff(inventory)
+
+    print(f"⚡ 常駐程序啟動（pid {os.getpid()}），以 python sync_daemon.py sync|status|diff|stop 操作")
+    try:
+        serve_daemon({"sync": handle_sync, "status": handle_status, "diff": handle_diff})
+    except RuntimeError as e:
+        print(f"✗ {e}")
+        sys.exit(1)
+    except KeyboardInterrupt:
+        print("\n👋 常駐程序已結束")
+
+
+def _watched_sources() -> Tuple[Path, Path, Path, Set[Path]]:
+    """回傳 (mcp_config.json, global_rules.md, workflows/, .env 檔) 的路徑"""
+    root = Path(__file__).parent
+    return (root / "mcp_config.json", root / "global_rules.md", root / "workflows",
+            {root / ".env", Path.home() / ".env"})
+
+
+def plan_changed_sync(changed: Set[Path]) -> Tuple[Set[str], Optional[Set[Path]]]:
+    """依變動的檔案決定要執行的部分，回傳 (mcp / rules / workflows, 需同步的 workflow 來源檔)
+
+    workflow 來源檔為 None 表示需完整同步（例如只知道 workflows 目錄本身有變動）。
+    """
+    config_path, rules_path, workflows_dir, env_files = _watched_sources()
+    phases: Set[str] = set()
+    if changed & ({config_path} | env_files):
+        phases.add("mcp")
+    if rules_path in changed:
+        phases.add("rules")
+    workflow_files: Optional[Set[Path]] = {p for p in changed if workflows_dir in p.parents}
+    if workflows_dir in changed:
+        workflow_files = None
+        phases.add("workflows")
+    elif workflow_files:
+        phases.add("workflows")
+    return phases, workflow_files
+
+
+def _sync_kind(prefix: str, phases: Set[str]) -> str:
+    """執行紀錄的類型，例如 watch:rules；三個部分都同步時為 prefix:all。"""
+    return f"{prefix}:{'all' if phases >= {'mcp', 'rules', 'workflows'} else '+'.join(sorted(phases))}"
+
+
+def run_changed_sync(changed: Set[Path], journal: Optional[str] = None) -> None:
+    """只重新執行與變動檔案相關的部分；workflows 只同步（或移除）變動的檔案。
+
+    指定 journal 時（例如 watch），本次同步以「journal:階段」為類型另寫一筆執行紀錄。
+    """
+    _, _, _, env_files = _watched_sources()
+    phases, workflow_files = plan_changed_sync(changed)
+    if not phases:
+        print("沒有需要同步的變動")
+        return
+    if changed & env_files:
+        forget_loaded_env()
+    with (journal_sync("sync_mcp.py", _sync_kind(journal, phases)) if journal
+          else contextlib.nullcontext()):
+        if "mcp" in phases:
+            with phase("mcp"):
+                config, rendered = process_config()
+                run_sync_mcp(config, rendered)
+        if "rules" in phases:
+            with phase("rules"):
+                run_sync_rules()
+        if "workflows" in phases:
+            with phase("workflows"):
+                run_sync_workflows(workflow_files)
+
+
+def git_changed_files(rev: str) -> Set[Path]:
+    """以 git diff --name-only 取得自 rev 以來（含工作目錄）變動的檔案，回傳絕對路徑。"""
+    root = Path(__file__).parent
+    top = run_process(
+        ["git", "-C", str(root), "rev-parse", "--show-toplevel"],
+        capture_output=True, text=True, check=True,
+    ).stdout.strip()
+    output = run_process(
+        ["git", "-C", top, "diff", "--name-only", "-z", "--no-renames", rev, "--"],
+        capture_output=True, text=True, check=True,
+    ).stdout
+    # 與其他路徑相同以 Path(__file__).parent 為基準，避免 symlink 造成比對不一致
+    base = root / os.path.relpath(top, root.resolve())
+    return {Path(os.path.normpath(base / name)) for name in output.split("\0") if name}
+
+
+def run_changed_since(rev: str) -> int:
+    """只同步自 rev 以來變動的部分；常駐程序執行中時交由常駐程序處理。"""
+    try:
+        changed = git_changed_files(rev)
+    except (OSError, subprocess.CalledProcessError) as e:
+        detail = getattr(e, "stderr", "") or str(e)
+        print(f"✗ 無法取得自 {rev} 以來的變動: {detail.strip()}")
+        return 1
+
+    phases, workflow_files = plan_changed_sync(changed)
+    if not phases:
+        print(f"⊜ 自 {rev} 以來沒有需要同步的變動")
+        return 0
+
+    if daemon_is_running():
+        request: dict = {"phases": sorted(phases)}
+        if workflow_files is not None:
+            request["files"] = sorted(str(p.resolve()) for p in workflow_files)
+        response = call_daemon("sync", request)
+        sys.stdout.write(response.get("output", ""))
+        return int(response.get("exit", 0))
+
+    mark_sync_run("changed-since")
+    run_changed_sync(changed)
+    return 0
+
+
+HOOK_MARKER = "# mcp_rule_config: sync_mcp.py --install-hooks"
+HOOK_SCRIPTS = {
+    "post-merge": '{python} {script} --changed-since ORIG_HEAD',
+    # 只在切換分支時同步（$3 = 1）；$1 為切換前的 HEAD
+    "post-checkout": '[ "$3" = "1" ] || exit 0\n{python} {script} --changed-since "$1"',
+}
+
+
+def install_git_hooks() -> int:
+    """安裝 post-merge / post-checkout hook，在 pull 或切換分支後只同步變動的部分。"""
+    root = Path(__file__).parent
+    try:
+        hooks_dir = Path(run_process(
+            ["git", "-C", str(root), "rev-parse", "--git-path", "hooks"],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip())
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(f"✗ 找不到 git hooks 目錄: {e}")
+        return 1
+    if not hooks_dir.is_absolute():
+        hooks_dir = root / hooks_dir
+    hooks_dir.mkdir(parents=True, exist_ok=True)
+
+    failed = 0
+    for name, command in HOOK_SCRIPTS.items():
+        hook = hooks_dir / name
+        if hook.exists() and HOOK_MARKER not in hook.read_text(encoding="utf-8", errors="replace"):
+            print(f"⚠ 已存在其他 {name} hook，未覆寫: {hook}")
+            failed += 1
+            continue
+        # 直譯器或腳本路徑可能含空白，需以 shell 引號包住
+        body = command.format(
+            python=shlex.quote(sys.executable), script=shlex.quote(str(Path(__file__).resolve()))
+        )
+        hook.write_text(f"#!/bin/sh\n{HOOK_MARKER}\n{body}\n", encoding="utf-8")
+        hook.chmod(0o755)
+        print(f"✓ 已安裝 {name} hook: {hook}")
+    return 1 if failed else 0
+
+
+def run_watch() -> None:
+    """持續監看設定檔、全域規則、workflows 與 .env，變動時只重新執行受影響的部分
+
+    - mcp_config.json / .env 變動：重新處理配置並同步 MCP
+    - global_rules.md 變動：同步全域規則
+    - workflows/ 內的檔案變動：只同步（或移除）變動的 workflow
+    """
+    config_path, rules_path, workflows_dir, env_files = _watched_sources()
+
+    watcher = open_watcher([config_path, rules_path, *env_files], [workflows_dir], WATCH_POLL_INTERVAL)
+    print(f"👀 監看變動中（{watcher.name}），按 Ctrl+C 結束...")
+    print(f"   {config_path}\n   {rules_path}\n   {workflows_dir}/\n   " + "\n   ".join(map(str, sorted(env_files))))
+
+    try:
+        for changed in watch_changes(watcher, WATCH_DEBOUNCE):
+            print(f"\n[{time.strftime('%H:%M:%S')}] 偵測到 {len(changed)} 個檔案變動")
+            # 其他行程（例如 sync_workflows.py --deploy）可能已改寫部署紀錄
+            forget_changed_manifests()
+            try:
+                # 事件佇列溢位時只知道 workflows 目錄本身有變動，會完整同步一次
+                run_changed_sync(changed, journal="watch")
+            except SystemExit:
+                print("✗ 本次同步失敗，繼續監看")
+            except Exception as e:
+                print(f"✗ 同步失敗: {e}")
+            # 常駐執行：每批變動後即寫回部署世代與雜湊快取，不等到行程結束
+            commit_generation()
+            save_digest_cache()
+    except KeyboardInterrupt:
+        print("\n👋 結束監看")
+
+
+def show_claude_status_from_config() -> None:
+    """解析 Claude 設定檔列出 user scope 的 MCP，並與 mcp_config.json 比對（不做健康檢查）。"""
+    path = claude_config_path()
+    if not path.exists():
+        print(f"⚠ 找不到 Claude 設定檔: {path}")
+        return
+
+    registered = read_claude_user_servers(path)
+    # 只需名稱，不展開環境變數
+    desired = desired_mcp_names(load_json_file(Path(__file__).parent / "mcp_config.json"))
+
+    for name, spec in registered.items():
+        if spec.get("url"):
+            target = spec["url"]
+        else:
+            target = " ".join([str(spec.get("command", "?")), *map(str, spec.get("args") or [])])
+        kind = spec.get("type") or ("http" if spec.get("url") else "stdio")
+        if name in desired:
+            print(f"  ✓ {name}: {target} ({kind})")
+        else:
+            print(f"  ○ {name}: {target} ({kind}) - 不在 mcp_config.json，同步時將被移除")
+    for name in sorted(desired - set(registered)):
+        print(f"  ⚠ {name}: 尚未註冊")
+    print(f"共 {len(registered)} 個 (來源: {path})")
+
+
+def show_deploy_status() -> None:
+    """依部署紀錄 (manifest) 顯示各目標狀態，只需 stat，不走訪目錄。"""
+    manifests = [m for m in list_manifests() if m.entries()]
+    if not manifests:
+        print("\n📁 尚無部署紀錄")
+        return
+
+    labels = {"ok": "✓", "modified": "⚠ 已被修改", "missing": "✗ 已不存在"}
+    print("\n📁 部署紀錄:")
+    for manifest in manifests:
+        counts = {"ok": 0, "modified": 0, "missing": 0}
+        problems: List[str] = []
+        for target in sorted(manifest.entries()):
+            state = manifest.status(Path(target))
+            counts[state] = counts.get(state, 0) + 1
+            if state != "ok":
+                problems.append(f"     {labels.get(state, state)}: {target}")
+        print(f"  {manifest.name}: {sum(counts.values())} 個目標 "
+              f"(✓ {counts['ok']} / ⚠ {counts['modified']} / ✗ {counts['missing']})")
+        for line in problems:
+            print(line)
+
+
+def diff_deployment(config: dict, rendered: bytes,
+                    inventory: Optional[ClaudeCliInventory] = None) -> List[Tuple[str, str]]:
+    """列出同步時會變更的目標，不實際寫入：[(A 新增 / M 修改 / D 移除, 目標)]。"""
+    changes: List[Tuple[str, str]] = []
+
+    for target in editor_config_targets().values():
+        if not bytes_match_file(rendered, target):
+            changes.append(("M" if target.exists() else "A", str(target)))
+
+    if inventory is None:
+        inventory = ClaudeCliInventory()
+    to_add, to_readd = plan_claude_cli_sync(config, inventory)
+    changes.extend(("A", f"claude:{name}") for name in sorted(to_add))
+    changes.extend(("M", f"claude:{name}") for name in sorted(to_readd))
+    changes.extend(("D", f"claude:{name}") for name in sorted(inventory.names() - desired_mcp_names(config)))
+
+    root = Path(__file__).parent
+    rules = root / "global_rules.md"
+    if rules.exists():
+        for target in global_rules_targets().values():
+            if needs_deploy(rules, target):
+                changes.append(("M" if target.exists() else "A", str(target)))
+
+    source_dir = root / "workflows"
+    sources = sorted(source_dir.rglob("*.md")) if source_dir.is_dir() else []
+    for system_name, target_root in workflow_targets().items():
+        for src in sources:
+            dst = target_root / src.relative_to(source_dir)
+            if needs_deploy(src, dst):
+                changes.append(("M" if dst.exists() else "A", str(dst)))
+        manifest = load_manifest(f"workflows-{system_name}")
+        changes.extend(("D", str(t)) for t in manifest.orphans(target_root) if manifest.status(t) == "ok")
+
+    return changes
+
+
+def run_diff(inventory: Optional[ClaudeCliInventory] = None) -> int:
+    """顯示同步時會變更的目標；有差異時回傳 1。"""
+    config, rendered = process_config()
+    changes = diff_deployment(config, rendered, inventory)
+    if not changes:
+        print("✓ 所有目標皆與來源一致")
+        return 0
+    for flag, target in changes:
+        print(f"  {flag}  {target}")
+    print(f"共 {len(changes)} 個目標將被變更")
+    return 1
+
+
+def show_generations() -> None:
+    """列出部署世代（最新在後），標示目前使用中的世代。"""
+    generations = list_generations()
+    if not generations:
+        print("\n🗂️  尚無部署世代")
+        return
+
+    current = current_generation()
+    print("\n🗂️  部署世代:")
+    for gen_id in generations:
+        data = load_generation(gen_id)
+        created = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(data.get("created_at", 0)))
+        marker = "→" if gen_id == current else " "
+        print(f"  {marker} #{gen_id:<5} {created}  {len(data.get('targets', {}))} 個目標  {data.get('command', '')}")
+
+
+def run_rollback(gen_id: Optional[int] = None) -> None:
+    """切換到指定世代；未指定時切換回目前世代的上一個世代。"""
+    if gen_id is None:
+        current = current_generation()
+        gen_id = load_generation(current).get("parent") if current is not None else None
+        if gen_id is None:
+            print("✗ 沒有可以回復的上一個世代")
+            return
+
+    print(f"\n⏪ 切換到部署世代 #{gen_id}...")
+    try:
+        changed, problems = switch_generation(gen_id)
+    except ValueError as e:
+        print(f"✗ {e}")
+        return
+    for target in changed:
+        print(f"✓ {target}")
+    for problem in problems:
+        print(f"⚠ {problem}")
+    print(f"✓ 已切換到世代 #{gen_id}（變更 {len(changed)} 個目標）")
+
+
+def run_gc_generations(keep: int) -> None:
+    removed_generations, removed_objects = gc_generations(keep)
+    print(f"🧹 已移除 {removed_generations} 個世代、{removed_objects} 個未引用的物件")
 
 
 def run_show_claude_status():
     """顯示 Claude CLI MCP 狀態"""
     print("\n📊 目前 Claude CLI MCP 伺服器:")
-    subprocess.run(['claude', 'mcp', 'list'], check=False)
+    if claude_inventory_source() == "file":
+        show_claude_status_from_config()
+    else:
+        run_process([CLAUDE_EXECUTABLE, 'mcp', 'list'], check=False)
 
 
 def run_clean_claude_mcps():
@@ -816,7 +1853,7 @@ def interactive_mode():
     """互動式選單模式"""
     print_banner()
     
-    temp_path = None
+    rendered = None
     config = None
     
     try:
@@ -829,43 +1866,51 @@ def interactive_mode():
             
             elif choice == '1':
                 # 同步全部
-                if config is None:
-                    config, temp_path = process_config()
-                    print("✓ 配置檔案處理完成")
-                
-                run_sync_mcp(config, temp_path)
-                run_sync_rules()
-                run_sync_workflows()
-                run_show_claude_status()
+                with journal_sync("sync_mcp.py", "interactive:all"):
+                    if config is None:
+                        config, rendered = process_config()
+                        print("✓ 配置檔案處理完成")
+                    
+                    with phase("mcp"):
+                        run_sync_mcp(config, rendered)
+                    with phase("rules"):
+                        run_sync_rules()
+                    with phase("workflows"):
+                        run_sync_workflows()
+                    run_show_claude_status()
                 print("\n✅ 全部同步完成！")
             
             elif choice == '2':
                 # 同步所有 MCP
-                if config is None:
-                    config, temp_path = process_config()
-                    print("✓ 配置檔案處理完成")
-                
-                success = run_sync_mcp(config, temp_path)
+                with journal_sync("sync_mcp.py", "interactive:mcp"):
+                    if config is None:
+                        config, rendered = process_config()
+                        print("✓ 配置檔案處理完成")
+                    
+                    success = run_sync_mcp(config, rendered)
                 print(f"\n✅ MCP 同步完成！成功: {success}/4 個目標")
             
             elif choice == '3':
                 # 選擇性同步 MCP
-                if config is None:
-                    config, temp_path = process_config()
-                    print("✓ 配置檔案處理完成")
-                
-                success = run_selective_sync_mcp(config, temp_path)
+                with journal_sync("sync_mcp.py", "interactive:mcp-selective"):
+                    if config is None:
+                        config, rendered = process_config()
+                        print("✓ 配置檔案處理完成")
+                    
+                    success = run_selective_sync_mcp(config)
                 if success > 0:
                     print(f"\n✅ 選擇性 MCP 同步完成！成功: {success}/4 個目標")
             
             elif choice == '4':
                 # 只同步規則
-                run_sync_rules()
+                with journal_sync("sync_mcp.py", "interactive:rules"):
+                    run_sync_rules()
                 print("\n✅ 全域規則同步完成！")
             
             elif choice == '5':
                 # 只同步 Workflows
-                run_sync_workflows()
+                with journal_sync("sync_mcp.py", "interactive:workflows"):
+                    run_sync_workflows()
                 print("\n✅ Workflows 同步完成！")
             
             elif choice == '6':
@@ -883,55 +1928,80 @@ def interactive_mode():
     
     except KeyboardInterrupt:
         print("\n\n使用者中斷執行")
-    finally:
-        if temp_path and temp_path.exists():
-            temp_path.unlink()
 
 
 def batch_mode():
-    """批次模式 (原本的 main 流程)"""
-    temp_path = None
-    try:
-        print("開始同步 MCP 配置...")
+    """批次模式：各階段依相依關係並行執行
 
-        # 1. 處理配置檔案（創建臨時檔案）
-        config, temp_path = process_config()
+    config → editors / claude；rules、workflows 與 config 無關，和較慢的 Claude CLI 同步重疊執行；
+    status 等待所有階段完成。各階段輸出依下列順序整段列印，最後回報耗時與關鍵路徑。
+    """
+    inventory = ClaudeCliInventory()
+
+    def render(_: dict) -> Tuple[dict, bytes]:
+        # 處理配置檔案（只在記憶體中展開）
+        config, rendered = process_config()
         print("✓ 配置檔案處理完成")
+        return config, rendered
 
-        # 2. 同步到編輯器
-        success_count = sync_to_editors(config, temp_path)
+    def editors(done: dict) -> int:
+        config, rendered = done["config"]
+        return sync_to_editors(config, rendered, inventory, claude=False)
 
-        # 3. 刪除未列於設定檔中的 Claude CLI MCP
+    def claude(done: dict) -> int:
+        # 同步並刪除未列於設定檔中的 Claude CLI MCP（清單於本次執行只查詢一次）
+        config, _ = done["config"]
+        print("\n🤖 同步 Claude CLI MCP...")
+        synced = 0
+        try:
+            sync_to_claude_cli(config, inventory=inventory)
+            synced = 1
+        except Exception as e:
+            print(f"✗ Claude CLI: {e}")
+            count("targets_failed")
         try:
-            removed = prune_claude_cli(config)
+            removed = prune_claude_cli(config, inventory=inventory)
             if removed:
                 print(f"已清理多餘 MCP: {', '.join(removed)}")
         except Exception as e:
             print(f"清理多餘 MCP 時發生錯誤: {e}")
+        return synced
 
-        # 4. 同步全域規則
+    def rules(_: dict) -> None:
+        print("\n📋 同步全域規則...")
         sync_global_rules()
 
-        # 4.1 同步 Workflows (Windsurf & Antigravity)
+    def workflows(_: dict) -> None:
+        # Windsurf & Antigravity
+        print("\n📂 同步 Workflows...")
         sync_workflows()
 
-        print(f"\n同步完成！成功: {success_count}/4 個目標")
+    def status(done: dict) -> None:
+        print(f"\n同步完成！成功: {done['editors'] + done['claude']}/4 個目標")
+        run_show_claude_status()
 
-        # 5. 顯示 Claude CLI 狀態
-        print("\n目前 Claude CLI MCP 伺服器:")
-        subprocess.run(['claude', 'mcp', 'list'], check=False)
+    phases = [
+        Phase("config", render),
+        Phase("editors", editors, ["config"]),
+        Phase("rules", rules),
+        Phase("workflows", workflows),
+        Phase("claude", claude, ["config"]),
+        Phase("status", status, ["editors", "claude", "rules", "workflows"], capture=False),
+    ]
 
+    print("開始同步 MCP 配置...")
+    try:
+        results = run_phases(phases)
     except KeyboardInterrupt:
         print("\n使用者中斷執行")
         sys.exit(1)
-    except Exception as e:
-        print(f"執行錯誤: {e}")
+
+    print(format_phase_report(phases, results))
+    errors = [r.error for r in results.values() if r.error is not None]
+    if errors:
+        if not isinstance(errors[0], SystemExit):
+            print(f"執行錯誤: {errors[0]}")
         sys.exit(1)
-    finally:
-        # 清理臨時檔案
-        if temp_path and temp_path.exists():
-            temp_path.unlink()
-            print(f"已刪除臨時檔案: {temp_path}")
 
 
 def main():
@@ -954,6 +2024,41 @@ def main():
   python sync_mcp.py --mcp        # 只同步 MCP 配置
   python sync_mcp.py --rules      # 只同步全域規則
   python sync_mcp.py --workflows  # 只同步 Workflows
+  
+  # 以 8 個並行子程序註冊 Claude CLI MCP
+  python sync_mcp.py --batch --jobs 8
+  
+  # 直接寫入 ~/.claude.json，不逐一呼叫 claude 指令
+  python sync_mcp.py --batch --claude-backend file
+  
+  # 快速檢視已註冊的 MCP（解析設定檔，不做健康檢查）
+  python sync_mcp.py --status --inventory file
+  
+  # 常駐監看，檔案變動時只同步受影響的部分
+  python sync_mcp.py --watch
+  
+  # 只同步自指定版本以來變動的部分；安裝 git hook 讓 pull / 切換分支後自動執行
+  python sync_mcp.py --changed-since HEAD~1
+  python sync_mcp.py --install-hooks
+  
+  # 常駐程序：之後以 sync_daemon.py 快速同步
+  python sync_mcp.py --daemon &
+  python sync_daemon.py sync
+  
+  # 列出部署世代，並切換回上一個世代或指定世代
+  python sync_mcp.py --generations
+  python sync_mcp.py --rollback
+  python sync_mcp.py --rollback 12
+  
+  # 顯示各階段、目標與子程序的耗時摘要，並輸出 JSON
+  python sync_mcp.py --batch --timings
+  python sync_mcp.py --batch --timings timings.json
+  
+  # 檢視近期同步的耗時趨勢與退步的執行
+  python sync_mcp.py --history
+  
+  # 由 systemd timer 執行，並輸出 node_exporter textfile 指標
+  python sync_mcp.py --batch --metrics-file /var/lib/node_exporter/textfile/mcp_sync.prom
         """
     )
     
@@ -981,34 +2086,211 @@ def main():
         help='只同步 Workflows'
     )
     
+    parser.add_argument(
+        '--jobs', '-j',
+        type=int,
+        default=DEFAULT_CLAUDE_CLI_JOBS,
+        metavar='N',
+        help=f'同時執行的 Claude CLI 子程序數量 (預設: {DEFAULT_CLAUDE_CLI_JOBS})'
+    )
+    
+    parser.add_argument(
+        '--claude-backend',
+        choices=CLAUDE_BACKENDS,
+        default='cli',
+        help='Claude MCP 註冊方式: cli 呼叫 claude 指令 (預設)；'
+             'file 直接寫入 Claude 設定檔 ($CLAUDE_CONFIG_DIR/.claude.json 或 ~/.claude.json)'
+    )
+    
+    parser.add_argument(
+        '--claude-bin',
+        default='claude',
+        metavar='PATH',
+        help='cli 後端與清單查詢使用的 Claude 指令 (預設: claude)'
+    )
+    
+    parser.add_argument(
+        '--inventory',
+        choices=CLAUDE_INVENTORIES,
+        default='auto',
+        help='Claude MCP 清單來源: cli 使用 claude mcp list (含健康檢查)；'
+             'file 直接解析 Claude 設定檔；auto 隨 --claude-backend (預設)'
+    )
+    
+    parser.add_argument(
+        '--status',
+        action='store_true',
+        help='顯示 Claude CLI MCP 狀態；搭配 --mcp/--rules/--workflows 時於同步後顯示'
+    )
+    
+    parser.add_argument(
+        '--io-workers',
+        type=int,
+        default=DEFAULT_IO_WORKERS,
+        metavar='N',
+        help=f'同時進行檔案比對/寫入的執行緒數量 (預設: {DEFAULT_IO_WORKERS})'
+    )
+    parser.add_argument(
+        '--link-mode',
+        choices=LINK_MODES,
+        default='copy',
+        help='全域規則與 workflows 的部署方式：copy 複製、hardlink/symlink 直接連結來源'
+             '（在 IDE 中修改會改到來源）、reflink 與來源共用資料區塊 (預設: copy)'
+    )
+    
+    parser.add_argument(
+        '--refresh-env',
+        action='store_true',
+        help='忽略快取，重新從 login shell 擷取環境變數'
+    )
+    parser.add_argument(
+        '--watch',
+        action='store_true',
+        help='常駐監看 mcp_config.json、global_rules.md、workflows/ 與 .env，變動時只同步受影響的部分'
+    )
+    parser.add_argument(
+        '--changed-since',
+        metavar='REV',
+        help='以 git diff --name-only REV 判斷變動，只執行受影響的部分並只部署變動的 workflows'
+    )
+    parser.add_argument(
+        '--install-hooks',
+        action='store_true',
+        help='安裝 git post-merge / post-checkout hook，自動執行 --changed-since'
+    )
+    parser.add_argument(
+        '--daemon',
+        action='store_true',
+        help='以常駐程序執行，透過 sync_daemon.py 呼叫 sync/status/diff'
+    )
+    parser.add_argument(
+        '--diff',
+        action='store_true',
+        help='列出同步時會變更的目標，不實際寫入'
+    )
+    parser.add_argument(
+        '--generations',
+        action='store_true',
+        help='列出部署世代'
+    )
+    parser.add_argument(
+        '--rollback',
+        nargs='?',
+        type=int,
+        const=-1,
+        metavar='GEN',
+        help='將 MCP 配置、全域規則與 workflows 切換回指定世代（未指定時為上一個世代），不重新產生'
+    )
+    parser.add_argument(
+        '--gc',
+        nargs='?',
+        type=int,
+        const=GENERATION_KEEP,
+        metavar='KEEP',
+        help=f'只保留最近 KEEP 個部署世代並回收未引用的內容 (預設: {GENERATION_KEEP})'
+    )
+    parser.add_argument(
+        '--timings',
+        nargs='?',
+        const='',
+        metavar='FILE',
+        help='結束時顯示各階段、目標與子程序的耗時、讀寫量與結束碼，並將 JSON 寫入 FILE'
+             '（- 為標準輸出，此時其他輸出改到標準錯誤；未指定時寫入快取目錄的 timings/sync_mcp.json）'
+    )
+    parser.add_argument(
+        '--history',
+        nargs='?',
+        type=int,
+        const=20,
+        metavar='N',
+        help='顯示最近 N 次同步的耗時、子程序數與讀寫檔案數，並標示比近期中位數明顯退步的執行 (預設: 20)'
+    )
+    parser.add_argument(
+        '--metrics-file',
+        type=Path,
+        metavar='PATH',
+        help='每次同步（--batch、--mcp/--rules/--workflows、--changed-since、--watch、--daemon、互動選單）'
+             '結束後以原子方式寫入 Prometheus textfile 指標（供 node_exporter 讀取）；'
+             '--changed-since 交由常駐程序處理時，由常駐程序的 --metrics-file 寫入'
+    )
+    
     args = parser.parse_args()
+    if args.metrics_file and (
+        args.history is not None or args.install_hooks or args.diff or args.generations
+        or args.rollback is not None or args.gc is not None
+        or (args.status and not (args.batch or args.mcp or args.rules or args.workflows))
+    ):
+        parser.error('--metrics-file 只能用於同步，不能與 --history、--install-hooks、--diff、'
+                     '--generations、--rollback、--gc 或單獨的 --status 併用')
+    if args.timings is not None:
+        enable_timings("sync_mcp.py", args.timings or None)
+    
+    global CLAUDE_CLI_JOBS, CLAUDE_BACKEND, CLAUDE_EXECUTABLE, CLAUDE_INVENTORY, LOGIN_ENV_REFRESH
+    LOGIN_ENV_REFRESH = args.refresh_env
+    set_io_workers(args.io_workers)
+    set_link_mode(args.link_mode)
+    CLAUDE_CLI_JOBS = max(1, args.jobs)
+    CLAUDE_BACKEND = args.claude_backend
+    CLAUDE_EXECUTABLE = args.claude_bin
+    CLAUDE_INVENTORY = args.inventory
+    
+    if args.metrics_file:
+        # 只在寫入執行紀錄時呼叫：單次同步於結束時一次，--watch / 常駐程序 / 互動選單則每次同步一次
+        add_run_listener(lambda record: write_metrics_file(args.metrics_file, record))
     
     # 判斷執行模式
-    if args.batch:
+    if args.history is not None:
+        show_history("sync_mcp.py", args.history)
+    elif args.install_hooks:
+        sys.exit(install_git_hooks())
+    elif args.changed_since:
+        sys.exit(run_changed_since(args.changed_since))
+    elif args.daemon:
+        run_daemon()
+    elif args.diff:
+        sys.exit(run_diff())
+    elif args.watch:
+        run_watch()
+    elif args.generations or args.rollback is not None or args.gc is not None:
+        if args.rollback is not None:
+            run_rollback(None if args.rollback == -1 else args.rollback)
+        if args.gc is not None:
+            run_gc_generations(args.gc)
+        if args.generations:
+            show_generations()
+    elif args.status and not (args.batch or args.mcp or args.rules or args.workflows):
+        run_show_claude_status()
+        show_deploy_status()
+    elif args.batch:
+        mark_sync_run("batch")
         batch_mode()
     elif args.mcp or args.rules or args.workflows:
         # 部分同步模式
-        temp_path = None
-        try:
-            if args.mcp:
-                config, temp_path = process_config()
+        mark_sync_run("+".join(k for k in ("mcp", "rules", "workflows", "status") if getattr(args, k)))
+        if args.mcp:
+            with phase("mcp"):
+                config, rendered = process_config()
                 print("✓ 配置檔案處理完成")
-                run_sync_mcp(config, temp_path)
-            
-            if args.rules:
+                run_sync_mcp(config, rendered)
+        
+        if args.rules:
+            with phase("rules"):
                 run_sync_rules()
-            
-            if args.workflows:
+        
+        if args.workflows:
+            with phase("workflows"):
                 run_sync_workflows()
-            
-            print("\n✅ 同步完成！")
-        finally:
-            if temp_path and temp_path.exists():
-                temp_path.unlink()
+        
+        print("\n✅ 同步完成！")
+        if args.status:
+            # --status 搭配部分同步：同步完成後顯示狀態
+            run_show_claude_status()
+            show_deploy_status()
     else:
         # 預設進入互動式選單
         interactive_mode()
 
 
 if __name__ == "__main__":
-    main()
+    with record_run("sync_mcp.py"), report_on_exit():
+        main()
@@ -0,0 +1,87 @@
+"""
+Prometheus textfile 指標輸出（供 node_exporter 的 textfile collector 讀取）
+- --metrics-file PATH：每次同步（sync_mcp.py 各同步模式、sync_workflows.py --deploy/--clean/--prune）結束後，以原子方式（暫存檔 + rename）寫入 .prom 檔
+- 指標取自本次執行的紀錄 (見 sync_journal)：各階段耗時、同步/跳過/失敗的目標數、子程序數
+- 漂移數：依部署紀錄檢查目前已被修改或已不存在的目標（只需 stat）
+"""
+import sys
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from sync_io import atomic_write_bytes, list_manifests
+
+METRIC_PREFIX = "mcp_sync"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _value(value) -> str:
+    # 整數（例如 Unix 時間）完整輸出，避免 %g 截斷有效位數
+    return str(value) if isinstance(value, int) else repr(float(value))
+
+
+def _labels(labels: Dict[str, str]) -> str:
+    return "{" + ",".join(f'{k}="{_escape(str(v))}"' for k, v in labels.items()) + "}"
+
+
+def deployment_drift() -> Dict[str, int]:
+    """依所有部署紀錄統計目前已被修改 (modified) 或已不存在 (missing) 的目標數。"""
+    drift = {"modified": 0, "missing": 0}
+    for manifest in list_manifests():
+        for target in manifest.entries():
+            state = manifest.status(Path(target))
+            if state in drift:
+                drift[state] += 1
+    return drift
+
+
+def format_metrics(record: dict, drift: Optional[Dict[str, int]] = None) -> str:
+    """將一筆執行紀錄轉為 Prometheus 文字格式。"""
+    program = record.get("program", "")
+    base = {"program": program}
+    lines: List[str] = []
+
+    def metric(name: str, help_text: str, kind: str, samples: List[tuple]) -> None:
+        full = f"{METRIC_PREFIX}_{name}"
+        lines.append(f"# HELP {full} {help_text}")
+        lines.append(f"# TYPE {full} {kind}")
+        for labels, value in samples:
+            lines.append(f"{full}{_labels({**base, **labels})} {_value(value)}")
+
+    metric("last_run_timestamp_seconds", "最後一次同步開始的時間 (Unix 時間)", "gauge",
+           [({}, record.get("ts", 0))])
+    metric("last_run_success", "最後一次同步是否成功 (1 成功 / 0 失敗)", "gauge",
+           [({}, 1 if record.get("exit", 0) == 0 else 0)])
+    metric("last_run_exit_code", "最後一次同步的結束碼", "gauge",
+           [({}, record.get("exit", 0))])
+    metric("last_run_duration_seconds", "最後一次同步的總耗時", "gauge",
+           [({}, record.get("duration", 0.0))])
+    metric("last_run_phase_duration_seconds", "最後一次同步各階段的耗時", "gauge",
+           [({"phase": name}, seconds) for name, seconds in sorted((record.get("phases") or {}).items())])
+    metric("last_run_targets", "最後一次同步的目標數（synced 已更新 / skipped 未變動 / failed 失敗）", "gauge",
+           [({"result": "synced"}, record.get("targets_written", 0)),
+            ({"result": "skipped"}, record.get("targets_skipped", 0)),
+            ({"result": "failed"}, record.get("targets_failed", 0))])
+    # command="claude" 一律輸出（未啟動時為 0），其他指令有啟動才輸出，避免 claude 的序列時有時無
+    commands = {"claude": 0, **{key.split(":", 1)[1]: value
+                                for key, value in record.items() if key.startswith("subprocess:")}}
+    metric("last_run_subprocesses", "最後一次同步啟動的子程序數（依指令）", "gauge",
+           [({"command": name}, value) for name, value in sorted(commands.items())])
+    metric("last_run_bytes", "最後一次同步讀取 / 寫入的位元組數", "gauge",
+           [({"direction": "read"}, record.get("bytes_read", 0)),
+            ({"direction": "written"}, record.get("bytes_written", 0))])
+    if drift is not None:
+        metric("drift_targets", "部署後已被修改或已不存在的目標數", "gauge",
+               [({"state": state}, value) for state, value in sorted(drift.items())])
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics_file(path: Path, record: dict) -> None:
+    """以原子方式寫入 .prom 檔（node_exporter 不會讀到寫一半的檔案）；失敗時只提示。"""
+    try:
+        text = format_metrics(record, deployment_drift())
+        atomic_write_bytes(Path(path), text.encode("utf-8"), mode=0o644)
+    except OSError as e:
+        print(f"⚠ 無法寫入監控指標 {path}: {e}", file=sys.stderr)
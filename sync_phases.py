@@ -0,0 +1,172 @@
+"""
+批次同步的階段排程
+- 各階段宣告相依關係，相依的階段完成後立即在執行緒中並行執行
+- 各階段的輸出先各自緩衝，再依宣告順序整段列印，不會互相交錯
+- 回報總耗時、各階段耗時與關鍵路徑 (critical path)
+"""
+import io
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterable, List, Optional, TextIO, Tuple
+
+from sync_timing import bind, phase as timed_phase
+
+
+class Phase:
+    """一個同步階段：func 接收相依階段的結果 {名稱: 回傳值}。
+
+    capture=False 的階段直接輸出（例如子程序直接寫入終端機的狀態顯示），
+    開始前會先印出之前的階段；只適合相依於所有其他階段的最後一步。
+    """
+
+    def __init__(self, name: str, func: Callable[[Dict[str, Any]], Any], deps: Iterable[str] = (),
+                 capture: bool = True):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+        self.capture = capture
+
+
+class PhaseResult:
+    def __init__(self, name: str):
+        self.name = name
+        self.value: Any = None
+        self.error: Optional[BaseException] = None
+        self.skipped = False
+        self.start = 0.0
+        self.end = 0.0
+        self.output = ""
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+
+class _ThreadStdout(io.TextIOBase):
+    """依執行緒導向的標準輸出：階段執行緒寫入各自的緩衝，其他執行緒照常輸出。"""
+
+    def __init__(self, stream: TextIO):
+        self._stream = stream
+        self._local = threading.local()
+
+    def capture(self, buffer: Optional[io.StringIO]) -> None:
+        self._local.buffer = buffer
+
+    def write(self, text: str) -> int:
+        buffer = getattr(self._local, "buffer", None)
+        return (buffer or self._stream).write(text)
+
+    def flush(self) -> None:
+        self._stream.flush()
+
+
+def run_phases(phases: List[Phase]) -> Dict[str, PhaseResult]:
+    """依相依關係並行執行各階段，回傳 {名稱: PhaseResult}。
+
+    相依的階段失敗時，後續階段會被略過（skipped）。
+    """
+    by_name = {phase.name: phase for phase in phases}
+    for phase in phases:
+        missing = [dep for dep in phase.deps if dep not in by_name]
+        if missing:
+            raise ValueError(f"階段 {phase.name} 的相依階段不存在: {', '.join(missing)}")
+
+    results = {phase.name: PhaseResult(phase.name) for phase in phases}
+    values: Dict[str, Any] = {}
+    done: Dict[str, bool] = {}
+    printed = 0
+    origin = time.perf_counter()
+
+    real_stdout = sys.stdout
+    proxy = _ThreadStdout(real_stdout)
+
+    def execute(phase: Phase) -> None:
+        result = results[phase.name]
+        buffer = io.StringIO()
+        proxy.capture(buffer if phase.capture else None)
+        result.start = time.perf_counter() - origin
+        try:
+            with timed_phase(phase.name):
+                result.value = phase.func({dep: values[dep] for dep in phase.deps})
+        except BaseException as e:  # 包含 process_config 的 sys.exit
+            result.error = e
+        finally:
+            result.end = time.perf_counter() - origin
+            proxy.capture(None)
+            result.output = buffer.getvalue()
+
+    def flush_ready() -> None:
+        # 依宣告順序輸出已完成的階段，前面的階段尚未完成時先保留
+        nonlocal printed
+        while printed < len(phases) and phases[printed].name in done:
+            real_stdout.write(results[phases[printed].name].output)
+            printed += 1
+        real_stdout.flush()
+
+    execute = bind(execute)
+    sys.stdout = proxy
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, len(phases))) as executor:
+            running: Dict[Future, Phase] = {}
+            pending = list(phases)
+            while pending or running:
+                for phase in list(pending):
+                    if not all(dep in done for dep in phase.deps):
+                        continue
+                    pending.remove(phase)
+                    failed = [dep for dep in phase.deps if not done[dep]]
+                    if failed:
+                        results[phase.name].skipped = True
+                        done[phase.name] = False
+                        continue
+                    if not phase.capture:
+                        flush_ready()
+                    running[executor.submit(execute, phase)] = phase
+                if not running:
+                    if pending and not any(all(dep in done for dep in p.deps) for p in pending):
+                        raise ValueError(f"階段相依關係有循環: {', '.join(p.name for p in pending)}")
+                    continue
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    phase = running.pop(future)
+                    result = results[phase.name]
+                    done[phase.name] = result.error is None
+                    values[phase.name] = result.value
+                flush_ready()
+    finally:
+        sys.stdout = real_stdout
+    flush_ready()
+    return results
+
+
+def critical_path(phases: List[Phase], results: Dict[str, PhaseResult]) -> Tuple[List[str], float]:
+    """依各階段耗時計算最長的相依鏈，回傳 (階段名稱, 總耗時)。"""
+    longest: Dict[str, Tuple[float, List[str]]] = {}
+    for phase in phases:  # 宣告順序即為拓撲順序（相依階段必須先宣告）
+        before = max((longest[dep] for dep in phase.deps if dep in longest),
+                     key=lambda item: item[0], default=(0.0, []))
+        longest[phase.name] = (before[0] + results[phase.name].duration, before[1] + [phase.name])
+    total, path = max(longest.values(), key=lambda item: item[0], default=(0.0, []))
+    return path, total
+
+
+def format_phase_report(phases: List[Phase], results: Dict[str, PhaseResult]) -> str:
+    """產生各階段耗時與關鍵路徑的摘要。"""
+    lines = ["", "⏱ 階段耗時:"]
+    for phase in phases:
+        result = results[phase.name]
+        if result.skipped:
+            state = "略過"
+        elif result.error is not None:
+            state = "失敗"
+        else:
+            state = f"{result.start:6.2f}s → {result.end:6.2f}s  {result.duration:6.2f}s"
+        lines.append(f"  {phase.name:<10} {state}")
+    path, path_time = critical_path(phases, results)
+    wall = max((r.end for r in results.values()), default=0.0)
+    serial = sum(r.duration for r in results.values())
+    lines.append(f"  總耗時 {wall:.2f}s（依序執行約 {serial:.2f}s）")
+    lines.append(f"  關鍵路徑 {' → '.join(path)} ({path_time:.2f}s)")
+    return "\n".join(lines)
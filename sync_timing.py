@@ -0,0 +1,345 @@
+"""
+sync_mcp.py / sync_workflows.py 的 --timings 量測
+- 以階層式 span 記錄各階段、目標與子程序的耗時、讀寫位元組數與結束碼
+- 結束時輸出摘要表（標準錯誤）並寫入 JSON（預設為快取目錄下的 timings/<程式名>.json）
+- 未啟用時 span() 回傳共用的空 context manager，幾乎沒有額外負擔
+- 另有一律開啟的整體計數（子程序數、讀寫的檔案數與位元組數、各階段耗時），供執行紀錄使用
+"""
+import contextlib
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import unicodedata
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, TypeVar
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+ENABLED = False
+TIMINGS_DIR = "timings"
+# 摘要表最多顯示的層數與每層的子區間數（其餘只顯示最久的幾個與合計；JSON 仍完整保留）
+REPORT_MAX_DEPTH = 4
+REPORT_MAX_CHILDREN = 8
+
+_local = threading.local()
+_lock = threading.Lock()
+_root: Optional["Span"] = None
+_json_path: Optional[str] = None
+# --timings - 時保留原本的標準輸出（JSON 專用），其餘輸出一律改到標準錯誤
+_json_fd: Optional[int] = None
+_stats: Dict[str, int] = {}
+_phase_times: Dict[str, float] = {}
+
+
+def count(key: str, amount: int = 1) -> None:
+    """累加整體計數（不論是否啟用 --timings）。"""
+    with _lock:
+        _stats[key] = _stats.get(key, 0) + amount
+
+
+def note_phase(name: str, seconds: float) -> None:
+    """記錄一個階段的耗時（同名階段累加）。"""
+    with _lock:
+        _phase_times[name] = _phase_times.get(name, 0.0) + seconds
+
+
+def run_stats() -> Tuple[Dict[str, int], Dict[str, float]]:
+    """回傳 (整體計數, 各階段耗時) 的副本。"""
+    with _lock:
+        return dict(_stats), dict(_phase_times)
+
+
+class Span:
+    """一段量測區間；子區間可能來自其他執行緒（以 bind 傳遞上層 span）。"""
+
+    __slots__ = ("name", "kind", "attrs", "start", "end", "bytes_read", "bytes_written",
+                 "exit_code", "children")
+
+    def __init__(self, name: str, kind: str, attrs: Dict[str, Any]):
+        self.name = name
+        self.kind = kind
+        self.attrs = attrs
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.exit_code: Optional[int] = None
+        self.children: List["Span"] = []
+
+    @property
+    def duration(self) -> float:
+        return (self.end if self.end is not None else time.perf_counter()) - self.start
+
+    def total_bytes(self) -> tuple:
+        """含所有子區間的 (讀取, 寫入) 位元組數。"""
+        read, written = self.bytes_read, self.bytes_written
+        for child in self.children:
+            r, w = child.total_bytes()
+            read += r
+            written += w
+        return read, written
+
+    def to_dict(self, origin: float) -> Dict[str, Any]:
+        read, written = self.total_bytes()
+        data: Dict[str, Any] = {
+            "name": self.name,
+            "kind": self.kind,
+            "start": round(self.start - origin, 6),
+            "duration": round(self.duration, 6),
+            "bytes_read": read,
+            "bytes_written": written,
+        }
+        if self.exit_code is not None:
+            data["exit_code"] = self.exit_code
+        if self.attrs:
+            data["attrs"] = self.attrs
+        if self.children:
+            data["children"] = [c.to_dict(origin) for c in self.children]
+        return data
+
+
+def current() -> Optional[Span]:
+    return getattr(_local, "span", None) or _root
+
+
+@contextlib.contextmanager
+def _span(name: str, kind: str, attrs: Dict[str, Any]) -> Iterator[Span]:
+    parent = current()
+    item = Span(name, kind, attrs)
+    if parent is not None:
+        with _lock:
+            parent.children.append(item)
+    _local.span = item
+    try:
+        yield item
+    finally:
+        item.end = time.perf_counter()
+        _local.span = parent
+
+
+_NULL_SPAN = contextlib.nullcontext()
+
+
+def span(name: str, kind: str = "step", **attrs: Any):
+    """量測一段區間：with span("rules", kind="phase"): ...；未啟用時為空操作。"""
+    if not ENABLED:
+        return _NULL_SPAN
+    return _span(name, kind, attrs)
+
+
+@contextlib.contextmanager
+def phase(name: str) -> Iterator[None]:
+    """一個階段：一律記錄耗時（供執行紀錄），啟用 --timings 時並建立 span。"""
+    start = time.perf_counter()
+    try:
+        with span(name, kind="phase"):
+            yield
+    finally:
+        note_phase(name, time.perf_counter() - start)
+
+
+def add_bytes(read: int = 0, written: int = 0) -> None:
+    """記錄讀取/寫入一個檔案的位元組數：計入整體計數，啟用時並計入目前的 span。"""
+    item = current() if ENABLED else None
+    with _lock:
+        if read:
+            _stats["files_read"] = _stats.get("files_read", 0) + 1
+            _stats["bytes_read"] = _stats.get("bytes_read", 0) + read
+        if written:
+            _stats["files_written"] = _stats.get("files_written", 0) + 1
+            _stats["bytes_written"] = _stats.get("bytes_written", 0) + written
+        if item is not None:
+            item.bytes_read += read
+            item.bytes_written += written
+
+
+def bind(func: F) -> F:
+    """讓 func 在其他執行緒執行時，其 span 掛在呼叫 bind 時的 span 之下。"""
+    if not ENABLED:
+        return func
+    parent = current()
+
+    def bound(*args, **kwargs):
+        previous = getattr(_local, "span", None)
+        _local.span = parent
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _local.span = previous
+
+    return bound  # type: ignore[return-value]
+
+
+def run_process(cmd: List[str], **kwargs: Any) -> subprocess.CompletedProcess:
+    """subprocess.run 的量測版本：記錄子程序耗時、輸出位元組數與結束碼。"""
+    count("subprocesses")
+    count(f"subprocess:{Path(str(cmd[0])).name}")
+    if not ENABLED:
+        return subprocess.run(cmd, **kwargs)
+    with _span(" ".join(str(c) for c in cmd[:4]), "subprocess", {"argv": [str(c) for c in cmd]}) as item:
+        try:
+            proc = subprocess.run(cmd, **kwargs)
+        except subprocess.CalledProcessError as e:
+            item.exit_code = e.returncode
+            item.bytes_read += len(e.stdout or "") + len(e.stderr or "")
+            raise
+        except subprocess.TimeoutExpired:
+            item.attrs["timeout"] = True
+            raise
+        item.exit_code = proc.returncode
+        item.bytes_read += len(proc.stdout or "") + len(proc.stderr or "")
+        return proc
+
+
+def enable_timings(program: str, json_path: Optional[str] = None) -> None:
+    """開始量測；json_path 為 '-' 時 JSON 輸出到標準輸出，未指定時寫入快取目錄。
+
+    JSON 輸出到標準輸出時，同步過程的一般輸出（含子程序）改到標準錯誤，
+    讓標準輸出只有可解析的 JSON。
+    """
+    global ENABLED, _root, _json_path, _json_fd
+    _root = Span(program, "run", {"argv": sys.argv[1:]})
+    _json_path = json_path
+    if json_path == "-" and _json_fd is None:
+        sys.stdout.flush()
+        _json_fd = os.dup(1)
+        os.dup2(2, 1)
+    ENABLED = True
+
+
+def _human_bytes(count: int) -> str:
+    if not count:
+        return "-"
+    size = float(count)
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return f"{size:.0f}{unit}" if unit == "B" else f"{size:.1f}{unit}"
+        size /= 1024
+    return f"{size:.1f}GB"
+
+
+def pad_cells(text: str, width: int, align: str = "<") -> str:
+    """依終端機顯示寬度（全形字佔兩格）截斷並補齊到 width；align 為 '>' 時靠右。"""
+    out, used = [], 0
+    for ch in text:
+        w = 2 if unicodedata.east_asian_width(ch) in "WF" else 1
+        if used + w > width:
+            break
+        out.append(ch)
+        used += w
+    fill = " " * (width - used)
+    return fill + "".join(out) if align == ">" else "".join(out) + fill
+
+
+def _iter_rows(item: Span, depth: int) -> Iterator[tuple]:
+    yield depth, item
+    if depth + 1 >= REPORT_MAX_DEPTH:
+        return
+    children = item.children
+    hidden: List[Span] = []
+    if len(children) > REPORT_MAX_CHILDREN:
+        by_duration = sorted(children, key=lambda c: c.duration, reverse=True)
+        children, hidden = by_duration[:REPORT_MAX_CHILDREN], by_duration[REPORT_MAX_CHILDREN:]
+    for child in sorted(children, key=lambda c: c.start):
+        yield from _iter_rows(child, depth + 1)
+    if hidden:
+        yield depth + 1, f"…其餘 {len(hidden)} 個，合計 {sum(c.duration for c in hidden):.3f}s"
+
+
+def _iter_all(item: Span) -> Iterator[Span]:
+    yield item
+    for child in item.children:
+        yield from _iter_all(child)
+
+
+def format_report(root: Span) -> str:
+    """產生階層式的耗時摘要表。"""
+    # 標題與資料列使用相同的顯示寬度（中文標題佔兩格，不能直接用 :>N 對齊）
+    header = [pad_cells("區間", 44)] + [pad_cells(title, width, ">") for title, width in
+                                       (("開始", 7), ("耗時", 8), ("讀取", 8), ("寫入", 8), ("結束碼", 6))]
+    lines = ["", "⏱ 執行耗時 (--timings):", "  " + " ".join(header)]
+    for depth, item in _iter_rows(root, 0):
+        if isinstance(item, str):
+            lines.append(f"  {'  ' * depth}{item}")
+            continue
+        read, written = item.total_bytes()
+        label = pad_cells("  " * depth + item.name, 44)
+        code = "" if item.exit_code is None else str(item.exit_code)
+        lines.append(
+            f"  {label} {item.start - root.start:6.2f}s {item.duration:7.3f}s"
+            f" {_human_bytes(read):>8} {_human_bytes(written):>8} {code:>6}"
+        )
+    procs = [s for s in _iter_all(root) if s.kind == "subprocess"]
+    if procs:
+        failed = sum(1 for s in procs if s.exit_code not in (0, None))
+        lines.append(
+            f"  子程序 {len(procs)} 個（失敗 {failed}），合計 {sum(s.duration for s in procs):.2f}s，"
+            f"最久 {max(procs, key=lambda s: s.duration).name} ({max(s.duration for s in procs):.2f}s)"
+        )
+    return "\n".join(lines)
+
+
+def _write_json(root: Span) -> Optional[Path]:
+    payload = json.dumps({
+        "program": root.name,
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S%z", time.localtime(time.time() - root.duration)),
+        "exit_code": root.exit_code,
+        "spans": root.to_dict(root.start),
+    }, ensure_ascii=False, indent=2)
+    if _json_path == "-":
+        sys.stdout.flush()
+        with os.fdopen(_json_fd, "w", encoding="utf-8") as out:
+            out.write(payload + "\n")
+        return None
+    from sync_io import atomic_write_bytes, cache_dir
+    if _json_path:
+        path = Path(_json_path)
+    else:
+        path = cache_dir() / TIMINGS_DIR / f"{Path(root.name).stem}.json"
+    atomic_write_bytes(path, (payload + "\n").encode("utf-8"), mode=0o600)
+    return path
+
+
+def finish(exit_code: int) -> None:
+    """結束量測並輸出摘要表與 JSON。"""
+    global ENABLED
+    if not ENABLED or _root is None:
+        return
+    ENABLED = False
+    _root.end = time.perf_counter()
+    _root.exit_code = exit_code
+    print(format_report(_root), file=sys.stderr)
+    try:
+        path = _write_json(_root)
+    except OSError as e:
+        print(f"⚠ 無法寫入耗時紀錄: {e}", file=sys.stderr)
+        return
+    if path is not None:
+        print(f"  JSON: {path}", file=sys.stderr)
+
+
+def exit_code_of(error: Optional[BaseException]) -> int:
+    """程式以 error 結束（None 為正常結束）時的結束碼。"""
+    if error is None:
+        return 0
+    if isinstance(error, SystemExit):
+        return error.code if isinstance(error.code, int) else (0 if error.code is None else 1)
+    if isinstance(error, KeyboardInterrupt):
+        return 130
+    return 1
+
+
+@contextlib.contextmanager
+def report_on_exit() -> Iterator[None]:
+    """包住程式主體：結束時（含 sys.exit 與例外）記錄結束碼並輸出量測結果。"""
+    error: Optional[BaseException] = None
+    try:
+        yield
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        finish(exit_code_of(error))
@@ -0,0 +1,200 @@
+"""
+sync_mcp.py --watch 使用的檔案變動監看
+- Linux 以 inotify 監看（透過 ctypes 呼叫 libc，不需額外套件），其他平台改為定期 stat 比對
+- 監看單一檔案時改監看其所在目錄（編輯器常以 rename 取代檔案，直接監看檔案會失效）
+- 一連串的變動會合併（debounce），安靜一段時間後才整批回報變動的路徑
+"""
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, Optional, Set, Tuple
+
+# inotify 事件旗標（見 <sys/inotify.h>）
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = getattr(os, "O_CLOEXEC", 0o2000000)
+
+WATCH_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE
+              | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+_EVENT_HEADER = struct.Struct("iIII")
+
+# 變動合併的靜默時間與輪詢間隔（秒）
+DEFAULT_DEBOUNCE = 0.5
+DEFAULT_POLL_INTERVAL = 1.0
+
+
+class _InotifyWatcher:
+    """以 inotify 監看指定檔案（所在目錄）與目錄樹。"""
+
+    name = "inotify"
+
+    def __init__(self, files: Iterable[Path], trees: Iterable[Path]):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+        self._fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+
+        self._files = {Path(f) for f in files}
+        self._trees = [Path(t) for t in trees]
+        self._dirs: Dict[int, Path] = {}
+        for folder in {f.parent for f in self._files}:
+            self._add(folder)
+        for tree in self._trees:
+            self._add_tree(tree)
+
+    def _add(self, folder: Path) -> bool:
+        wd = self._add_watch(self._fd, os.fsencode(folder), WATCH_MASK)
+        if wd < 0:
+            return False
+        self._dirs[wd] = folder
+        return True
+
+    def _add_tree(self, tree: Path) -> Set[Path]:
+        """監看整個目錄樹，回傳樹中既有的檔案（新建目錄時，監看建立前寫入的檔案也要回報）。"""
+        found: Set[Path] = set()
+        for root, dirs, names in os.walk(tree):
+            if self._add(Path(root)):
+                found.update(Path(root) / n for n in names)
+        return found
+
+    def _relevant(self, path: Path) -> bool:
+        return path in self._files or any(t == path or t in path.parents for t in self._trees)
+
+    def read(self, timeout: Optional[float]) -> Set[Path]:
+        """等待至多 timeout 秒（None 為無限期），回傳期間變動的路徑。"""
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return set()
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return set()
+
+        changed: Set[Path] = set()
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            wd, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            raw_name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                # 事件佇列溢位：無法得知哪些檔案變動，回報所有監看目標
+                changed.update(self._files)
+                changed.update(self._trees)
+                continue
+            folder = self._dirs.get(wd)
+            if folder is None:
+                continue
+            if mask & IN_IGNORED:
+                self._dirs.pop(wd, None)
+                continue
+            if not raw_name:
+                continue
+            path = folder / os.fsdecode(raw_name)
+            if not self._relevant(path):
+                continue
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    changed.update(self._add_tree(path))
+                continue
+            changed.add(path)
+        return changed
+
+    def close(self) -> None:
+        os.close(self._fd)
+
+
+class _PollingWatcher:
+    """無法使用 inotify 時，定期以 (大小, mtime_ns) 比對檔案與目錄樹。"""
+
+    name = "polling"
+
+    def __init__(self, files: Iterable[Path], trees: Iterable[Path],
+                 interval: float = DEFAULT_POLL_INTERVAL):
+        self._files = [Path(f) for f in files]
+        self._trees = [Path(t) for t in trees]
+        self._interval = interval
+        self._snapshot = self._scan()
+
+    def _scan(self) -> Dict[Path, Tuple[int, int]]:
+        snapshot: Dict[Path, Tuple[int, int]] = {}
+        paths = list(self._files)
+        for tree in self._trees:
+            for root, _, names in os.walk(tree):
+                paths.extend(Path(root) / n for n in names)
+        for path in paths:
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            snapshot[path] = (st.st_size, st.st_mtime_ns)
+        return snapshot
+
+    def read(self, timeout: Optional[float]) -> Set[Path]:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self._interval if deadline is None else min(self._interval, deadline - time.monotonic())
+            if wait > 0:
+                time.sleep(wait)
+            current = self._scan()
+            changed = {
+                p for p in set(current) | set(self._snapshot)
+                if current.get(p) != self._snapshot.get(p)
+            }
+            self._snapshot = current
+            if changed or (deadline is not None and time.monotonic() >= deadline):
+                return changed
+
+    def close(self) -> None:
+        pass
+
+
+def open_watcher(files: Iterable[Path], trees: Iterable[Path],
+                 poll_interval: float = DEFAULT_POLL_INTERVAL):
+    """建立監看器：Linux 上優先使用 inotify，失敗時改用輪詢。"""
+    files, trees = list(files), list(trees)
+    if sys.platform.startswith("linux"):
+        try:
+            return _InotifyWatcher(files, trees)
+        except (OSError, AttributeError):
+            pass
+    return _PollingWatcher(files, trees, poll_interval)
+
+
+def watch_changes(watcher, debounce: float = DEFAULT_DEBOUNCE) -> Iterator[Set[Path]]:
+    """持續產出變動路徑的集合；收到變動後，直到 debounce 秒內沒有新變動才整批產出。"""
+    try:
+        while True:
+            changed = watcher.read(None)
+            if not changed:
+                continue
+            deadline = time.monotonic() + debounce
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                more = watcher.read(remaining)
+                if more:
+                    changed |= more
+                    deadline = time.monotonic() + debounce
+            yield changed
+    finally:
+        watcher.close()
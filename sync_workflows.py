@@ -11,15 +11,37 @@
 支援平台: macOS, Ubuntu/Linux
 """
 import argparse
+import hashlib
 import os
 import platform
-import shutil
 import subprocess
 import sys
+import threading
 from pathlib import Path
-from typing import Dict, List, Optional, Set, Tuple
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
 from datetime import datetime
 
+from sync_io import (
+    atomic_write_bytes,
+    bytes_match_file,
+    file_digest,
+    get_link_mode,
+    links_to_source,
+    load_manifest,
+    map_isolated,
+    needs_deploy,
+    place_file,
+    points_to,
+    remove_deployed,
+    set_io_workers,
+    set_link_mode,
+    DEFAULT_IO_WORKERS,
+    LINK_MODES,
+)
+from sync_journal import add_run_listener, mark_sync_run, record_run, set_gauge, show_history
+from sync_metrics import write_metrics_file
+from sync_timing import add_bytes, count, enable_timings, phase, report_on_exit, span
+
 
 # ============================================================================
 # AI IDE 配置路徑
@@ -122,18 +144,6 @@ def get_system_info() -> Dict[str, str]:
     }
 
 
-def files_are_identical(file1: Path, file2: Path) -> bool:
-    """比對兩個檔案內容是否完全相同"""
-    if not file1.exists() or not file2.exists():
-        return False
-    try:
-        content1 = file1.read_text(encoding='utf-8')
-        content2 = file2.read_text(encoding='utf-8')
-        return content1 == content2
-    except Exception:
-        return False
-
-
 def ensure_dir(path: Path) -> bool:
     """確保目錄存在，若不存在則建立"""
     try:
@@ -153,40 +163,40 @@ def copy_file_if_different(src: Path, dst: Path, dry_run: bool = False) -> Tuple
     if not src.exists():
         return False, f"來源檔案不存在: {src}"
     
-    if files_are_identical(src, dst):
+    # 依部署方式判斷：copy / reflink 比對內容，hardlink / symlink 只需確認是否已連結
+    if not needs_deploy(src, dst):
+        count("targets_skipped")
         return True, "⊜ 內容相同，跳過"
     
+    action = "連結" if links_to_source() else "複製"
     if dry_run:
-        return True, "🔍 (dry-run) 將會複製"
+        return True, f"🔍 (dry-run) 將會{action}"
     
     try:
-        dst.parent.mkdir(parents=True, exist_ok=True)
-        shutil.copy2(src, dst)
-        return True, "✓ 已複製"
+        place_file(src, dst)
+        count("targets_written")
+        return True, f"✓ 已{action}"
     except Exception as e:
-        return False, f"✗ 複製失敗: {e}"
+        return False, f"✗ {action}失敗: {e}"
 
 
 # ============================================================================
 # Workflow 解析與處理
 # ============================================================================
 
-def parse_workflow_frontmatter(content: str) -> Dict[str, str]:
-    """解析 Workflow 的 YAML frontmatter
-    
-    格式:
-    ---
-    description: 短描述
-    ---
-    """
+# 讀取 frontmatter 時最多讀取的位元組數（超過即視為 frontmatter 結束）
+FRONTMATTER_MAX_BYTES = 64 * 1024
+
+
+def _parse_frontmatter_lines(lines: Iterator[str]) -> Dict[str, str]:
+    """從逐行輸入解析 frontmatter，遇到結尾的 --- 即停止讀取"""
     metadata: Dict[str, str] = {}
-    lines = content.split('\n')
     
-    if not lines or lines[0].strip() != '---':
+    first = next(lines, None)
+    if first is None or first.strip() != '---':
         return metadata
     
-    in_frontmatter = True
-    for i, line in enumerate(lines[1:], 1):
+    for line in lines:
         if line.strip() == '---':
             break
         if ':' in line:
@@ -196,6 +206,40 @@ def parse_workflow_frontmatter(content: str) -> Dict[str, str]:
     return metadata
 
 
+def parse_workflow_frontmatter(content: str) -> Dict[str, str]:
+    """解析 Workflow 的 YAML frontmatter
+    
+    格式:
+    ---
+    description: 短描述
+    ---
+    """
+    return _parse_frontmatter_lines(iter(content.split('\n')))
+
+
+def read_workflow_frontmatter(path: Path, max_bytes: int = FRONTMATTER_MAX_BYTES) -> Dict[str, str]:
+    """只讀取檔案開頭的 frontmatter，不載入整份內容
+    
+    逐行讀取直到結尾的 ---，總讀取量不超過 max_bytes。
+    """
+    remaining = max_bytes
+    
+    def read_lines(f) -> Iterator[str]:
+        nonlocal remaining
+        while remaining > 0:
+            line = f.readline(remaining)
+            if not line:
+                return
+            remaining -= len(line)
+            # 讀取上限可能切在多位元組字元中間，無法解碼的位元組以替代字元表示
+            yield line.decode('utf-8', errors='replace')
+    
+    with open(path, 'rb') as f:
+        metadata = _parse_frontmatter_lines(read_lines(f))
+    add_bytes(read=max_bytes - remaining)
+    return metadata
+
+
 def get_workflow_command_name(filepath: Path) -> str:
     """從檔名取得 workflow 命令名稱 (e.g., code-review-agent.md -> /code-review-agent)"""
     name = filepath.stem  # 移除 .md 副檔名
@@ -211,29 +255,32 @@ def discover_workflows(source_dir: Path) -> List[Dict]:
         - name: 檔名
         - command: 命令名稱 (e.g., /code-review-agent)
         - description: 描述
+    
+    只讀取各檔案開頭的 frontmatter，並在 I/O 執行緒池中並行解析；
+    完整內容留待部署時才讀取（見 workflow_source）。
     """
     workflows = []
     
     if not source_dir.exists() or not source_dir.is_dir():
         return workflows
     
-    for md_file in source_dir.rglob("*.md"):
-        if not md_file.is_file() or md_file.name.startswith('_'):
+    md_files = [
+        md_file for md_file in source_dir.rglob("*.md")
+        if not md_file.name.startswith('_') and md_file.is_file()
+    ]
+    
+    for md_file, (metadata, error) in zip(md_files, map_isolated(read_workflow_frontmatter, md_files)):
+        if error is not None:
+            print(f"  ⚠ 無法解析 {md_file}: {error}")
             continue
         
-        try:
-            content = md_file.read_text(encoding='utf-8')
-            metadata = parse_workflow_frontmatter(content)
-            
-            workflows.append({
-                "path": md_file,
-                "name": md_file.name,
-                "command": get_workflow_command_name(md_file),
-                "description": metadata.get("description", ""),
-                "relative_path": md_file.relative_to(source_dir),
-            })
-        except Exception as e:
-            print(f"  ⚠ 無法解析 {md_file}: {e}")
+        workflows.append({
+            "path": md_file,
+            "name": md_file.name,
+            "command": get_workflow_command_name(md_file),
+            "description": metadata.get("description", ""),
+            "relative_path": md_file.relative_to(source_dir),
+        })
     
     return sorted(workflows, key=lambda x: x["name"])
 
@@ -276,76 +323,193 @@ def convert_for_antigravity(content: str, filename: str) -> str:
 # 部署邏輯
 # ============================================================================
 
-def deploy_to_ide(
-    ide_name: str,
-    ide_paths: Dict[str, Path],
+# 各 IDE 對應的轉換器
+CONVERTERS: Dict[str, Callable[[str, str], str]] = {
+    "Antigravity": convert_for_antigravity,
+    "Cursor": convert_for_cursor,
+    "Windsurf": convert_for_windsurf,
+    "Claude Code": convert_for_claude,
+}
+
+
+def _identity_converter(content: str, filename: str) -> str:
+    return content
+
+
+# 轉換結果備忘：(轉換器, 來源雜湊, 檔名) → 輸出雜湊；輸出雜湊 → 輸出內容
+# 相同的轉換結果在各 IDE 間共用同一份 bytes 與雜湊
+_source_lock = threading.Lock()
+_convert_lock = threading.Lock()
+_converted: Dict[Tuple[Callable[[str, str], str], str, str], str] = {}
+_outputs: Dict[str, bytes] = {}
+
+
+def workflow_source(wf: Dict) -> Tuple[str, str]:
+    """回傳 workflow 原始內容與其 sha256；每個來源在整個行程中只讀取一次。
+
+    各來源各自持有一把鎖，不同檔案的讀取仍可並行。
+    """
+    with _source_lock:
+        lock = wf.setdefault("_lock", threading.Lock())
+    with lock:
+        if "content_digest" not in wf:
+            if "content" not in wf:
+                raw = wf["path"].read_bytes()
+                add_bytes(read=len(raw))
+                wf["content"] = raw.decode('utf-8')
+            wf["content_digest"] = hashlib.sha256(wf["content"].encode('utf-8')).hexdigest()
+        return wf["content"], wf["content_digest"]
+
+
+def render_workflow(wf: Dict, converter: Callable[[str, str], str]) -> Tuple[bytes, str]:
+    """以 converter 轉換 workflow，回傳 (輸出內容, sha256)
+
+    每個轉換器對每份來源內容只呼叫一次，結果在各 IDE 間共用。
+    """
+    content, source_digest = workflow_source(wf)
+    key = (converter, source_digest, wf["name"])
+    with _convert_lock:
+        digest = _converted.get(key)
+        if digest is not None:
+            return _outputs[digest], digest
+    
+    data = converter(content, wf["name"]).encode('utf-8')
+    digest = hashlib.sha256(data).hexdigest()
+    with _convert_lock:
+        data = _outputs.setdefault(digest, data)
+        _converted[key] = digest
+    return data, digest
+
+
+def deploy_to_ides(
+    ide_names: List[str],
+    ide_paths: Dict[str, Dict[str, Path]],
     workflows: List[Dict],
     dry_run: bool = False,
     verbose: bool = False
 ) -> Tuple[int, int, int]:
-    """部署 workflows 到特定 IDE
+    """部署 workflows 到多個 IDE
+    
+    所有 (IDE, workflow) 組合在同一個 I/O 執行緒池中並行處理：
+    來源只讀取一次、每個轉換器對每份來源只呼叫一次；輸出依 IDE 與 workflow 順序整段列印。
     
     Returns:
         Tuple[成功數, 跳過數, 失敗數]
     """
-    print(f"\n📦 部署到 {ide_name}...")
-    
-    target_dir = ide_paths.get("global_workflows")
-    if not target_dir:
-        print(f"  ⚠ 找不到 {ide_name} 的 workflow 目錄配置")
-        return 0, 0, len(workflows)
-    
-    if not dry_run and not ensure_dir(target_dir):
-        return 0, 0, len(workflows)
-    
     success, skipped, failed = 0, 0, 0
     
-    # 取得對應的轉換器
-    converters = {
-        "Antigravity": convert_for_antigravity,
-        "Cursor": convert_for_cursor,
-        "Windsurf": convert_for_windsurf,
-        "Claude Code": convert_for_claude,
-    }
-    converter = converters.get(ide_name, lambda c, f: c)
+    link_mode = get_link_mode()
     
-    for wf in workflows:
-        src_path = wf["path"]
+    # 準備各 IDE 的目標目錄、轉換器與部署紀錄
+    plans = []
+    for ide_name in ide_names:
+        target_dir = ide_paths[ide_name].get("global_workflows")
+        if not target_dir:
+            plans.append((ide_name, None, None, None, "missing"))
+        elif not dry_run and not ensure_dir(target_dir):
+            plans.append((ide_name, None, None, None, "error"))
+        else:
+            converter = CONVERTERS.get(ide_name, _identity_converter)
+            plans.append((ide_name, target_dir, converter, load_manifest(f"workflows-{ide_name}"), None))
+    
+    def deploy_one(job: Tuple[int, Dict]) -> Tuple[str, Path]:
+        """轉換並寫入單一 workflow，回傳 (狀態, 目標路徑)"""
+        index, wf = job
+        _, target_dir, converter, manifest, _ = plans[index]
         relative = wf.get("relative_path", Path(wf["name"]))
         dst_path = target_dir / relative
         
-        # 讀取並轉換內容
-        try:
-            content = src_path.read_text(encoding='utf-8')
-            converted = converter(content, wf["name"])
-            
-            # 檢查是否需要更新
-            if dst_path.exists():
-                existing = dst_path.read_text(encoding='utf-8')
-                if existing == converted:
-                    if verbose:
-                        print(f"  ⊜ {wf['name']}: 內容相同，跳過")
-                    skipped += 1
-                    continue
-            
+        src_path = wf["path"]
+        extra = {"converter": converter.__name__, "link_mode": link_mode}
+        
+        # 來源、目標、轉換器與部署方式都與部署紀錄一致時，不需讀取任何檔案
+        if manifest.is_current(dst_path, source=src_path, **extra):
+            return "skipped", dst_path
+        
+        data, digest = render_workflow(wf, converter)
+        
+        # 轉換結果與來源相同時，hardlink / symlink 模式直接連結來源
+        if links_to_source(link_mode) and digest == file_digest(src_path):
+            if not needs_deploy(src_path, dst_path, link_mode):
+                if not dry_run:
+                    manifest.record(dst_path, src_path, digest, written=False, **extra)
+                return "skipped", dst_path
             if dry_run:
-                print(f"  🔍 {wf['name']}: 將會部署到 {dst_path}")
-                success += 1
+                return "dry-run", dst_path
+            place_file(src_path, dst_path, link_mode)
+            manifest.record(dst_path, src_path, digest, **extra)
+            return "deployed", dst_path
+        
+        # 檢查是否需要更新（大小與快取的雜湊，不需讀取目標內容）；仍連結著來源的目標須改為獨立檔案
+        if not points_to(src_path, dst_path) and bytes_match_file(data, dst_path, digest):
+            if not dry_run:
+                manifest.record(dst_path, src_path, digest, written=False, **extra)
+            return "skipped", dst_path
+        
+        if dry_run:
+            return "dry-run", dst_path
+        
+        # 實際寫入（先寫暫存檔再 rename，不會透過連結改到來源）
+        atomic_write_bytes(dst_path, data, mode=0o644)
+        manifest.record(dst_path, src_path, digest, **extra)
+        return "deployed", dst_path
+    
+    def timed_deploy(job: Tuple[int, Dict]) -> Tuple[str, Path]:
+        with span(f"{plans[job[0]][0]}: {job[1]['name']}", kind="file"):
+            return deploy_one(job)
+    
+    jobs = [(i, wf) for i, plan in enumerate(plans) if plan[1] for wf in workflows]
+    with phase("部署 workflows"):
+        results = iter(map_isolated(timed_deploy, jobs))
+    
+    for ide_name, target_dir, _, manifest, problem in plans:
+        print(f"\n📦 部署到 {ide_name}...")
+        if problem == "missing":
+            print(f"  ⚠ 找不到 {ide_name} 的 workflow 目錄配置")
+        if problem:
+            failed += len(workflows)
+            continue
+        
+        for wf in workflows:
+            result, error = next(results)
+            if error is not None:
+                print(f"  ✗ {wf['name']}: {error}")
+                failed += 1
                 continue
             
-            # 實際寫入
-            dst_path.parent.mkdir(parents=True, exist_ok=True)
-            dst_path.write_text(converted, encoding='utf-8')
-            print(f"  ✓ {wf['name']} → {dst_path}")
-            success += 1
-            
-        except Exception as e:
-            print(f"  ✗ {wf['name']}: {e}")
-            failed += 1
+            status, dst_path = result
+            if status == "skipped":
+                if verbose:
+                    print(f"  ⊜ {wf['name']}: 內容相同，跳過")
+                skipped += 1
+            elif status == "dry-run":
+                print(f"  🔍 {wf['name']}: 將會部署到 {dst_path}")
+                success += 1
+            else:
+                print(f"  ✓ {wf['name']} → {dst_path}")
+                success += 1
+        
+        manifest.save()
     
+    count("targets_failed", failed)
     return success, skipped, failed
 
 
+def deploy_to_ide(
+    ide_name: str,
+    ide_paths: Dict[str, Path],
+    workflows: List[Dict],
+    dry_run: bool = False,
+    verbose: bool = False
+) -> Tuple[int, int, int]:
+    """部署 workflows 到特定 IDE
+    
+    Returns:
+        Tuple[成功數, 跳過數, 失敗數]
+    """
+    return deploy_to_ides([ide_name], {ide_name: ide_paths}, workflows, dry_run, verbose)
+
+
 def deploy_global_rules(
     source_file: Path,
     ide_paths: Dict[str, Dict[str, Path]],
@@ -358,12 +522,18 @@ def deploy_global_rules(
     
     print("\n📋 部署全域規則...")
     
-    for ide_name, paths in ide_paths.items():
-        rules_path = paths.get("global_rules")
-        if not rules_path:
-            continue
-        
-        ok, msg = copy_file_if_different(source_file, rules_path, dry_run)
+    targets = [(name, paths["global_rules"]) for name, paths in ide_paths.items() if paths.get("global_rules")]
+    
+    def copy_rules(target: Tuple[str, Path]) -> Tuple[bool, str]:
+        with span(target[0], kind="target", path=str(target[1])):
+            return copy_file_if_different(source_file, target[1], dry_run)
+    
+    with phase("部署全域規則"):
+        results = map_isolated(copy_rules, targets)
+    for (ide_name, _), (result, error) in zip(targets, results):
+        if error is not None or not result[0]:
+            count("targets_failed")
+        msg = result[1] if error is None else f"✗ 複製失敗: {error}"
         print(f"  {ide_name}: {msg}")
 
 
@@ -399,8 +569,24 @@ def list_deployed_workflows(ide_paths: Dict[str, Dict[str, Path]]) -> None:
     print("\n📋 已部署的 Workflows...")
     print("═" * 60)
     
+    marks = {"ok": "•", "modified": "⚠", "missing": "✗"}
+    notes = {"modified": " - 已被修改", "missing": " - 已不存在"}
+    
     for ide_name, paths in ide_paths.items():
         wf_dir = paths.get("global_workflows")
+        
+        # 有部署紀錄時直接依紀錄列出（只需 stat），不走訪目錄
+        manifest = load_manifest(f"workflows-{ide_name}")
+        entries = manifest.entries()
+        if entries:
+            print(f"\n🖥️  {ide_name}: ({len(entries)} 個 workflows，依部署紀錄)")
+            for target in sorted(entries):
+                path = Path(target)
+                state = manifest.status(path)
+                rel = path.relative_to(wf_dir) if wf_dir and wf_dir in path.parents else path.name
+                print(f"   {marks.get(state, '?')} {get_workflow_command_name(path)} ({rel}){notes.get(state, '')}")
+            continue
+        
         if not wf_dir or not wf_dir.exists():
             print(f"\n🖥️  {ide_name}: (無 workflows)")
             continue
@@ -418,36 +604,64 @@ def list_deployed_workflows(ide_paths: Dict[str, Dict[str, Path]]) -> None:
 # 清理功能
 # ============================================================================
 
+def _print_removals(results: List[Tuple[Path, str]]) -> int:
+    """輸出刪除結果，回傳已刪除（或 dry-run 將刪除）的檔案數"""
+    deleted = 0
+    for path, result in results:
+        if result == "removed":
+            print(f"  ✓ 已刪除: {path}")
+            deleted += 1
+        elif result == "dry-run":
+            print(f"  🔍 將刪除: {path}")
+            deleted += 1
+        elif result == "modified":
+            print(f"  ⚠ 已被修改，保留: {path}")
+        elif result != "missing":
+            print(f"  ✗ 無法刪除 {path}: {result}")
+    return deleted
+
+
 def clean_ide_workflows(
     ide_name: str,
     ide_paths: Dict[str, Path],
     dry_run: bool = False
 ) -> int:
-    """清理特定 IDE 的所有 workflows
+    """清理特定 IDE 中由本工具部署的 workflows
+    
+    只刪除部署紀錄中的檔案（使用者自行建立或已修改的檔案保留），依目錄分批刪除。
     
     Returns:
         已刪除的檔案數
     """
     wf_dir = ide_paths.get("global_workflows")
-    if not wf_dir or not wf_dir.exists():
+    if not wf_dir:
         return 0
     
-    workflows = list(wf_dir.rglob("*.md"))
-    deleted = 0
+    manifest = load_manifest(f"workflows-{ide_name}")
+    owned = manifest.owned(wf_dir)
+    if not owned:
+        print("  (無部署紀錄，未刪除任何檔案)")
+        return 0
     
-    for wf in workflows:
-        if dry_run:
-            print(f"  🔍 將刪除: {wf}")
-            deleted += 1
-        else:
-            try:
-                wf.unlink()
-                print(f"  ✓ 已刪除: {wf}")
-                deleted += 1
-            except Exception as e:
-                print(f"  ✗ 無法刪除 {wf}: {e}")
+    return _print_removals(remove_deployed(manifest, owned, dry_run))
+
+
+def prune_ide_workflows(
+    ide_name: str,
+    ide_paths: Dict[str, Path],
+    dry_run: bool = False
+) -> int:
+    """移除特定 IDE 中來源已刪除的 workflows（只處理本工具部署的檔案）
     
-    return deleted
+    Returns:
+        已刪除的檔案數
+    """
+    wf_dir = ide_paths.get("global_workflows")
+    if not wf_dir:
+        return 0
+    
+    manifest = load_manifest(f"workflows-{ide_name}")
+    return _print_removals(remove_deployed(manifest, manifest.orphans(wf_dir), dry_run))
 
 
 # ============================================================================
@@ -475,8 +689,20 @@ def main():
   # 檢查各 IDE 狀態
   python sync_workflows.py --status
 
-  # 清理特定 IDE 的 workflows
+  # 清理特定 IDE 中由本工具部署的 workflows
   python sync_workflows.py --clean --ide "Claude Code"
+
+  # 部署並移除來源已刪除的 workflows
+  python sync_workflows.py --deploy --prune
+
+  # 顯示各階段與檔案的耗時摘要，並輸出 JSON
+  python sync_workflows.py --deploy --timings
+
+  # 檢視近期部署的耗時趨勢與退步的執行
+  python sync_workflows.py --history
+
+  # 部署並輸出 node_exporter textfile 指標
+  python sync_workflows.py --deploy --metrics-file /var/lib/node_exporter/textfile/sync_workflows.prom
         """
     )
     
@@ -516,7 +742,13 @@ def main():
     parser.add_argument(
         '--clean',
         action='store_true',
-        help='清理指定 IDE 的 workflows'
+        help='清理指定 IDE 中由本工具部署的 workflows'
+    )
+    
+    parser.add_argument(
+        '--prune',
+        action='store_true',
+        help='移除來源已刪除的已部署 workflows（可與 --deploy 併用）'
     )
     
     parser.add_argument(
@@ -537,7 +769,59 @@ def main():
         help='同時部署全域規則 (global_rules.md)'
     )
     
+    parser.add_argument(
+        '--io-workers',
+        type=int,
+        default=DEFAULT_IO_WORKERS,
+        metavar='N',
+        help=f'同時進行檔案比對/寫入的執行緒數量 (預設: {DEFAULT_IO_WORKERS})'
+    )
+    parser.add_argument(
+        '--link-mode',
+        choices=LINK_MODES,
+        default='copy',
+        help='全域規則與 workflows 的部署方式：copy 複製、hardlink/symlink 直接連結來源'
+             '（在 IDE 中修改會改到來源）、reflink 與來源共用資料區塊 (預設: copy)'
+    )
+    parser.add_argument(
+        '--timings',
+        nargs='?',
+        const='',
+        metavar='FILE',
+        help='結束時顯示各階段與檔案的耗時、讀寫量，並將 JSON 寫入 FILE'
+             '（- 為標準輸出，此時其他輸出改到標準錯誤；未指定時寫入快取目錄的 timings/sync_workflows.json）'
+    )
+    parser.add_argument(
+        '--history',
+        nargs='?',
+        type=int,
+        const=20,
+        metavar='N',
+        help='顯示最近 N 次部署/清理的耗時與讀寫檔案數，並標示比近期中位數明顯退步的執行 (預設: 20)'
+    )
+    parser.add_argument(
+        '--metrics-file',
+        type=Path,
+        metavar='PATH',
+        help='--deploy / --clean / --prune 結束後以原子方式寫入 Prometheus textfile 指標（供 node_exporter 讀取）'
+    )
+    
     args = parser.parse_args()
+    if args.metrics_file and (args.history is not None or args.dry_run
+                              or not (args.deploy or args.clean or args.prune)):
+        parser.error('--metrics-file 只能搭配 --deploy、--clean 或 --prune（且不可為 --dry-run）')
+    if args.timings is not None:
+        enable_timings("sync_workflows.py", args.timings or None)
+    set_io_workers(args.io_workers)
+    set_link_mode(args.link_mode)
+    
+    if args.history is not None:
+        show_history("sync_workflows.py", args.history)
+        return
+    if not args.dry_run and (args.deploy or args.clean or args.prune):
+        mark_sync_run("+".join(k for k in ("clean", "prune", "deploy") if getattr(args, k)))
+        if args.metrics_file:
+            add_run_listener(lambda record: write_metrics_file(args.metrics_file, record))
     
     # 印出標題
     print_banner()
@@ -559,7 +843,9 @@ def main():
     
     # 探索來源 workflows
     print(f"\n📂 來源目錄: {args.source}")
-    workflows = discover_workflows(args.source)
+    with phase("探索 workflows"):
+        workflows = discover_workflows(args.source)
+    set_gauge("workflows", len(workflows))
     
     if not workflows:
         print("⚠ 未找到任何 workflow 檔案")
@@ -587,32 +873,40 @@ def main():
         for ide_name in targets:
             if ide_name in ide_paths:
                 print(f"\n清理 {ide_name}...")
-                deleted = clean_ide_workflows(ide_name, ide_paths[ide_name], args.dry_run)
+                with span(f"清理 {ide_name}", kind="target"):
+                    deleted = clean_ide_workflows(ide_name, ide_paths[ide_name], args.dry_run)
                 total_deleted += deleted
         
         print(f"\n✓ 共清理 {total_deleted} 個 workflow 檔案")
         return
     
+    # 移除來源已刪除的 workflows
+    if args.prune:
+        print("\n✂️  移除來源已刪除的 workflows" + (" (dry-run)" if args.dry_run else ""))
+        
+        targets = [args.ide] if args.ide != 'all' else list(ide_paths.keys())
+        total_pruned = sum(
+            prune_ide_workflows(ide_name, ide_paths[ide_name], args.dry_run)
+            for ide_name in targets if ide_name in ide_paths
+        )
+        print(f"✓ 共移除 {total_pruned} 個 workflow 檔案")
+        
+        if not args.deploy:
+            return
+    
     # 部署模式
     if args.deploy:
         print("\n🚀 部署模式" + (" (dry-run)" if args.dry_run else ""))
         
         targets = [args.ide] if args.ide != 'all' else list(ide_paths.keys())
         
-        total_success, total_skipped, total_failed = 0, 0, 0
-        
-        for ide_name in targets:
-            if ide_name in ide_paths:
-                s, sk, f = deploy_to_ide(
-                    ide_name,
-                    ide_paths[ide_name],
-                    workflows,
-                    dry_run=args.dry_run,
-                    verbose=args.verbose
-                )
-                total_success += s
-                total_skipped += sk
-                total_failed += f
+        total_success, total_skipped, total_failed = deploy_to_ides(
+            [name for name in targets if name in ide_paths],
+            ide_paths,
+            workflows,
+            dry_run=args.dry_run,
+            verbose=args.verbose
+        )
         
         # 部署全域規則
         if args.with_rules:
@@ -637,4 +931,5 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    with record_run("sync_workflows.py"), report_on_exit():
+        main()
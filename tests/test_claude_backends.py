@@ -0,0 +1,146 @@
+"""cli / file 兩種 Claude MCP 註冊後端對同一個 .claude.json 測試檔的行為。"""
+import json
+import sys
+import textwrap
+
+import pytest
+
+import sync_mcp
+
+# 以 Python 實作的假 claude 指令：只支援本工具使用的 mcp add / remove / list --json，
+# 直接改寫 $CLAUDE_CONFIG_DIR/.claude.json，並把每次呼叫記錄到同目錄的 calls.log（兼作檔案鎖）
+FAKE_CLAUDE = textwrap.dedent('''\
+    import fcntl, json, os, sys
+    from pathlib import Path
+
+    path = Path(os.environ["CLAUDE_CONFIG_DIR"]) / ".claude.json"
+    # 並行執行時依序處理，避免同時改寫測試檔
+    lock = open(path.parent / "calls.log", "a")
+    fcntl.flock(lock, fcntl.LOCK_EX)
+    lock.write(" ".join(sys.argv[1:]) + "\\n")
+    lock.flush()
+    data = json.loads(path.read_text()) if path.exists() else {}
+    servers = data.setdefault("mcpServers", {})
+    args = sys.argv[2:]
+    action = args.pop(0)
+    if action == "list":
+        print(json.dumps([{"name": name} for name in servers]))
+        sys.exit(0)
+    if action == "remove":
+        name = [a for a in args if a not in ("--scope", "user")][0]
+        if servers.pop(name, None) is None:
+            print(f"No MCP server found with name: {name}", file=sys.stderr)
+            sys.exit(1)
+    elif action == "add":
+        spec, positional, env, headers = {}, [], {}, {}
+        while args:
+            arg = args.pop(0)
+            if arg == "--":
+                spec = {"type": "stdio", "command": args[0], "args": args[1:], "env": env}
+                break
+            if arg in ("--scope", "--transport"):
+                args.pop(0)
+            elif arg == "-e":
+                key, _, value = args.pop(0).partition("=")
+                env[key] = value
+            elif arg == "--header":
+                key, _, value = args.pop(0).partition(":")
+                headers[key.strip()] = value.strip()
+            else:
+                positional.append(arg)
+        if len(positional) > 1:
+            spec = {"type": "http", "url": positional[1], "headers": headers}
+        if positional[0] in servers:
+            print(f"MCP server {positional[0]} already exists", file=sys.stderr)
+            sys.exit(1)
+        servers[positional[0]] = spec
+    path.write_text(json.dumps(data, indent=2))
+''')
+
+CONFIG = {
+    "mcpServers": {
+        "fetch": {"command": "uvx", "args": ["mcp-server-fetch"], "env": {"TOKEN": "secret"}},
+        "remote": {"serverUrl": "https://example.com/mcp", "headers": {"Authorization": "Bearer x"}},
+        "changed": {"command": "npx", "args": ["-y", "pkg@2"]},
+        "off": {"command": "npx", "args": ["off"], "disabled": True},
+    }
+}
+
+EXPECTED = {
+    "fetch": {"type": "stdio", "command": "uvx", "args": ["mcp-server-fetch"], "env": {"TOKEN": "secret"}},
+    "remote": {"type": "http", "url": "https://example.com/mcp", "headers": {"Authorization": "Bearer x"}},
+    "changed": {"type": "stdio", "command": "npx", "args": ["pkg@2"], "env": {}},
+}
+
+
+@pytest.fixture
+def claude_config(tmp_path):
+    """Claude 設定檔測試檔：含其他設定、一個已過時的定義與一個不在 mcp_config.json 的伺服器。"""
+    path = tmp_path / "claude" / ".claude.json"
+    path.parent.mkdir()
+    path.write_text(json.dumps({
+        "numStartups": 3,
+        "projects": {"/work": {"mcpServers": {}}},
+        "mcpServers": {
+            "changed": {"type": "stdio", "command": "npx", "args": ["pkg@1"], "env": {}},
+            "stale": {"type": "stdio", "command": "old", "args": [], "env": {}},
+        },
+    }))
+    return path
+
+
+@pytest.fixture(params=["cli", "file"])
+def backend(request, tmp_path, monkeypatch):
+    monkeypatch.setattr(sync_mcp, "CLAUDE_BACKEND", request.param)
+    monkeypatch.setattr(sync_mcp, "CLAUDE_INVENTORY", "auto")
+    if request.param == "cli":
+        script = tmp_path / "claude-fake"
+        script.write_text(f"#!{sys.executable}\n{FAKE_CLAUDE}")
+        script.chmod(0o755)
+        monkeypatch.setattr(sync_mcp, "CLAUDE_EXECUTABLE", str(script))
+    else:
+        # file 後端不應啟動任何 claude 程序
+        monkeypatch.setattr(sync_mcp, "CLAUDE_EXECUTABLE", str(tmp_path / "missing-claude"))
+    return request.param
+
+
+def test_sync_registers_new_and_changed_servers(backend, claude_config):
+    sync_mcp.sync_to_claude_cli(CONFIG, jobs=2, inventory=sync_mcp.ClaudeCliInventory())
+
+    data = json.loads(claude_config.read_text())
+    assert data["numStartups"] == 3
+    assert data["projects"] == {"/work": {"mcpServers": {}}}
+    assert data["mcpServers"] == {**EXPECTED, "stale": {"type": "stdio", "command": "old", "args": [], "env": {}}}
+    calls = claude_config.parent / "calls.log"
+    assert calls.exists() == (backend == "cli")
+
+
+def test_second_sync_does_not_touch_config(backend, claude_config):
+    sync_mcp.sync_to_claude_cli(CONFIG, inventory=sync_mcp.ClaudeCliInventory())
+    before = claude_config.stat().st_mtime_ns
+    calls = claude_config.parent / "calls.log"
+    logged = calls.read_text() if calls.exists() else ""
+
+    sync_mcp.sync_to_claude_cli(CONFIG, inventory=sync_mcp.ClaudeCliInventory())
+
+    assert claude_config.stat().st_mtime_ns == before
+    # cli 後端最多只查詢清單，不再 add / remove
+    new_calls = (calls.read_text() if calls.exists() else "")[len(logged):].splitlines()
+    assert all(call.startswith("mcp list") for call in new_calls)
+
+
+def test_prune_removes_servers_missing_from_config(backend, claude_config):
+    removed = sync_mcp.prune_claude_cli(CONFIG, inventory=sync_mcp.ClaudeCliInventory())
+
+    assert removed == ["stale"]
+    assert "stale" not in json.loads(claude_config.read_text())["mcpServers"]
+
+
+def test_file_backend_creates_private_config(backend, tmp_path):
+    if backend != "file":
+        pytest.skip("新建設定檔的權限由 claude 本身決定")
+    sync_mcp.sync_to_claude_cli(CONFIG, inventory=sync_mcp.ClaudeCliInventory())
+
+    path = tmp_path / "claude" / ".claude.json"
+    assert json.loads(path.read_text())["mcpServers"] == EXPECTED
+    assert path.stat().st_mode & 0o777 == 0o600
@@ -0,0 +1,80 @@
+"""以 --rollback 切換部署世代時，不可改到連結指向的來源，重新建立的目標只限本人讀寫。"""
+import stat
+
+import pytest
+
+import sync_io
+
+
+@pytest.fixture(autouse=True)
+def fresh_state(monkeypatch):
+    # 部署紀錄、世代變動與雜湊快取都是行程內的狀態，各測試分開
+    monkeypatch.setattr(sync_io, "_manifests", {})
+    monkeypatch.setattr(sync_io, "_generation_changes", None)
+    monkeypatch.setattr(sync_io, "_digest_cache", None)
+
+
+def deploy(src, dst, mode):
+    manifest = sync_io.load_manifest("workflows-Test")
+    sync_io.place_file(src, dst, mode)
+    manifest.record(dst, src)
+    manifest.save()
+    return sync_io.commit_generation("test deploy")
+
+
+def test_rollback_replaces_symlink_instead_of_writing_through(tmp_path):
+    src = tmp_path / "repo" / "workflows" / "docs-agent.md"
+    src.parent.mkdir(parents=True)
+    src.write_text("v1\n")
+    dst = tmp_path / "home" / ".windsurf" / "workflows" / "docs-agent.md"
+
+    first = deploy(src, dst, "copy")
+    # 尚未 commit 的修改，之後改以 symlink 部署
+    src.write_text("v2 uncommitted\n")
+    second = deploy(src, dst, "symlink")
+    assert (first, second) == (1, 2)
+    assert dst.is_symlink()
+
+    changed, problems = sync_io.switch_generation(first)
+
+    assert changed == [str(dst)]
+    assert problems == []
+    assert src.read_text() == "v2 uncommitted\n"
+    assert not dst.is_symlink()
+    assert dst.read_text() == "v1\n"
+
+
+def test_rollback_recreates_missing_target_private(tmp_path):
+    src = tmp_path / "rendered.json"
+    src.write_text('{"token": "secret"}\n')
+    src.chmod(0o600)
+    dst = tmp_path / "home" / ".cursor" / "mcp.json"
+
+    first = deploy(src, dst, "copy")
+    manifest = sync_io.load_manifest("workflows-Test")
+    dst.unlink()
+    manifest.forget(dst, removed=True)
+    manifest.save()
+    assert sync_io.commit_generation("test remove") == 2
+
+    changed, _ = sync_io.switch_generation(first)
+
+    assert changed == [str(dst)]
+    assert dst.read_text() == '{"token": "secret"}\n'
+    assert stat.S_IMODE(dst.stat().st_mode) == 0o600
+
+
+def test_rollback_keeps_mode_of_existing_target(tmp_path):
+    src = tmp_path / "global_rules.md"
+    src.write_text("rules v1\n")
+    dst = tmp_path / "home" / "rules.md"
+
+    first = deploy(src, dst, "copy")
+    src.write_text("rules v2\n")
+    deploy(src, dst, "copy")
+    dst.chmod(0o640)
+
+    sync_io.switch_generation(first)
+
+    assert dst.read_text() == "rules v1\n"
+    assert stat.S_IMODE(dst.stat().st_mode) == 0o640
@@ -0,0 +1,44 @@
+"""常駐程序中共用的部署紀錄在其他行程改寫 manifest 檔後需重新讀取。"""
+import pytest
+
+import sync_io
+
+
+@pytest.fixture(autouse=True)
+def fresh_state(monkeypatch):
+    monkeypatch.setattr(sync_io, "_manifests", {})
+    monkeypatch.setattr(sync_io, "_generation_changes", None)
+    monkeypatch.setattr(sync_io, "_digest_cache", None)
+
+
+def test_changed_manifest_is_reloaded(tmp_path):
+    old, new = tmp_path / "old.md", tmp_path / "new.md"
+    old.write_text("old\n")
+    new.write_text("new\n")
+    cached = sync_io.load_manifest("workflows-Windsurf")
+    cached.record(old)
+    cached.save()
+
+    # 另一個行程（例如 sync_workflows.py --prune 後再 --deploy）改寫了同一個 manifest 檔
+    other = sync_io.DeployManifest("workflows-Windsurf")
+    other.forget(old)
+    other.record(new)
+    other.save()
+
+    sync_io.forget_changed_manifests()
+    reloaded = sync_io.load_manifest("workflows-Windsurf")
+
+    assert reloaded is not cached
+    assert set(reloaded.entries()) == {str(new)}
+
+
+def test_unchanged_manifest_stays_cached(tmp_path):
+    target = tmp_path / "a.md"
+    target.write_text("a\n")
+    cached = sync_io.load_manifest("rules")
+    cached.record(target)
+    cached.save()
+
+    sync_io.forget_changed_manifests()
+
+    assert sync_io.load_manifest("rules") is cached